@@ -0,0 +1,349 @@
+import csv
+import hashlib
+import json
+import logging
+import math
+import time
+from collections import Counter, defaultdict
+from itertools import islice
+
+from bson import ObjectId
+from django.conf import settings
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from apps.search.catalog import derived_fields, menu_ordinals
+from apps.search.db import food_items_collection
+from apps.search.generation import bump_catalog_generation
+
+logger = logging.getLogger(__name__)
+
+"""
+Bulk import of food items from the nutrition CSV export.
+
+The CSV is streamed row by row. Rows are validated and converted to
+meals_fooditem documents, and the documents are written in unordered
+insert_many batches of FOOD_IMPORT_BATCH_SIZE, so that a full load takes one
+round trip per batch instead of one per row. Writes bypass the Django models,
+so the FoodItem signals do not fire; the food catalog generation is bumped once
+after the import instead.
+
+Each document keeps the CSV's menu_item_id and a content_hash of its imported
+fields. sync_food_items() uses them to make re-imports incremental: rows are
+matched to documents by menu_item_id, only the rows that are new or whose hash
+changed are written, as unordered bulk_write upserts, and items missing from
+the CSV can be deleted. It reports the restaurants whose items changed.
+
+Documents also carry the derived fields the search catalog reads (see
+apps/search/catalog.py). Those of a single item are set with the row; menu
+ordinals rank the items of a whole restaurant, so update_derived_fields()
+recomputes them for the restaurants an import touched, after its writes.
+"""
+
+# CSV column of each numeric FoodItem field
+NUMERIC_COLUMNS = {
+    "calories": "calories",
+    "protein": "protein",
+    "carbohydrates": "carbohydrates",
+    "fats": "total_fat",
+}
+# Document fields covered by the content hash
+HASHED_FIELDS = ("item_name", "restaurant", "food_category", "calories", "protein", "carbohydrates", "fats")
+# Fields read to compute the derived fields of a restaurant's items
+DERIVED_PROJECTION = {
+    "restaurant": 1, "food_category": 1, "calories": 1, "protein": 1, "carbohydrates": 1, "fats": 1,
+    "category_key": 1, "role": 1, "calorie_density": 1, "menu_ordinal": 1, "derived_version": 1,
+}
+
+
+class ImportStats:
+    """Counters of an import run."""
+
+    def __init__(self):
+        self.rows = 0
+        self.imported = 0
+        self.batches = 0
+        self.deleted = 0
+        self.added = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.derived = 0
+        self.changed_restaurants = set()
+        self.skipped = Counter()
+        self.started_at = time.monotonic()
+        self.elapsed = 0.0
+
+    def finish(self):
+        self.elapsed = time.monotonic() - self.started_at
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    def _skipped_summary(self):
+        reasons = ", ".join(f"{reason}: {count}" for reason, count in self.skipped.most_common())
+        return f"skipped {sum(self.skipped.values())}" + (f" ({reasons})" if reasons else "")
+
+    def summary(self):
+        return (
+            f"Imported {self.imported} of {self.rows} rows in {self.batches} batches in {self.elapsed:.2f} seconds "
+            f"({self.rows_per_second:.0f} rows/s), derived fields of {self.derived} items updated; "
+            f"{self._skipped_summary()}"
+        )
+
+    def sync_summary(self):
+        return (
+            f"Synced {self.rows} rows in {self.elapsed:.2f} seconds ({self.rows_per_second:.0f} rows/s): "
+            f"{self.added} added, {self.updated} updated, {self.unchanged} unchanged, {self.deleted} deleted, "
+            f"{len(self.changed_restaurants)} restaurants changed, derived fields of {self.derived} items updated; "
+            f"{self._skipped_summary()}"
+        )
+
+
+def _number(row, column):
+    value = (row.get(column) or "").strip()
+    if not value:
+        return 0.0
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError(f"{column} is not a finite number")
+    return number
+
+
+def content_hash(document):
+    """Return a hex digest of the HASHED_FIELDS of a document."""
+    content = json.dumps([document.get(field) for field in HASHED_FIELDS], separators=(",", ":"))
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+
+def food_item_document(row):
+    """
+    Convert a CSV row to a meals_fooditem document.
+
+    Args:
+        row (dict): Row read by csv.DictReader
+
+    Returns:
+        dict: The document, with the same ObjectId as _id and id, menu_item_id when the row has one, and
+            every derived field but menu_ordinal
+
+    Raises:
+        ValueError: When the row has no item_name or a field is not a number; the message is the skip reason
+    """
+    item_name = (row.get("item_name") or "").strip()
+    if not item_name:
+        raise ValueError("missing item_name")
+
+    document = {
+        "item_name": item_name,
+        "restaurant": (row.get("restaurant") or "").strip(),
+        "food_category": (row.get("food_category") or "").strip(),
+    }
+    for field, column in NUMERIC_COLUMNS.items():
+        try:
+            document[field] = _number(row, column)
+        except ValueError:
+            raise ValueError(f"invalid {column}")
+    document["content_hash"] = content_hash(document)
+    document.update(derived_fields(document))
+
+    menu_item_id = (row.get("menu_item_id") or "").strip()
+    if menu_item_id:
+        document["menu_item_id"] = menu_item_id
+
+    item_id = ObjectId()
+    document["_id"] = item_id
+    document["id"] = item_id
+    return document
+
+
+def read_food_items(rows, stats):
+    """Yield the document of each valid row, counting the skipped ones by reason in stats."""
+    for row in rows:
+        stats.rows += 1
+        try:
+            yield food_item_document(row)
+        except ValueError as e:
+            stats.skipped[str(e)] += 1
+
+
+def chunked(iterable, size):
+    """Yield lists of up to size consecutive items."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def insert_batch(collection, documents, stats):
+    """Insert a batch without stopping at failed documents, counting the failures as skipped rows."""
+    stats.batches += 1
+    try:
+        stats.imported += len(collection.insert_many(documents, ordered=False).inserted_ids)
+    except BulkWriteError as e:
+        stats.imported += e.details.get("nInserted", 0)
+        stats.skipped["write error"] += len(e.details.get("writeErrors", []))
+
+
+def write_batch(collection, requests, stats):
+    """Apply a batch of write requests without stopping at failed ones, counting the failures as skipped rows."""
+    stats.batches += 1
+    try:
+        collection.bulk_write(requests, ordered=False)
+    except BulkWriteError as e:
+        stats.skipped["write error"] += len(e.details.get("writeErrors", []))
+
+
+def update_derived_fields(collection, restaurants=None, batch_size=None, stats=None):
+    """
+    Recompute the derived fields of the items of some restaurants and write the ones that differ.
+
+    Args:
+        collection (Collection): meals_fooditem collection
+        restaurants (iterable): Restaurants to update, or None for every item
+        batch_size (int): Writes per bulk_write, defaults to FOOD_IMPORT_BATCH_SIZE
+        stats (ImportStats): Counters to add the updated items and write errors to
+
+    Returns:
+        ImportStats: The counters
+    """
+    batch_size = batch_size or getattr(settings, "FOOD_IMPORT_BATCH_SIZE", 1000)
+    stats = stats if stats is not None else ImportStats()
+    query = {} if restaurants is None else {"restaurant": {"$in": sorted(restaurants)}}
+
+    by_restaurant = defaultdict(list)
+    for document in collection.find(query, DERIVED_PROJECTION).sort("_id", 1):
+        by_restaurant[document.get("restaurant") or ""].append(document)
+
+    def changes():
+        for documents in by_restaurant.values():
+            fields = [derived_fields(document) for document in documents]
+            for document, item_fields, ordinal in zip(documents, fields, menu_ordinals(fields)):
+                item_fields["menu_ordinal"] = ordinal
+                changed = {field: value for field, value in item_fields.items() if document.get(field) != value}
+                if changed:
+                    yield UpdateOne({"_id": document["_id"]}, {"$set": changed})
+
+    for batch in chunked(changes(), batch_size):
+        write_batch(collection, batch, stats)
+        stats.derived += len(batch)
+    return stats
+
+
+def import_food_items(csv_path, batch_size=None, replace=False, collection=None):
+    """
+    Import every valid row of a CSV file into meals_fooditem.
+
+    Args:
+        csv_path (str): Path of the CSV file
+        batch_size (int): Documents per insert_many, defaults to FOOD_IMPORT_BATCH_SIZE
+        replace (bool): Delete every existing food item first, for a full reload
+        collection (Collection): Target collection, defaults to meals_fooditem
+
+    Returns:
+        ImportStats: Counters of the run
+    """
+    batch_size = batch_size or getattr(settings, "FOOD_IMPORT_BATCH_SIZE", 1000)
+    collection = collection if collection is not None else food_items_collection()
+    stats = ImportStats()
+
+    try:
+        if replace:
+            stats.deleted = collection.delete_many({}).deleted_count
+        with open(csv_path, newline="", encoding="utf-8") as csv_file:
+            for batch in chunked(read_food_items(csv.DictReader(csv_file), stats), batch_size):
+                stats.changed_restaurants.update(document["restaurant"] for document in batch)
+                insert_batch(collection, batch, stats)
+        update_derived_fields(collection, None if replace else stats.changed_restaurants, batch_size, stats)
+    finally:
+        stats.finish()
+        if stats.imported or stats.deleted:
+            bump_catalog_generation()
+
+    logger.info(stats.summary())
+    return stats
+
+
+def sync_food_items(csv_path, batch_size=None, delete_missing=False, collection=None):
+    """
+    Bring meals_fooditem in line with a CSV file, writing only the rows that are new or changed.
+
+    Rows are matched to documents by menu_item_id; rows without one are skipped, and so are
+    later rows repeating a menu_item_id. Documents without a menu_item_id are left alone.
+
+    Args:
+        csv_path (str): Path of the CSV file
+        batch_size (int): Writes per bulk_write, defaults to FOOD_IMPORT_BATCH_SIZE
+        delete_missing (bool): Delete the items whose menu_item_id is no longer in the CSV
+        collection (Collection): Target collection, defaults to meals_fooditem
+
+    Returns:
+        ImportStats: Counters of the run, with the restaurants whose items changed
+    """
+    batch_size = batch_size or getattr(settings, "FOOD_IMPORT_BATCH_SIZE", 1000)
+    collection = collection if collection is not None else food_items_collection()
+    stats = ImportStats()
+
+    existing = {
+        document["menu_item_id"]: document
+        for document in collection.find(
+            {"menu_item_id": {"$type": "string"}}, {"menu_item_id": 1, "content_hash": 1, "restaurant": 1}
+        )
+    }
+    seen = set()
+
+    def changes(documents):
+        for document in documents:
+            menu_item_id = document.get("menu_item_id")
+            if menu_item_id is None:
+                stats.skipped["missing menu_item_id"] += 1
+                continue
+            if menu_item_id in seen:
+                stats.skipped["duplicate menu_item_id"] += 1
+                continue
+            seen.add(menu_item_id)
+
+            current = existing.get(menu_item_id)
+            if current is not None and current.get("content_hash") == document["content_hash"]:
+                stats.unchanged += 1
+                continue
+
+            if current is None:
+                stats.added += 1
+            else:
+                stats.updated += 1
+                stats.changed_restaurants.add(current.get("restaurant"))
+            stats.changed_restaurants.add(document["restaurant"])
+            item_id = document.pop("_id")
+            document.pop("id")
+            # The restaurant's menu ordinals are recomputed once every row is written
+            yield UpdateOne(
+                {"menu_item_id": menu_item_id},
+                {"$set": document, "$unset": {"menu_ordinal": ""}, "$setOnInsert": {"_id": item_id, "id": item_id}},
+                upsert=True,
+            )
+
+    try:
+        with open(csv_path, newline="", encoding="utf-8") as csv_file:
+            for batch in chunked(changes(read_food_items(csv.DictReader(csv_file), stats)), batch_size):
+                write_batch(collection, batch, stats)
+
+        if delete_missing:
+            missing = [menu_item_id for menu_item_id in existing if menu_item_id not in seen]
+            for menu_item_id in missing:
+                stats.changed_restaurants.add(existing[menu_item_id].get("restaurant"))
+            for chunk in chunked(missing, batch_size):
+                stats.deleted += collection.delete_many({"menu_item_id": {"$in": chunk}}).deleted_count
+
+        stats.changed_restaurants.discard(None)
+        if stats.changed_restaurants:
+            update_derived_fields(collection, stats.changed_restaurants, batch_size, stats)
+    finally:
+        stats.finish()
+        if stats.added or stats.updated or stats.deleted:
+            bump_catalog_generation()
+
+    logger.info(stats.sync_summary())
+    return stats
@@ -0,0 +1,66 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.meals.importer import import_food_items, sync_food_items, update_derived_fields
+from apps.search.db import food_items_collection
+from apps.search.generation import bump_catalog_generation
+
+DEFAULT_CSV_PATH = "data/Test Data MoD - RealData MoD.csv"
+
+
+class Command(BaseCommand):
+    help = "Import food items from a nutrition CSV export with batched writes, or sync them by menu_item_id."
+
+    def add_arguments(self, parser):
+        parser.add_argument("csv_path", nargs="?", default=DEFAULT_CSV_PATH, help="CSV file to import.")
+        parser.add_argument(
+            "--batch-size", type=int, default=None,
+            help="Writes per batch (defaults to FOOD_IMPORT_BATCH_SIZE).",
+        )
+        parser.add_argument(
+            "--replace", action="store_true",
+            help="Delete every existing food item before importing, for a full reload.",
+        )
+        parser.add_argument(
+            "--sync", action="store_true",
+            help="Upsert by menu_item_id, writing only the rows that are new or changed since the last import.",
+        )
+        parser.add_argument(
+            "--delete-missing", action="store_true",
+            help="With --sync, delete the items whose menu_item_id is no longer in the CSV.",
+        )
+        parser.add_argument(
+            "--refresh-derived", action="store_true",
+            help="Only recompute the derived fields of every stored item, e.g. after DERIVED_FIELDS_VERSION changed.",
+        )
+
+    def handle(self, *args, **options):
+        if options["batch_size"] is not None and options["batch_size"] < 1:
+            raise CommandError("--batch-size must be at least 1")
+        if options["sync"] and options["replace"]:
+            raise CommandError("--sync and --replace cannot be combined")
+        if options["delete_missing"] and not options["sync"]:
+            raise CommandError("--delete-missing requires --sync")
+
+        if options["refresh_derived"]:
+            stats = update_derived_fields(food_items_collection(), batch_size=options["batch_size"])
+            if stats.derived:
+                bump_catalog_generation()
+            self.stdout.write(self.style.SUCCESS(f"Updated the derived fields of {stats.derived} food items"))
+            return
+
+        try:
+            if options["sync"]:
+                stats = sync_food_items(options["csv_path"], options["batch_size"], options["delete_missing"])
+            else:
+                stats = import_food_items(options["csv_path"], options["batch_size"], options["replace"])
+        except FileNotFoundError:
+            raise CommandError(f"CSV file not found: {options['csv_path']}")
+
+        if options["sync"]:
+            for restaurant in sorted(stats.changed_restaurants):
+                self.stdout.write(f"Changed: {restaurant}")
+            self.stdout.write(self.style.SUCCESS(stats.sync_summary()))
+            return
+        if stats.deleted:
+            self.stdout.write(f"Deleted {stats.deleted} existing food items")
+        self.stdout.write(self.style.SUCCESS(stats.summary()))
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.18 on 2026-10-17 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('meals', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fooditem',
+            name='content_hash',
+            field=models.CharField(blank=True, default=None, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='fooditem',
+            name='menu_item_id',
+            field=models.CharField(blank=True, default=None, max_length=64, null=True),
+        ),
+    ]
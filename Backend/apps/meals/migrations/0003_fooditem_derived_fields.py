@@ -0,0 +1,38 @@
+# Generated by Django 3.2.18 on 2026-10-17 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('meals', '0002_fooditem_menu_item_id_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fooditem',
+            name='calorie_density',
+            field=models.FloatField(blank=True, default=None, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='fooditem',
+            name='category_key',
+            field=models.CharField(blank=True, default=None, editable=False, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='fooditem',
+            name='derived_version',
+            field=models.SmallIntegerField(blank=True, default=None, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='fooditem',
+            name='menu_ordinal',
+            field=models.IntegerField(blank=True, default=None, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='fooditem',
+            name='role',
+            field=models.SmallIntegerField(blank=True, default=None, editable=False, null=True),
+        ),
+    ]
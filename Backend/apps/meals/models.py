@@ -12,6 +12,16 @@ class FoodItem(models.Model):
     carbohydrates = models.FloatField(default=0)
     fats = models.FloatField(default=0)
 
+    # Source row of the item in the nutrition CSV, and a hash of its imported fields (see apps/meals/importer.py)
+    menu_item_id = models.CharField(max_length=64, null=True, blank=True, default=None)
+    content_hash = models.CharField(max_length=64, null=True, blank=True, default=None)
+    # Derived from the fields above by the importer and read by the search catalog (see apps/search/catalog.py)
+    category_key = models.CharField(max_length=255, null=True, blank=True, default=None, editable=False)
+    role = models.SmallIntegerField(null=True, blank=True, default=None, editable=False)
+    calorie_density = models.FloatField(null=True, blank=True, default=None, editable=False)
+    menu_ordinal = models.IntegerField(null=True, blank=True, default=None, editable=False)
+    derived_version = models.SmallIntegerField(null=True, blank=True, default=None, editable=False)
+
     def __str__(self):
         return self.item_name
 
@@ -1,3 +1,149 @@
-from django.test import TestCase
+import os
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.test import SimpleTestCase
+from pymongo.errors import BulkWriteError
+
+from apps.search.catalog import ROLE_DESSERT, ROLE_ENTREE, ROLE_EXCLUDED, ROLE_SIDE
+
+from . import importer
+
+CSV_HEADER = "menu_item_id,food_category,restaurant,item_name,calories,total_fat,carbohydrates,protein\n"
+
+
+class FoodItemImportTests(SimpleTestCase):
+    """The CSV importer writes valid rows in unordered batches and counts the skipped ones"""
+
+    def write_csv(self, lines):
+        handle, path = tempfile.mkstemp(suffix=".csv")
+        with os.fdopen(handle, "w", encoding="utf-8") as csv_file:
+            csv_file.write(CSV_HEADER + "".join(lines))
+        self.addCleanup(os.remove, path)
+        return path
+
+    def import_csv(self, path, collection, **kwargs):
+        with mock.patch.object(importer, "bump_catalog_generation") as bump:
+            stats = importer.import_food_items(path, collection=collection, **kwargs)
+        return stats, bump
+
+    def test_rows_are_converted_and_batched(self):
+        path = self.write_csv(
+            [f"{i},Burgers,Restaurant {i % 2}, Burger {i} ,{500 + i},20,40.5,\n" for i in range(5)]
+            + [",Burgers,Restaurant 0,,500,20,40,30\n", "9,Burgers,Restaurant 0,Bad,lots,20,40,30\n"]
+        )
+        collection = mock.MagicMock()
+        collection.insert_many.side_effect = lambda documents, ordered: mock.Mock(
+            inserted_ids=[document["_id"] for document in documents]
+        )
+
+        stats, bump = self.import_csv(path, collection, batch_size=2)
+
+        self.assertEqual((stats.rows, stats.imported, stats.batches), (7, 5, 3))
+        self.assertEqual(stats.skipped, {"missing item_name": 1, "invalid calories": 1})
+        documents = [document for call in collection.insert_many.call_args_list for document in call.args[0]]
+        self.assertTrue(all(call.kwargs["ordered"] is False for call in collection.insert_many.call_args_list))
+        first = documents[0]
+        self.assertEqual(first["_id"], first["id"])
+        expected = {
+            "menu_item_id": "0", "item_name": "Burger 0", "restaurant": "Restaurant 0", "food_category": "Burgers",
+            "calories": 500.0, "protein": 0.0, "carbohydrates": 40.5, "fats": 20.0,
+            "category_key": "burgers", "role": ROLE_ENTREE, "calorie_density": 500.0 / 60.5,
+        }
+        self.assertEqual({key: first[key] for key in expected}, expected)
+        self.assertNotIn("menu_ordinal", first)
+        collection.find.assert_called_once_with(
+            {"restaurant": {"$in": ["Restaurant 0", "Restaurant 1"]}}, importer.DERIVED_PROJECTION
+        )
+        bump.assert_called_once_with()
+        collection.delete_many.assert_not_called()
+
+    def test_write_errors_are_counted(self):
+        path = self.write_csv([f"{i},Salads,Restaurant,Salad {i},100,1,2,3\n" for i in range(3)])
+        collection = mock.MagicMock()
+        collection.delete_many.return_value.deleted_count = 4
+        collection.insert_many.side_effect = BulkWriteError({"nInserted": 2, "writeErrors": [{"index": 1}]})
+
+        stats, bump = self.import_csv(path, collection, replace=True)
+
+        self.assertEqual((stats.deleted, stats.imported, stats.skipped["write error"]), (4, 2, 1))
+        collection.delete_many.assert_called_once_with({})
+        bump.assert_called_once_with()
+
+    def test_sync_writes_only_changes(self):
+        path = self.write_csv([
+            "1,Burgers,Restaurant A,Burger,500,20,40,30\n",
+            "2,Salads,Restaurant B,Salad,150,5,10,4\n",
+            "3,Desserts,Restaurant C,Cookie,200,9,30,2\n",
+            "3,Desserts,Restaurant C,Cookie again,200,9,30,2\n",
+            ",Desserts,Restaurant C,No id,200,9,30,2\n",
+        ])
+        burger = importer.food_item_document(
+            {"menu_item_id": "1", "food_category": "Burgers", "restaurant": "Restaurant A", "item_name": "Burger",
+             "calories": "500", "total_fat": "20", "carbohydrates": "40", "protein": "30"}
+        )
+        collection = mock.MagicMock()
+        collection.find.return_value.__iter__.return_value = iter([
+            {"menu_item_id": "1", "content_hash": burger["content_hash"], "restaurant": "Restaurant A"},
+            {"menu_item_id": "2", "content_hash": "old", "restaurant": "Restaurant D"},
+            {"menu_item_id": "4", "content_hash": "gone", "restaurant": "Restaurant E"},
+        ])
+        collection.find.return_value.sort.return_value = []
+        collection.delete_many.return_value.deleted_count = 1
+
+        with mock.patch.object(importer, "bump_catalog_generation") as bump:
+            stats = importer.sync_food_items(path, collection=collection, delete_missing=True)
+
+        self.assertEqual((stats.added, stats.updated, stats.unchanged, stats.deleted), (1, 1, 1, 1))
+        self.assertEqual(stats.skipped, {"duplicate menu_item_id": 1, "missing menu_item_id": 1})
+        self.assertEqual(
+            stats.changed_restaurants, {"Restaurant B", "Restaurant C", "Restaurant D", "Restaurant E"}
+        )
+        requests = collection.bulk_write.call_args.args[0]
+        self.assertEqual([request._filter for request in requests], [{"menu_item_id": "2"}, {"menu_item_id": "3"}])
+        update = requests[0]._doc
+        self.assertEqual(update["$set"]["item_name"], "Salad")
+        self.assertEqual(update["$set"]["role"], ROLE_SIDE)
+        self.assertEqual(update["$unset"], {"menu_ordinal": ""})
+        self.assertNotIn("_id", update["$set"])
+        self.assertEqual(update["$setOnInsert"]["_id"], update["$setOnInsert"]["id"])
+        collection.delete_many.assert_called_once_with({"menu_item_id": {"$in": ["4"]}})
+        self.assertEqual(
+            collection.find.call_args.args[0]["restaurant"]["$in"],
+            ["Restaurant B", "Restaurant C", "Restaurant D", "Restaurant E"],
+        )
+        bump.assert_called_once_with()
+
+    def test_content_hash_ignores_identity(self):
+        row = {"menu_item_id": "1", "item_name": "Burger", "restaurant": "A", "calories": "500"}
+        first, second = importer.food_item_document(row), importer.food_item_document(row)
+        self.assertNotEqual(first["_id"], second["_id"])
+        self.assertEqual(first["content_hash"], second["content_hash"])
+        changed = importer.food_item_document({**row, "calories": "501"})
+        self.assertNotEqual(first["content_hash"], changed["content_hash"])
+
+    def test_derived_fields_rank_each_restaurant(self):
+        documents = [
+            {"_id": 1, "restaurant": "A", "food_category": "Desserts", "calories": 300, "protein": 5, "fats": 15},
+            {"_id": 2, "restaurant": "A", "food_category": "Burgers", "calories": 600, "protein": 30, "fats": 30},
+            {"_id": 3, "restaurant": "A", "food_category": "Burgers", "calories": 240, "protein": 30},
+            {"_id": 4, "restaurant": "A", "food_category": "Beverages", "calories": 0},
+            {"_id": 5, "restaurant": "B", "food_category": " Burgers ", "calories": 400, "protein": 20},
+        ]
+        documents[4].update(importer.derived_fields(documents[4]), menu_ordinal=0)
+        collection = mock.MagicMock()
+        collection.find.return_value.sort.return_value = documents
+
+        stats = importer.update_derived_fields(collection)
+
+        collection.find.assert_called_once_with({}, importer.DERIVED_PROJECTION)
+        collection.find.return_value.sort.assert_called_once_with("_id", 1)
+        updates = {request._filter["_id"]: request._doc["$set"] for request in collection.bulk_write.call_args.args[0]}
+        self.assertEqual(stats.derived, 4)
+        self.assertEqual(sorted(updates), [1, 2, 3, 4])
+        self.assertEqual(
+            [(updates[item_id]["role"], updates[item_id]["menu_ordinal"]) for item_id in (3, 2, 1, 4)],
+            [(ROLE_ENTREE, 0), (ROLE_ENTREE, 1), (ROLE_DESSERT, 2), (ROLE_EXCLUDED, 3)],
+        )
+        self.assertEqual(updates[4]["calorie_density"], float("inf"))
+        self.assertEqual(documents[4]["category_key"], "burgers")
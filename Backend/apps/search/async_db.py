@@ -0,0 +1,143 @@
+import asyncio
+import functools
+import logging
+import os
+import threading
+
+from django.conf import settings
+
+from .db import (
+    CATALOG_META_COLLECTION, FOOD_ITEMS_COLLECTION, MEALS_COLLECTION, SEARCH_CACHE_COLLECTION, SEARCH_LOCKS_COLLECTION,
+    get_database,
+)
+
+try:
+    from motor.motor_asyncio import AsyncIOMotorClient
+except ImportError:
+    # Motor 2.x, the release line for pymongo 3, does not import on Python 3.11+
+    AsyncIOMotorClient = None
+
+logger = logging.getLogger(__name__)
+
+"""
+Non-blocking MongoDB access for the async search views.
+
+The async counterpart of db.py: one pooled Motor client, created on first use
+with the same MONGODB_* pool and timeout settings. Motor clients are bound to
+the event loop they are created on, so a client is kept per process and per
+loop; uvicorn runs one loop per worker, so in practice each worker holds one
+client next to the pymongo client used by the synchronous code.
+
+Where Motor cannot be imported, the accessors return ThreadedCollection
+wrappers around the pymongo collections instead: the same awaitable methods,
+each running the pymongo call on the loop's default executor, so the event loop
+still never blocks on the database.
+"""
+
+_client = None
+_client_loop = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_async_client():
+    """Return the Motor client of the running event loop, creating it on first use."""
+    global _client, _client_loop, _client_pid
+    loop = asyncio.get_running_loop()
+    if _client is not None and _client_loop is loop and _client_pid == os.getpid():
+        return _client
+
+    with _client_lock:
+        if _client is None or _client_loop is not loop or _client_pid != os.getpid():
+            if _client is not None and _client_pid == os.getpid():
+                _client.close()
+            _client = AsyncIOMotorClient(
+                settings.DATABASES["default"]["CLIENT"]["host"],
+                maxPoolSize=getattr(settings, "MONGODB_MAX_POOL_SIZE", 100),
+                minPoolSize=getattr(settings, "MONGODB_MIN_POOL_SIZE", 0),
+                maxIdleTimeMS=getattr(settings, "MONGODB_MAX_IDLE_TIME_MS", None),
+                serverSelectionTimeoutMS=getattr(settings, "MONGODB_SERVER_SELECTION_TIMEOUT_MS", 30000),
+                connectTimeoutMS=getattr(settings, "MONGODB_CONNECT_TIMEOUT_MS", 20000),
+                socketTimeoutMS=getattr(settings, "MONGODB_SOCKET_TIMEOUT_MS", None),
+                io_loop=loop,
+            )
+            _client_loop = loop
+            _client_pid = os.getpid()
+        return _client
+
+
+class ThreadedCursor:
+    """Stand-in for a Motor cursor: to_list() runs the pymongo find on the default executor."""
+
+    def __init__(self, collection, args, kwargs):
+        self._collection = collection
+        self._args = args
+        self._kwargs = kwargs
+
+    def _fetch(self, length):
+        cursor = self._collection.find(*self._args, **self._kwargs)
+        if length is not None:
+            cursor = cursor.limit(length)
+        return list(cursor)
+
+    async def to_list(self, length):
+        return await asyncio.get_running_loop().run_in_executor(None, self._fetch, length)
+
+
+class ThreadedCollection:
+    """
+    Stand-in for a Motor collection when Motor is not available: every method of
+    the wrapped pymongo collection returns an awaitable running it on the
+    default executor, and find() returns a ThreadedCursor.
+    """
+
+    def __init__(self, collection):
+        self._collection = collection
+        self.full_name = collection.full_name
+
+    def find(self, *args, **kwargs):
+        return ThreadedCursor(self._collection, args, kwargs)
+
+    def __getattr__(self, name):
+        method = getattr(self._collection, name)
+
+        async def call(*args, **kwargs):
+            return await asyncio.get_running_loop().run_in_executor(None, functools.partial(method, *args, **kwargs))
+        return call
+
+
+class ThreadedDatabase:
+    """Stand-in for a Motor database, handing out ThreadedCollection wrappers."""
+
+    def __init__(self, database):
+        self._database = database
+
+    def __getitem__(self, name):
+        return ThreadedCollection(self._database[name])
+
+
+def get_async_database():
+    """Return the application database on the Motor client, or its threaded stand-in without Motor."""
+    if AsyncIOMotorClient is None:
+        return ThreadedDatabase(get_database())
+    return get_async_client()[settings.DATABASES["default"]["NAME"]]
+
+
+def async_food_items_collection():
+    return get_async_database()[FOOD_ITEMS_COLLECTION]
+
+
+def async_search_cache_collection():
+    return get_async_database()[SEARCH_CACHE_COLLECTION]
+
+
+def async_meals_collection():
+    return get_async_database()[MEALS_COLLECTION]
+
+
+def async_catalog_meta_collection():
+    return get_async_database()[CATALOG_META_COLLECTION]
+
+
+def async_search_locks_collection():
+    return get_async_database()[SEARCH_LOCKS_COLLECTION]
@@ -0,0 +1,260 @@
+import asyncio
+import functools
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from .async_db import async_food_items_collection, async_meals_collection, async_search_cache_collection
+from .buckets import filter_meals
+from .cache import meal_options_cache
+from .catalog import CATALOG_PROJECTION, FoodCatalog, cached_catalog, install_catalog
+from .generation import async_current_generation
+from .persistent_cache import async_ensure_cache_indexes, cache_document, document_partitions
+from .rank_meals import get_top_ranked_meals, get_top_ranked_meals_by_restaurant
+from .refresh import refresh_in_task
+from .script import enumerate_meal_options, load_catalog, lookup_meal_options, resolve_search
+from .singleflight import AsyncSingleFlight, async_distributed_search_lock, async_meal_searches
+
+logger = logging.getLogger(__name__)
+
+"""
+Meal search for the async views.
+
+Follows the same steps as script.check_meal_options. The catalog generation
+poll, the catalog load, the search_cache documents and saved meals go through
+the Motor client and are awaited on the event loop. The CPU-bound steps (cache
+filtering, enumeration, packing) run on a thread pool of
+SEARCH_ASYNC_EXECUTOR_WORKERS threads. The process-wide catalog is loaded
+asynchronously before the steps run, and concurrent searches that need a newer
+catalog share one load.
+
+The pool steps reuse the synchronous search code, so their threads can still
+make blocking pymongo calls. The generation poll is shared with
+current_generation(), so a step polls again only when SEARCH_CATALOG_POLL_SECONDS
+have passed since the awaited poll. A step then loads the catalog itself if that
+poll found a newer generation. With SEARCH_USE_CATALOG off, every search reads
+its candidate items synchronously. Only the event loop is guaranteed never to
+block on the database; a pool thread may wait on it.
+"""
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+# Catalog loads in progress, by generation
+_catalog_loads = AsyncSingleFlight()
+
+
+def search_executor():
+    """Return the thread pool the async views run CPU-bound search steps on."""
+    global _executor, _executor_pid
+    if _executor is not None and _executor_pid == os.getpid():
+        return _executor
+
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, "SEARCH_ASYNC_EXECUTOR_WORKERS", 4),
+                thread_name_prefix="search",
+            )
+            _executor_pid = os.getpid()
+        return _executor
+
+
+async def run_in_executor(func, *args):
+    """Run a blocking function on the search thread pool and await its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(search_executor(), functools.partial(func, *args))
+
+
+async def _load_catalog(generation):
+    start_time = time.time()
+    documents = await async_food_items_collection().find({}, CATALOG_PROJECTION).to_list(None)
+    catalog = install_catalog(await run_in_executor(FoodCatalog.from_documents, documents), generation)
+    logger.info(f"Loaded {len(catalog)} food items into the catalog in {time.time() - start_time:.2f} seconds")
+    return catalog
+
+
+async def async_load_catalog(limits=None):
+    """
+    Return the food catalog for a search, loading the process-wide catalog
+    through the Motor client when the generation moved on. Returns None when the
+    catalog cannot be loaded.
+
+    Args:
+        limits (tuple): Calorie, carb and fat limits of the search, see script.load_catalog
+    """
+    if not getattr(settings, "SEARCH_USE_CATALOG", True):
+        return await run_in_executor(load_catalog, limits)
+
+    # Read before the documents, so a write during the load triggers another reload
+    generation = await async_current_generation()
+    catalog = cached_catalog(generation)
+    if catalog is not None:
+        return catalog
+
+    try:
+        return await _catalog_loads.do(generation, _load_catalog, generation)
+    except Exception as e:
+        logger.error(f"Could not load food catalog: {e}")
+        return None
+
+
+async def warm_catalog():
+    """
+    Load the process-wide catalog through Motor, so that the steps run on the thread
+    pool find it in memory. Returns False when it cannot be loaded.
+    """
+    if not getattr(settings, "SEARCH_USE_CATALOG", True):
+        # Catalogs read per search are fetched by the steps themselves, for their limits
+        return True
+    return await async_load_catalog() is not None
+
+
+async def async_check_meal_options(calorie_limit, protein_limit, carb_limit, fat_limit):
+    """Async check_meal_options(): the valid meal options of a search."""
+    if not await warm_catalog():
+        return []
+
+    cache_key, limits, bucket_catalog = await run_in_executor(
+        resolve_search, calorie_limit, protein_limit, carb_limit, fat_limit
+    )
+    valid_meals = await async_search_meal_options(cache_key, *limits)
+    if bucket_catalog is not None:
+        valid_meals = await run_in_executor(
+            filter_meals, bucket_catalog, valid_meals, calorie_limit, carb_limit, fat_limit
+        )
+        logger.info(f"Filtered {len(valid_meals)} meal options from the bucket for key: {cache_key}")
+    return valid_meals
+
+
+async def async_search_meal_options(cache_key, calorie_limit, carb_limit, fat_limit):
+    """
+    Async search_meal_options(): meals from the cache, or generated and cached.
+
+    Args:
+        cache_key (str): Key the meal list is cached under
+        calorie_limit (int): Maximum calories allowed
+        carb_limit (int): Maximum carbohydrates allowed in grams
+        fat_limit (int): Maximum fats allowed in grams
+
+    Returns:
+        list: Valid meal options
+    """
+    limits = (calorie_limit, carb_limit, fat_limit)
+    generation = await async_current_generation()
+    partitions = {}
+
+    try:
+        cached_results, partitions = await run_in_executor(lookup_meal_options, cache_key, limits, generation)
+        if cached_results is not None:
+            # Past its soft expiry, the entry is still served while one background refresh replaces it
+            if meal_options_cache.claim_refresh(cache_key):
+                refresh_in_task(cache_key, async_refresh_meal_options, cache_key, limits)
+            return cached_results
+    except Exception as e:
+        logger.error(f"Cache retrieval error: {e}")
+
+    # Concurrent searches for the same key wait for the first one instead of generating the same meals
+    return await async_meal_searches.do(
+        cache_key, async_compute_meal_options, cache_key, limits, generation, partitions
+    )
+
+
+async def async_refresh_meal_options(cache_key, limits):
+    """Async refresh_meal_options(): recompute a cached search, replacing its in-memory entry."""
+    generation = await async_current_generation()
+    return await async_meal_searches.do(cache_key, async_compute_meal_options, cache_key, limits, generation, {})
+
+
+async def async_compute_meal_options(cache_key, limits, generation, partitions):
+    """Async compute_meal_options(): generate and cache the meals of a search missing from memory."""
+    catalog = await async_load_catalog(limits)
+    if catalog is None:
+        return []
+
+    source = "in-memory"
+    if not partitions:
+        partitions = await async_database_partitions(cache_key, catalog)
+        source = "database"
+    if partitions:
+        return await async_store_meal_options(cache_key, limits, generation, catalog, partitions, source)
+
+    # Cached nowhere: let one process generate the meals while the others wait for its database entry
+    async with async_distributed_search_lock(cache_key) as waited:
+        if waited:
+            partitions = await async_database_partitions(cache_key, catalog)
+        return await async_store_meal_options(cache_key, limits, generation, catalog, partitions, source)
+
+
+async def async_database_partitions(cache_key, catalog):
+    """Async database_partitions(): still valid partitions of a search in the database cache."""
+    try:
+        document = await async_search_cache_collection().find_one({"key": cache_key})
+        return await run_in_executor(document_partitions, document, catalog)
+    except Exception as e:
+        logger.error(f"Cache retrieval error: {e}")
+        return {}
+
+
+async def async_store_meal_options(cache_key, limits, generation, catalog, partitions, source):
+    """Async store_meal_options(): generate the meals of a search and store them in both caches."""
+    valid_meals, fingerprints, refreshed = await run_in_executor(
+        enumerate_meal_options, cache_key, limits, generation, catalog, partitions, source
+    )
+
+    # Store in database cache, unless it already holds every partition
+    try:
+        document = None
+        if refreshed:
+            document = await run_in_executor(cache_document, cache_key, valid_meals, fingerprints, limits, generation)
+        if document is not None:
+            cache_collection = async_search_cache_collection()
+            await async_ensure_cache_indexes(cache_collection)
+            await cache_collection.replace_one({"key": cache_key}, document, upsert=True)
+            logger.info(f"Stored results in database cache with key: {cache_key}")
+    except Exception as e:
+        logger.error(f"Cache storage error: {e}")
+
+    return valid_meals
+
+
+async def async_get_top_ranked_meals(calorie_limit, protein_limit, carb_limit, fat_limit, top_n=10):
+    """Async get_top_ranked_meals(), ranking on the search thread pool."""
+    await warm_catalog()
+    return await run_in_executor(get_top_ranked_meals, calorie_limit, protein_limit, carb_limit, fat_limit, top_n)
+
+
+async def async_get_top_ranked_meals_by_restaurant(calorie_limit, protein_limit, carb_limit, fat_limit,
+                                                   top_n_per_restaurant=3):
+    """Async get_top_ranked_meals_by_restaurant(), ranking on the search thread pool."""
+    await warm_catalog()
+    return await run_in_executor(
+        get_top_ranked_meals_by_restaurant, calorie_limit, protein_limit, carb_limit, fat_limit, top_n_per_restaurant
+    )
+
+
+async def async_save_meal_to_db(meal_data):
+    """
+    Async save_meal_to_db(): save a meal through the Motor client.
+
+    Returns:
+        dict: Response with meal ID and status message
+    """
+    try:
+        result = await async_meals_collection().insert_one(meal_data)
+        return {
+            "message": "Meal saved successfully.",
+            "meal": {
+                "id": str(result.inserted_id),
+                **meal_data
+            }
+        }
+    except Exception as e:
+        return {
+            "message": f"Error saving meal: {str(e)}",
+            "error": True
+        }
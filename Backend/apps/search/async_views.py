@@ -0,0 +1,167 @@
+from django.conf import settings
+from django.http import HttpResponseNotAllowed, JsonResponse
+import functools
+import json
+import logging
+from .async_search import (
+    async_check_meal_options, async_get_top_ranked_meals, async_get_top_ranked_meals_by_restaurant,
+    async_save_meal_to_db, run_in_executor,
+)
+from .generation import async_current_generation
+from .pagination import paginate
+from .views import REQUIRED_MEAL_FIELDS, format_ranked_meal
+
+logger = logging.getLogger(__name__)
+
+"""
+Async versions of the search views, routed instead of views.py when
+SEARCH_ASYNC_VIEWS is set and the project is served over ASGI, e.g. by uvicorn
+workers (gunicorn -k uvicorn.workers.UvicornWorker macrosondemand.asgi:application).
+
+They answer with the same payloads as views.py, but wait on MongoDB without
+holding a thread and run enumeration, ranking and serialization of large
+responses on the search thread pool (see async_search.py), so a worker keeps
+serving other searches while one waits on the database.
+"""
+
+
+def require_methods(methods):
+    """require_http_methods() for async views, which Django 3.2's decorator would turn into sync views"""
+    def decorator(view):
+        @functools.wraps(view)
+        async def inner(request, *args, **kwargs):
+            if request.method not in methods:
+                logger.warning(f"Method Not Allowed ({request.method}): {request.path}")
+                return HttpResponseNotAllowed(methods)
+            return await view(request, *args, **kwargs)
+        return inner
+    return decorator
+
+
+async def json_response(data, **kwargs):
+    """JsonResponse serialized on the search thread pool"""
+    return await run_in_executor(functools.partial(JsonResponse, data, **kwargs))
+
+
+@require_methods(["GET"])
+async def meal_options_view(request):
+    """
+    Async meal_options_view: meal options based on specified macronutrient limits
+
+    Pass `limit` (and then the returned `next_cursor` as `cursor`) to page through
+    the meals. Streaming is not supported here: Django 3.2 iterates streamed
+    bodies synchronously on the event loop, where generating the meals lazily
+    would block it, so `stream` answers 400 instead of buffering every meal.
+    Streamed searches are served by the sync views (SEARCH_ASYNC_VIEWS off).
+    """
+    try:
+        # Get user-defined macronutrient constraints from query parameters
+        calorie_limit = int(request.GET.get("calories", 800))
+        protein_limit = int(request.GET.get("protein", 50))
+        carb_limit = int(request.GET.get("carbs", 100))
+        fat_limit = int(request.GET.get("fats", 30))
+
+        if request.GET.get("stream"):
+            return JsonResponse({
+                "error": "Streaming is not supported by the async search views"
+            }, status=400)
+
+        valid_meals = await async_check_meal_options(calorie_limit, protein_limit, carb_limit, fat_limit)
+
+        limit = request.GET.get("limit")
+        cursor = request.GET.get("cursor")
+        if limit is not None or cursor is not None:
+            page, next_cursor = paginate(
+                valid_meals,
+                limit or getattr(settings, "SEARCH_PAGE_SIZE", 100),
+                cursor,
+                (calorie_limit, protein_limit, carb_limit, fat_limit),
+                await async_current_generation(),
+            )
+            return await json_response({
+                "count": len(valid_meals),
+                "valid_meals": page,
+                "next_cursor": next_cursor
+            })
+
+        return await json_response({
+            "count": len(valid_meals),
+            "valid_meals": valid_meals
+        })
+    except Exception as e:
+        return JsonResponse({
+            "error": str(e)
+        }, status=400)
+
+
+@require_methods(["GET"])
+async def ranked_meal_options_view(request):
+    """
+    Async ranked_meal_options_view: ranked meal options based on how close they are to the specified limits
+    """
+    try:
+        # Get user-defined macronutrient constraints from query parameters
+        calorie_limit = int(request.GET.get("calories", 800))
+        protein_limit = int(request.GET.get("protein", 50))
+        carb_limit = int(request.GET.get("carbs", 100))
+        fat_limit = int(request.GET.get("fats", 30))
+
+        # Optional parameters
+        top_n = int(request.GET.get("top_n", 10))
+        by_restaurant = request.GET.get("by_restaurant", "false").lower() == "true"
+        top_n_per_restaurant = int(request.GET.get("top_n_per_restaurant", 3))
+
+        if by_restaurant:
+            top_meals = await async_get_top_ranked_meals_by_restaurant(
+                calorie_limit, protein_limit, carb_limit, fat_limit, top_n_per_restaurant
+            )
+            return JsonResponse({
+                "restaurants": {
+                    restaurant: [format_ranked_meal(meal) for meal in meals]
+                    for restaurant, meals in top_meals.items()
+                }
+            })
+
+        top_meals = await async_get_top_ranked_meals(calorie_limit, protein_limit, carb_limit, fat_limit, top_n)
+        return JsonResponse({
+            "count": len(top_meals),
+            "ranked_meals": [format_ranked_meal(meal) for meal in top_meals]
+        })
+    except Exception as e:
+        return JsonResponse({
+            "error": str(e)
+        }, status=400)
+
+
+@require_methods(["POST"])
+async def save_meal_view(request):
+    """
+    Async save_meal_view: save a selected meal to the database
+    """
+    try:
+        data = json.loads(request.body)
+
+        for field in REQUIRED_MEAL_FIELDS:
+            if field not in data:
+                return JsonResponse({
+                    "error": f"Missing required field: {field}"
+                }, status=400)
+
+        result = await async_save_meal_to_db(data)
+
+        if result.get("error"):
+            return JsonResponse(result, status=500)
+
+        return JsonResponse(result)
+    except json.JSONDecodeError:
+        return JsonResponse({
+            "error": "Invalid JSON in request body"
+        }, status=400)
+    except Exception as e:
+        return JsonResponse({
+            "error": str(e)
+        }, status=500)
+
+
+# csrf_exempt() would wrap the view in a sync function
+save_meal_view.csrf_exempt = True
@@ -0,0 +1,228 @@
+import heapq
+import logging
+import math
+import time
+
+logger = logging.getLogger(__name__)
+
+"""
+Branch-and-bound search for the top N meals by RMSE.
+
+Instead of enumerating every feasible meal and ranking afterwards, the search
+scores meals while it enumerates them. For a partial meal (a restaurant, an
+entree combo, or an entree and side combo) it computes a lower bound on the
+squared-error sum of calculate_rmse over every way of completing it, and skips
+the subtree when that bound cannot beat the current N-th best meal.
+
+The bound relaxes each macro on its own: adding items only raises a macro, up
+to the largest amount the remaining courses can add, and never past its limit.
+Calorie, carb and fat errors shrink as the macro approaches its limit and the
+protein term never increases with more protein, so each term is minimized at
+that best reachable value.
+
+Restaurants and entree combos are visited best bound first, while ties in
+RMSE are still broken by the engine's enumeration order, so results match
+ranking the full list.
+"""
+
+# Relative slack when comparing bounds with scores, so rounding never prunes a tie
+BOUND_TOLERANCE = 1e-9
+
+
+def protein_error(protein, protein_target):
+    """Protein term of calculate_rmse: a weighted penalty below the target, a capped bonus above it."""
+    if protein >= protein_target:
+        exceed_ratio = min((protein - protein_target) / protein_target, 0.25)
+        return -((protein_target * exceed_ratio) ** 2)
+    return ((protein - protein_target) ** 2) * 1.5
+
+
+def lower_bound(totals, headroom, target):
+    """
+    Lower bound on the mean squared error of any completion of a partial meal.
+
+    Args:
+        totals (tuple): Calories, protein, carbs and fats of the partial meal
+        headroom (tuple): Most calories, protein, carbs and fats the remaining
+            courses can add
+        target (tuple): Target calories, protein, carbs and fats
+
+    Returns:
+        float: Lower bound on the mean squared error (may be negative)
+    """
+    calorie_target, protein_target, carb_target, fat_target = target
+    calories = min(totals[0] + headroom[0], calorie_target)
+    carbs = min(totals[2] + headroom[2], carb_target)
+    fats = min(totals[3] + headroom[3], fat_target)
+    squared_errors = (
+        (calories - calorie_target) ** 2
+        + (carbs - carb_target) ** 2
+        + (fats - fat_target) ** 2
+        + protein_error(totals[1] + headroom[1], protein_target)
+    )
+    return squared_errors / 4
+
+
+def _combos(items, columns, calorie_limit, carb_limit, fat_limit, allow_pairs=True):
+    """Build the engine's combo list for one role as (items, calories, protein, carbs, fats) tuples."""
+    calories, protein, carbohydrates, fats = columns
+    combos = [()] + [(item,) for item in items]
+    if allow_pairs:
+        for i, first in enumerate(items):
+            for second in items[i+1:]:
+                if (calories[first] + calories[second] <= calorie_limit and
+                    carbohydrates[first] + carbohydrates[second] <= carb_limit and
+                    fats[first] + fats[second] <= fat_limit):
+                    combos.append((first, second))
+    return [
+        (
+            combo,
+            sum(calories[item] for item in combo),
+            sum(protein[item] for item in combo),
+            sum(carbohydrates[item] for item in combo),
+            sum(fats[item] for item in combo),
+        )
+        for combo in combos
+    ]
+
+
+def _headroom(combos):
+    """Largest amount of each macro any combo in the list adds."""
+    return tuple(max(combo[k] for combo in combos) for k in range(1, 5))
+
+
+def branch_and_bound_top_meals(catalog, calorie_limit, protein_limit, carb_limit, fat_limit, top_n, restaurants=None):
+    """
+    Find the top N meals by calculate_rmse without enumerating the whole meal space.
+
+    Args:
+        catalog (FoodCatalog): Food items to build meals from
+        calorie_limit (int): Maximum calories allowed
+        protein_limit (int): Minimum protein target in grams
+        carb_limit (int): Maximum carbohydrates allowed in grams
+        fat_limit (int): Maximum fats allowed in grams
+        top_n (int): Number of meals to return
+        restaurants (set): Only search these restaurants when given
+
+    Returns:
+        list: (rmse, meal) tuples in rank order
+    """
+    from .rank_meals import calculate_rmse
+
+    if top_n <= 0:
+        return []
+
+    start_time = time.time()
+    ids, names, calories, protein, carbohydrates, fats = catalog.column_lists()
+    columns = (calories, protein, carbohydrates, fats)
+    target = (calorie_limit, protein_limit, carb_limit, fat_limit)
+    target_macros = {"calories": calorie_limit, "protein": protein_limit, "carbs": carb_limit, "fats": fat_limit}
+
+    # Heap of the best meals so far; entries are negated so heap[0] is the worst survivor.
+    # The sequence is (restaurant, entree combo, side combo, dessert) positions in engine order.
+    heap = []
+    visited = 0
+
+    def worst_mse():
+        if len(heap) < top_n:
+            return math.inf
+        worst_rmse = -heap[0][0]
+        return worst_rmse * worst_rmse * (1 + BOUND_TOLERANCE) + BOUND_TOLERANCE
+
+    searches = []
+    for position, menu in enumerate(catalog.restaurant_menus(calorie_limit, carb_limit, fat_limit)):
+        if restaurants is not None and menu.restaurant not in restaurants:
+            continue
+        entree_combos = [
+            (index, combo) for index, combo in enumerate(_combos(
+                menu.entrees.tolist(), columns, calorie_limit, carb_limit, fat_limit))
+            if combo[1] <= calorie_limit and combo[3] <= carb_limit and combo[4] <= fat_limit
+        ]
+        if not entree_combos:
+            continue
+        side_combos = _combos(menu.sides.tolist(), columns, calorie_limit, carb_limit, fat_limit)
+        dessert_combos = _combos(menu.desserts.tolist(), columns, calorie_limit, carb_limit, fat_limit, allow_pairs=False)
+
+        side_headroom = _headroom(side_combos)
+        dessert_headroom = _headroom(dessert_combos)
+        course_headroom = tuple(s + d for s, d in zip(side_headroom, dessert_headroom))
+        entree_headroom = _headroom([combo for _, combo in entree_combos])
+        bound = lower_bound((0, 0, 0, 0), tuple(e + c for e, c in zip(entree_headroom, course_headroom)), target)
+        searches.append((bound, position, menu.restaurant, entree_combos, side_combos, dessert_combos,
+                            course_headroom, dessert_headroom))
+
+    searches.sort(key=lambda search: (search[0], search[1]))
+
+    for (bound, position, restaurant_name, entree_combos, side_combos, dessert_combos,
+         course_headroom, dessert_headroom) in searches:
+        # Restaurants are sorted by bound, so none of the rest can do better
+        if bound > worst_mse():
+            break
+
+        entree_bounds = sorted(
+            (lower_bound(combo[1:], course_headroom, target), index, combo)
+            for index, combo in entree_combos
+        )
+        for entree_bound, entree_index, entree_combo in entree_bounds:
+            if entree_bound > worst_mse():
+                break
+            entree_items, entree_calories, entree_protein, entree_carbs, entree_fats = entree_combo
+            remaining_calories = calorie_limit - entree_calories
+            remaining_carbs = carb_limit - entree_carbs
+            remaining_fats = fat_limit - entree_fats
+
+            for side_index, (side_items, side_calories, side_protein, side_carbs, side_fats) in enumerate(side_combos):
+                if (remaining_calories - side_calories < 0 or
+                    remaining_carbs - side_carbs < 0 or
+                    remaining_fats - side_fats < 0):
+                    continue
+
+                partial = (
+                    entree_calories + side_calories,
+                    entree_protein + side_protein,
+                    entree_carbs + side_carbs,
+                    entree_fats + side_fats,
+                )
+                if lower_bound(partial, dessert_headroom, target) > worst_mse():
+                    continue
+
+                for dessert_index, (dessert_items, dessert_calories, dessert_protein, dessert_carbs, dessert_fats) in enumerate(dessert_combos):
+                    if not entree_items and not side_items and not dessert_items:
+                        continue
+
+                    total_calories = partial[0] + dessert_calories
+                    total_carbs = partial[2] + dessert_carbs
+                    total_fats = partial[3] + dessert_fats
+                    if (total_calories > calorie_limit or
+                        total_carbs > carb_limit or
+                        total_fats > fat_limit):
+                        continue
+
+                    visited += 1
+                    totals = (total_calories, partial[1] + dessert_protein, total_carbs, total_fats)
+                    rmse = calculate_rmse(
+                        {"calories": totals[0], "protein": totals[1], "carbs": totals[2], "fats": totals[3]},
+                        target_macros,
+                    )
+                    neg_seq = (-position, -entree_index, -side_index, -dessert_index)
+                    entry = (-rmse, neg_seq, restaurant_name, entree_items + side_items + dessert_items, totals)
+                    if len(heap) < top_n:
+                        heapq.heappush(heap, entry)
+                    elif (-rmse, neg_seq) > heap[0][:2]:
+                        heapq.heapreplace(heap, entry)
+
+    top_meals = []
+    for neg_rmse, _, restaurant_name, all_items, totals in sorted(heap, reverse=True):
+        meal = {
+            "restaurant": restaurant_name,
+            "calories": totals[0],
+            "protein": totals[1],
+            "carbs": totals[2],
+            "fats": totals[3],
+            "food_item_ids": [ids[item] for item in all_items],
+            "item_names": [names[item] for item in all_items]
+        }
+        top_meals.append((-neg_rmse, meal))
+
+    logger.info(f"Branch and bound scored {visited} meals for the top {top_n} in {time.time() - start_time:.2f} seconds")
+    return top_meals
@@ -0,0 +1,119 @@
+import logging
+import math
+
+from django.conf import settings
+
+from .catalog import ROLE_DESSERT, ROLE_ENTREE, ROLE_SIDE
+
+logger = logging.getLogger(__name__)
+
+"""
+Macro-bucketed meal searches.
+
+With SEARCH_CACHE_BUCKETING on, the calorie, carb and fat limits of a search
+are rounded up to the next multiple of their SEARCH_CACHE_BUCKETS width, and
+the meals of that envelope are computed and cached once. Every search inside
+the same envelope filters the cached list down to its own limits, so nudging
+a limit within a bucket is a cache hit. Protein is not a limit, so it is left
+out of the envelope entirely.
+
+The filtered list is exactly what the engine returns for the request: with
+non-negative macros every meal within the request limits is also a meal of
+the envelope, the relative order of items, combos and meals is unchanged, and
+restaurants are put back in their order for the request. Meals close to a
+limit are re-checked with the engine's own float arithmetic. Catalogs with
+negative macros are never bucketed.
+"""
+
+# Bucket widths used when SEARCH_CACHE_BUCKETS does not set one
+DEFAULT_BUCKETS = {"calories": 50, "carbs": 10, "fats": 5}
+
+# Relative distance from a limit within which a meal is re-checked item by item
+LIMIT_MARGIN = 1e-9
+
+
+def nonnegative_macros(catalog):
+    """Whether no item has negative calories, carbs or fats, so looser limits only ever add meals."""
+    if "nonnegative_macros" not in catalog.derived:
+        catalog.derived["nonnegative_macros"] = bool(
+            (catalog.calories >= 0).all() and (catalog.carbohydrates >= 0).all() and (catalog.fats >= 0).all()
+        )
+    return catalog.derived["nonnegative_macros"]
+
+
+def bucketing_enabled(catalog):
+    """Whether searches on this catalog are computed per bucket envelope."""
+    if not getattr(settings, "SEARCH_CACHE_BUCKETING", False) or catalog is None:
+        return False
+    return nonnegative_macros(catalog)
+
+
+def bucket_limits(calorie_limit, carb_limit, fat_limit):
+    """
+    Round each limit up to the next multiple of its bucket width.
+
+    Returns:
+        tuple: (calorie_limit, carb_limit, fat_limit) of the envelope
+    """
+    widths = {**DEFAULT_BUCKETS, **getattr(settings, "SEARCH_CACHE_BUCKETS", {})}
+    return tuple(
+        math.ceil(limit / widths[macro]) * widths[macro] if widths[macro] and widths[macro] > 0 else limit
+        for macro, limit in (("calories", calorie_limit), ("carbs", carb_limit), ("fats", fat_limit))
+    )
+
+
+def _within_engine_limits(catalog, meal, limits):
+    """Repeat the engine's limit checks for one meal, in the engine's float arithmetic."""
+    positions = catalog.item_positions()
+    items = [positions[item_id] for item_id in meal["food_item_ids"]]
+    roles = catalog.roles[items].tolist()
+    courses = [
+        [item for item, role in zip(items, roles) if role == course]
+        for course in (ROLE_ENTREE, ROLE_SIDE, ROLE_DESSERT)
+    ]
+
+    for column, limit in zip((catalog.calories, catalog.carbohydrates, catalog.fats), limits):
+        values = [[float(column[item]) for item in course] for course in courses]
+        if any(value > limit for course in values for value in course):
+            return False
+        if any(len(course) == 2 and course[0] + course[1] > limit for course in values[:2]):
+            return False
+        remaining = limit - sum(values[0])
+        if remaining < 0 or remaining - sum(values[1]) < 0:
+            return False
+    return True
+
+
+def filter_meals(catalog, meals, calorie_limit, carb_limit, fat_limit):
+    """
+    Narrow the meals of looser limits (a bucket envelope or any cached superset)
+    down to the meals of the request.
+
+    Args:
+        catalog (FoodCatalog): Catalog the meals were generated from
+        meals (list): Meals generated for limits at or above the request limits
+        calorie_limit (int): Maximum calories allowed
+        carb_limit (int): Maximum carbohydrates allowed in grams
+        fat_limit (int): Maximum fats allowed in grams
+
+    Returns:
+        list: The meals generate_meals yields for the request limits, in its order
+    """
+    limits = (calorie_limit, carb_limit, fat_limit)
+    safe_limits = [limit - LIMIT_MARGIN * max(abs(limit), 1) for limit in limits]
+    positions = catalog.restaurant_positions(calorie_limit, carb_limit, fat_limit)
+
+    meals_by_restaurant = {}
+    for meal in meals:
+        totals = (meal["calories"], meal["carbs"], meal["fats"])
+        if any(total > limit for total, limit in zip(totals, limits)):
+            continue
+        if any(total > limit for total, limit in zip(totals, safe_limits)):
+            if not _within_engine_limits(catalog, meal, limits):
+                continue
+        meals_by_restaurant.setdefault(meal["restaurant"], []).append(meal)
+
+    filtered = []
+    for restaurant in sorted(meals_by_restaurant, key=positions.get):
+        filtered.extend(meals_by_restaurant[restaurant])
+    return filtered
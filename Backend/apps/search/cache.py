@@ -0,0 +1,336 @@
+import logging
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+"""
+Bounded in-memory cache of meal option lists.
+
+Entries are evicted least recently used first once the cache holds more than
+SEARCH_CACHE_MAX_ENTRIES lists or more than SEARCH_CACHE_MAX_BYTES of
+estimated result size, and expire SEARCH_CACHE_TTL seconds after they were
+stored. Every worker process has its own cache.
+
+Entries also have a soft expiry, SEARCH_CACHE_SOFT_TTL seconds after they were
+stored. Past it they are still served, but the first claim_refresh() on the
+entry returns True, telling that caller to recompute the entry in the
+background; later claims return False until a new entry replaces it or the
+refresh ends without replacing it and release_refresh() drops the claim.
+
+Entries may record the (calories, carbs, fats) limits their meals were
+generated for. find_dominating() scans those limits for an entry whose limits
+are all at least as loose as a request's, so the request can be answered by
+filtering that entry instead of enumerating again.
+
+Entries also record the food catalog generation they were computed from and
+the fingerprint of each restaurant they cover. Once set_generation() moves the
+cache to a newer generation, get() and find_dominating() skip older entries,
+but get_stale() still returns them, so the restaurants whose items did not
+change can be reused.
+"""
+
+# Meals measured when estimating the size of a result list
+SIZE_SAMPLE = 16
+
+
+def _deep_size(value):
+    """Approximate memory used by a meal: the dict, its lists and its scalar values."""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for key, item in value.items():
+            size += sys.getsizeof(key) + _deep_size(item)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            size += _deep_size(item)
+    return size
+
+
+def estimate_size(results):
+    """
+    Estimate the memory used by a list of meals from a sample of its meals.
+
+    Args:
+        results (list): Meal option dicts
+
+    Returns:
+        int: Estimated size in bytes
+    """
+    if not results:
+        return sys.getsizeof(results)
+    step = max(1, len(results) // SIZE_SAMPLE)
+    sample = results[::step][:SIZE_SAMPLE]
+    per_meal = sum(_deep_size(meal) for meal in sample) / len(sample)
+    return sys.getsizeof(results) + int(per_meal * len(results))
+
+
+class CacheEntry:
+    __slots__ = (
+        "value", "size", "stored_at", "expires_at", "refresh_at", "refreshing", "hits", "limits", "generation",
+        "fingerprints",
+    )
+
+    def __init__(self, value, size, stored_at, expires_at, limits=None, generation=0, fingerprints=None,
+                 refresh_at=None):
+        self.value = value
+        self.size = size
+        self.stored_at = stored_at
+        self.expires_at = expires_at
+        self.refresh_at = refresh_at
+        self.refreshing = False
+        self.hits = 0
+        self.limits = limits
+        self.generation = generation
+        self.fingerprints = fingerprints
+
+
+class MealOptionsCache:
+    """
+    Thread-safe LRU cache with a byte budget and a per-entry TTL.
+
+    Args:
+        max_bytes (int): Largest total estimated size of the cached lists
+        max_entries (int): Largest number of cached lists
+        ttl (float): Seconds an entry stays valid, or None to never expire
+        sizer (callable): Returns the estimated size of a value in bytes
+        soft_ttl (float): Seconds after which an entry should be refreshed, or None
+    """
+
+    def __init__(self, max_bytes, max_entries, ttl=None, sizer=estimate_size, soft_ttl=None):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.soft_ttl = soft_ttl
+        self.sizer = sizer
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.superset_hits = 0
+        self.refreshes = 0
+        self.generation = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self.get(key, count=False) is not None
+
+    def get(self, key, default=None, count=True):
+        """Return the cached value for a key and mark it recently used, or default when missing, expired or stale."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry, time.time()):
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+
+            if entry is None or self._stale(entry):
+                if count:
+                    self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            if count:
+                self.hits += 1
+                entry.hits += 1
+            return entry.value
+
+    def get_stale(self, key):
+        """
+        Return (value, fingerprints) of an unexpired entry even when it is from an older
+        catalog generation, or None. Does not count as a hit.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or self._expired(entry, time.time()):
+                return None
+            return entry.value, entry.fingerprints
+
+    def set(self, key, value, ttl=None, limits=None, generation=None, fingerprints=None):
+        """
+        Store a value, evicting least recently used entries to stay within budget.
+
+        Args:
+            limits (tuple): Limits the value was generated for, indexed for find_dominating
+            generation (int): Catalog generation the value was computed from, defaults to the current one
+            fingerprints (dict): Fingerprint of each restaurant the value covers
+
+        Returns:
+            bool: False when the value alone is larger than the byte budget and was not stored
+        """
+        size = self.sizer(value)
+        ttl = self.ttl if ttl is None else ttl
+        now = time.time()
+
+        with self._lock:
+            self._remove(key)
+            if size > self.max_bytes:
+                logger.warning(f"Not caching {key}: {size} bytes exceeds the cache budget of {self.max_bytes} bytes")
+                return False
+
+            if generation is None:
+                generation = self.generation
+            elif generation < self.generation:
+                return False
+            # A soft expiry at or past the hard one would never be reached
+            refresh_at = now + self.soft_ttl if self.soft_ttl and (not ttl or self.soft_ttl < ttl) else None
+            self._entries[key] = CacheEntry(
+                value, size, now, now + ttl if ttl else None, limits, generation, fingerprints, refresh_at)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes or len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+            return True
+
+    def find_dominating(self, limits, count=True):
+        """
+        Find the live entry with the fewest items whose limits are each at or above the given limits.
+
+        Returns:
+            tuple: (key, value, limits) of the entry, or None when no entry dominates the limits
+        """
+        now = time.time()
+        with self._lock:
+            best_key, best = None, None
+            expired = []
+            for key, entry in self._entries.items():
+                if self._expired(entry, now):
+                    expired.append(key)
+                    continue
+                if entry.limits is None or self._stale(entry):
+                    continue
+                if any(cached < wanted for cached, wanted in zip(entry.limits, limits)):
+                    continue
+                if best is None or len(entry.value) < len(best.value):
+                    best_key, best = key, entry
+            for key in expired:
+                self._remove(key)
+            self.expirations += len(expired)
+
+            if best is None:
+                return None
+            if count:
+                self._entries.move_to_end(best_key)
+                self.superset_hits += 1
+                best.hits += 1
+            return best_key, best.value, best.limits
+
+    def claim_refresh(self, key):
+        """
+        Whether the caller should refresh a key: True once for a live entry past its
+        soft expiry, False otherwise (also while another caller's refresh runs).
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            now = time.time()
+            if entry is None or entry.refreshing or entry.refresh_at is None or entry.refresh_at > now:
+                return False
+            if self._expired(entry, now) or self._stale(entry):
+                return False
+            entry.refreshing = True
+            self.refreshes += 1
+            return True
+
+    def release_refresh(self, key):
+        """Drop the refresh claim on a key, so that the next claim_refresh() after a failed refresh succeeds."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.refreshing = False
+
+    def set_generation(self, generation):
+        """Move to a newer catalog generation; entries of older generations become stale."""
+        with self._lock:
+            self.generation = max(self.generation, generation)
+
+    def _expired(self, entry, now):
+        return entry.expires_at is not None and entry.expires_at <= now
+
+    def _stale(self, entry):
+        return entry.generation < self.generation
+
+    def delete(self, key):
+        """Remove a key; returns whether it was cached."""
+        with self._lock:
+            return self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def purge_expired(self):
+        """Drop every expired entry and return how many were dropped."""
+        now = time.time()
+        with self._lock:
+            expired = [key for key, entry in self._entries.items() if self._expired(entry, now)]
+            for key in expired:
+                self._remove(key)
+            self.expirations += len(expired)
+            return len(expired)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        self.total_bytes -= entry.size
+        return True
+
+    def stats(self):
+        """Counters and current usage of the cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "soft_ttl": self.soft_ttl,
+                "generation": self.generation,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "superset_hits": self.superset_hits,
+                "refreshes": self.refreshes,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+    def entries(self):
+        """Describe each cached entry, least recently used first."""
+        now = time.time()
+        with self._lock:
+            return [
+                {
+                    "key": key,
+                    "meals": len(entry.value) if hasattr(entry.value, "__len__") else None,
+                    "bytes": entry.size,
+                    "age": now - entry.stored_at,
+                    "expires_in": entry.expires_at - now if entry.expires_at is not None else None,
+                    "refresh_in": entry.refresh_at - now if entry.refresh_at is not None else None,
+                    "refreshing": entry.refreshing,
+                    "hits": entry.hits,
+                    "limits": entry.limits,
+                    "generation": entry.generation,
+                    "stale": self._stale(entry),
+                }
+                for key, entry in self._entries.items()
+            ]
+
+
+meal_options_cache = MealOptionsCache(
+    max_bytes=getattr(settings, "SEARCH_CACHE_MAX_BYTES", 256 * 1024 * 1024),
+    max_entries=getattr(settings, "SEARCH_CACHE_MAX_ENTRIES", 100),
+    ttl=getattr(settings, "SEARCH_CACHE_TTL", 3600),
+    soft_ttl=getattr(settings, "SEARCH_CACHE_SOFT_TTL", None),
+)
@@ -0,0 +1,437 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import namedtuple
+from operator import itemgetter
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+"""
+Columnar, in-memory snapshot of the meals_fooditem collection.
+
+The search engine reads item macros from typed NumPy columns instead of
+querying MongoDB and building a dict per document on every uncached search.
+The process-wide catalog is loaded on first use and reloaded when
+refresh_catalog() is called or the food catalog generation moves on.
+
+The importer stores derived fields on each item (see derived_fields() and
+menu_ordinals()): its role, calorie density and menu ordinal. When every
+document carries them at DERIVED_FIELDS_VERSION, the catalog reads them instead
+of classifying categories and computing densities, and restaurant menus come
+out of one precomputed item order rather than a sort per search.
+"""
+
+# Categories that never take part in a meal
+EXCLUDED_CATEGORIES = ["Beverages", "Toppings & Ingredients"]
+
+# Categories making up each part of a meal
+ENTREE_CATEGORIES = ["Sandwiches", "Entrees", "Pizza", "Burgers"]
+SIDE_CATEGORIES = ["Fried Potatoes", "Appetizers & Sides", "Salads", "Soup", "Baked Goods"]
+DESSERT_CATEGORIES = ["Desserts"]
+
+# Role codes stored per item
+ROLE_ENTREE = 0
+ROLE_SIDE = 1
+ROLE_DESSERT = 2
+ROLE_OTHER = 3
+ROLE_EXCLUDED = 4
+
+# Version of the derived fields stored on meals_fooditem documents; bump it when their definition changes
+DERIVED_FIELDS_VERSION = 1
+
+# Fields the search engine needs from meals_fooditem
+CATALOG_PROJECTION = {
+    "id": 1,
+    "item_name": 1,
+    "food_category": 1,
+    "restaurant": 1,
+    "calories": 1,
+    "protein": 1,
+    "carbohydrates": 1,
+    "fats": 1,
+    "role": 1,
+    "calorie_density": 1,
+    "menu_ordinal": 1,
+    "derived_version": 1,
+}
+
+# Indexes on meals_fooditem supporting candidate_query(): macro ranges first, then the category filter
+FOOD_ITEM_INDEXES = [
+    [("calories", 1), ("carbohydrates", 1), ("fats", 1)],
+    [("food_category", 1), ("calories", 1)],
+]
+
+# Candidate items of one restaurant, split by role and sorted by calorie density
+RestaurantMenu = namedtuple("RestaurantMenu", ["restaurant", "entrees", "sides", "desserts"])
+
+
+def category_role(category):
+    """Return the role code for a food category."""
+    if category in EXCLUDED_CATEGORIES:
+        return ROLE_EXCLUDED
+    if category in ENTREE_CATEGORIES:
+        return ROLE_ENTREE
+    if category in SIDE_CATEGORIES:
+        return ROLE_SIDE
+    if category in DESSERT_CATEGORIES:
+        return ROLE_DESSERT
+    return ROLE_OTHER
+
+
+def calorie_density(calories, protein, carbohydrates, fats):
+    """Calories per gram of macronutrients, infinite when an item has no macros."""
+    total_macros = protein + carbohydrates + fats
+    return calories / total_macros if total_macros > 0 else float("inf")
+
+
+def derived_fields(document):
+    """
+    Return the derived fields of a meals_fooditem document that depend on the
+    item alone: its normalized category, role and calorie density.
+    """
+    category = document.get("food_category") or ""
+    return {
+        "category_key": " ".join(category.split()).casefold(),
+        "role": category_role(category),
+        "calorie_density": calorie_density(*(
+            float(document.get(field) or 0) for field in ("calories", "protein", "carbohydrates", "fats")
+        )),
+        "derived_version": DERIVED_FIELDS_VERSION,
+    }
+
+
+def menu_ordinals(documents):
+    """
+    Return the menu ordinal of each document of one restaurant, given in _id
+    order: its rank by role, then calorie density, then _id. Sorting any subset
+    of a restaurant's items by ordinal lists each role by calorie density,
+    keeping catalog order on ties.
+    """
+    keys = [(fields["role"], fields["calorie_density"], position) for position, fields in enumerate(documents)]
+    ordinals = [0] * len(keys)
+    for ordinal, (_, _, position) in enumerate(sorted(keys)):
+        ordinals[position] = ordinal
+    return ordinals
+
+
+class FoodCatalog:
+    """
+    Immutable column store of food items.
+
+    Restaurants and food categories are stored as integer codes into the
+    `restaurants` and `categories` lists. Items without a restaurant get the
+    restaurant code -1 and are never part of a meal.
+
+    Stored derived fields are used only when every document has them at
+    DERIVED_FIELDS_VERSION. Their menu ordinals break ties in _id order, the
+    order from_documents() builds catalogs in.
+    """
+
+    def __init__(self, documents=()):
+        ids = []
+        item_names = []
+        calories = []
+        protein = []
+        carbohydrates = []
+        fats = []
+        roles = []
+        densities = []
+        ordinals = []
+        restaurant_codes = []
+        category_codes = []
+
+        self.restaurants = []
+        self.categories = []
+        self.restaurant_lookup = {}
+        category_lookup = {}
+
+        for doc in documents:
+            restaurant = doc.get("restaurant") or ""
+            category = doc.get("food_category") or ""
+
+            if restaurant:
+                if restaurant not in self.restaurant_lookup:
+                    self.restaurant_lookup[restaurant] = len(self.restaurants)
+                    self.restaurants.append(restaurant)
+                restaurant_codes.append(self.restaurant_lookup[restaurant])
+            else:
+                restaurant_codes.append(-1)
+
+            if category not in category_lookup:
+                category_lookup[category] = len(self.categories)
+                self.categories.append(category)
+            category_codes.append(category_lookup[category])
+
+            item_id = doc.get("id", doc.get("_id"))
+            ids.append(str(item_id))
+            item_names.append(str(doc.get("item_name")))
+            calories.append(doc.get("calories") or 0)
+            protein.append(doc.get("protein") or 0)
+            carbohydrates.append(doc.get("carbohydrates") or 0)
+            fats.append(doc.get("fats") or 0)
+            if doc.get("derived_version") == DERIVED_FIELDS_VERSION and doc.get("menu_ordinal") is not None:
+                roles.append(doc["role"])
+                densities.append(doc["calorie_density"])
+                ordinals.append(doc["menu_ordinal"])
+
+        self.ids = np.array(ids, dtype=object)
+        self.item_names = np.array(item_names, dtype=object)
+        self.calories = np.array(calories, dtype=np.float64)
+        self.protein = np.array(protein, dtype=np.float64)
+        self.carbohydrates = np.array(carbohydrates, dtype=np.float64)
+        self.fats = np.array(fats, dtype=np.float64)
+        self.restaurant_codes = np.array(restaurant_codes, dtype=np.int32)
+        self.category_codes = np.array(category_codes, dtype=np.int32)
+
+        if len(ordinals) == len(ids):
+            self.roles = np.array(roles, dtype=np.int8)
+            self.calorie_density = np.array(densities, dtype=np.float64)
+            self.menu_ordinals = np.array(ordinals, dtype=np.int64)
+        else:
+            # Per-category lookup, broadcast to a per-item column
+            category_roles = np.array([category_role(c) for c in self.categories], dtype=np.int8)
+            self.roles = category_roles[self.category_codes] if len(self.categories) else np.zeros(0, dtype=np.int8)
+
+            # Calories per gram of macronutrients, infinite when an item has no macros
+            total_macros = self.protein + self.carbohydrates + self.fats
+            with np.errstate(divide="ignore", invalid="ignore"):
+                self.calorie_density = np.where(total_macros > 0, self.calories / total_macros, np.inf)
+
+            # Rank by restaurant, role, calorie density and catalog order, a valid menu ordinal within each restaurant
+            order = np.lexsort((np.arange(len(ids)), self.calorie_density, self.roles, self.restaurant_codes))
+            self.menu_ordinals = np.empty(len(ids), dtype=np.int64)
+            self.menu_ordinals[order] = np.arange(len(ids))
+        self.excluded = self.roles == ROLE_EXCLUDED
+
+        self.loaded_at = time.time()
+        # Food catalog generation the documents were read at, when known
+        self.generation = None
+        self._lists = None
+        # Lookup tables derived from the columns by the engines, keyed by the engine
+        self.derived = {}
+
+    @classmethod
+    def from_collection(cls, collection, query=None):
+        """Build a catalog from the documents of a meals_fooditem collection."""
+        return cls.from_documents(collection.find(query or {}, CATALOG_PROJECTION))
+
+    @classmethod
+    def from_documents(cls, documents):
+        """
+        Build a catalog from meals_fooditem documents in _id order, so restaurant
+        order and ties do not depend on the plan of the query that read them.
+        """
+        return cls(sorted(documents, key=itemgetter("_id")))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getstate__(self):
+        # Derived tables and list copies are rebuilt on demand rather than pickled
+        state = self.__dict__.copy()
+        state["_lists"] = None
+        state["derived"] = {}
+        return state
+
+    def take(self, items):
+        """
+        Return a catalog of the given items only, keeping their order and the
+        restaurant and category codes of this catalog.
+        """
+        subset = FoodCatalog.__new__(FoodCatalog)
+        subset.__dict__.update(self.__getstate__())
+        for column in ("ids", "item_names", "calories", "protein", "carbohydrates", "fats",
+                       "restaurant_codes", "category_codes", "roles", "excluded", "calorie_density", "menu_ordinals"):
+            setattr(subset, column, getattr(self, column)[items])
+        return subset
+
+    def column_lists(self):
+        """Return (ids, item_names, calories, protein, carbohydrates, fats) as plain Python lists."""
+        # Plain lists index faster than NumPy arrays in per-item Python loops
+        if self._lists is None:
+            self._lists = tuple(
+                column.tolist()
+                for column in (self.ids, self.item_names, self.calories, self.protein, self.carbohydrates, self.fats)
+            )
+        return self._lists
+
+    def item_positions(self):
+        """Map each item id to its position in the columns."""
+        positions = self.derived.get("item_positions")
+        if positions is None:
+            positions = {item_id: index for index, item_id in enumerate(self.ids.tolist())}
+            self.derived["item_positions"] = positions
+        return positions
+
+    def menu_order(self):
+        """Item positions sorted by restaurant code, then menu ordinal."""
+        order = self.derived.get("menu_order")
+        if order is None:
+            order = np.lexsort((self.menu_ordinals, self.restaurant_codes))
+            self.derived["menu_order"] = order
+        return order
+
+    def candidate_mask(self, calorie_limit, carb_limit, fat_limit):
+        """Mask of the items that can be part of a meal within the given limits (protein is not a limit)."""
+        return (
+            ~self.excluded
+            & (self.restaurant_codes >= 0)
+            & (self.calories <= calorie_limit)
+            & (self.carbohydrates <= carb_limit)
+            & (self.fats <= fat_limit)
+        )
+
+    def restaurant_menus(self, calorie_limit, carb_limit, fat_limit, restaurants=None):
+        """
+        Yield a RestaurantMenu for every restaurant with candidate items, or
+        only for the given restaurants.
+
+        Restaurants come in the order of their first candidate item and each
+        role is sorted by calorie density, keeping catalog order on ties.
+        """
+        candidates, restaurant_order = self._candidates_by_restaurant(calorie_limit, carb_limit, fat_limit)
+        if not len(candidates):
+            return
+
+        # Candidates grouped by restaurant, each restaurant in menu ordinal order
+        order = self.menu_order()
+        is_candidate = np.zeros(len(self), dtype=bool)
+        is_candidate[candidates] = True
+        grouped = order[is_candidate[order]]
+        boundaries = np.searchsorted(self.restaurant_codes[grouped], restaurant_order)
+        counts = np.bincount(self.restaurant_codes[candidates], minlength=len(self.restaurants))
+
+        for code, start in zip(restaurant_order, boundaries):
+            if restaurants is not None and self.restaurants[code] not in restaurants:
+                continue
+            yield self._menu(code, grouped[start:start + counts[code]])
+
+    def restaurant_positions(self, calorie_limit, carb_limit, fat_limit):
+        """Map each restaurant with candidate items to its position in restaurant_menus() order."""
+        _, restaurant_order = self._candidates_by_restaurant(calorie_limit, carb_limit, fat_limit)
+        return {self.restaurants[code]: position for position, code in enumerate(restaurant_order.tolist())}
+
+    def _candidates_by_restaurant(self, calorie_limit, carb_limit, fat_limit):
+        """Return the candidate items and the restaurant codes in order of their first candidate item."""
+        candidates = np.flatnonzero(self.candidate_mask(calorie_limit, carb_limit, fat_limit))
+        unique_codes, first_seen = np.unique(self.restaurant_codes[candidates], return_index=True)
+        return candidates, unique_codes[np.argsort(first_seen)]
+
+    def restaurant_fingerprints(self):
+        """
+        Map each restaurant to a digest of its items (ids, names, categories,
+        macros and catalog order). A restaurant's meals for any limits only
+        depend on these, so equal digests mean equal meals.
+        """
+        fingerprints = self.derived.get("restaurant_fingerprints")
+        if fingerprints is None:
+            digests = [hashlib.blake2b(digest_size=16) for _ in self.restaurants]
+            rows = zip(
+                self.restaurant_codes.tolist(), self.ids.tolist(), self.item_names.tolist(),
+                self.category_codes.tolist(), self.calories.tolist(), self.protein.tolist(),
+                self.carbohydrates.tolist(), self.fats.tolist(),
+            )
+            for code, item_id, name, category, *macros in rows:
+                if code >= 0:
+                    digests[code].update(repr((item_id, name, self.categories[category], macros)).encode())
+            fingerprints = {restaurant: digest.hexdigest() for restaurant, digest in zip(self.restaurants, digests)}
+            self.derived["restaurant_fingerprints"] = fingerprints
+        return fingerprints
+
+    def restaurant_menu(self, restaurant):
+        """Return the RestaurantMenu of every item of a restaurant that can be part of a meal, ignoring limits."""
+        code = self.restaurant_lookup[restaurant]
+        order = self.menu_order()
+        return self._menu(code, order[(self.restaurant_codes[order] == code) & ~self.excluded[order]])
+
+    def _menu(self, code, items):
+        # Items in menu ordinal order list each role by calorie density already
+        roles = self.roles[items]
+        return RestaurantMenu(
+            self.restaurants[code],
+            items[roles == ROLE_ENTREE],
+            items[roles == ROLE_SIDE],
+            items[roles == ROLE_DESSERT],
+        )
+
+
+def candidate_query(calorie_limit, carb_limit, fat_limit):
+    """
+    MongoDB query for the meals_fooditem documents that can be part of a meal
+    within the limits, a superset of candidate_mask(). Macro limits use
+    $not/$gt rather than $lte so items without a value, which the catalog
+    reads as 0, still match.
+    """
+    return {
+        "food_category": {"$nin": EXCLUDED_CATEGORIES},
+        "restaurant": {"$nin": [None, ""]},
+        "calories": {"$not": {"$gt": calorie_limit}},
+        "carbohydrates": {"$not": {"$gt": carb_limit}},
+        "fats": {"$not": {"$gt": fat_limit}},
+    }
+
+
+_indexed_collections = set()
+_index_lock = threading.Lock()
+
+
+def ensure_food_item_indexes(collection):
+    """Create the FOOD_ITEM_INDEXES on a meals_fooditem collection once per process."""
+    name = collection.full_name
+    if name in _indexed_collections:
+        return
+    with _index_lock:
+        if name in _indexed_collections:
+            return
+        for keys in FOOD_ITEM_INDEXES:
+            collection.create_index(keys)
+        _indexed_collections.add(name)
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog():
+    """Return the process-wide catalog, loading it on first use or after the catalog generation changed."""
+    from .generation import current_generation
+
+    catalog = cached_catalog(current_generation())
+    return catalog if catalog is not None else refresh_catalog()
+
+
+def refresh_catalog():
+    """Reload the process-wide catalog from MongoDB and return it."""
+    from .generation import current_generation
+    from .script import get_db_connection
+
+    with _catalog_lock:
+        start_time = time.time()
+        # Read before the documents, so a write during the load triggers another reload
+        generation = current_generation()
+        collection = get_db_connection()
+        if collection is None:
+            logger.error("Could not load food catalog: no database connection")
+            return _catalog if _catalog is not None else FoodCatalog()
+
+        catalog = install_catalog(FoodCatalog.from_collection(collection), generation)
+        logger.info(f"Loaded {len(catalog)} food items into the catalog in {time.time() - start_time:.2f} seconds")
+        return catalog
+
+
+def install_catalog(catalog, generation):
+    """Make a catalog loaded at the given generation the process-wide catalog and return it."""
+    global _catalog
+    catalog.generation = generation
+    _catalog = catalog
+    return catalog
+
+
+def cached_catalog(generation):
+    """Return the process-wide catalog if it was loaded at the given generation, else None."""
+    if _catalog is not None and _catalog.generation == generation:
+        return _catalog
+    return None
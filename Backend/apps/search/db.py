@@ -0,0 +1,93 @@
+import logging
+import os
+import threading
+
+from django.conf import settings
+from pymongo import MongoClient
+
+logger = logging.getLogger(__name__)
+
+"""
+Shared MongoDB access for the search app.
+
+Every process keeps one pooled MongoClient, created on first use from the
+default database settings and the MONGODB_* pool and timeout settings, and
+reused by every request. A process forked from one that already has a client
+(e.g. a gunicorn worker forked from a preloaded master) drops the inherited
+client and creates its own, as pymongo clients are not fork-safe.
+"""
+
+FOOD_ITEMS_COLLECTION = "meals_fooditem"
+SEARCH_CACHE_COLLECTION = "search_cache"
+MEALS_COLLECTION = "meals_meal"
+CATALOG_META_COLLECTION = "catalog_meta"
+SEARCH_LOCKS_COLLECTION = "search_locks"
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def _reset_client():
+    global _client, _client_pid
+    _client = None
+    _client_pid = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_client)
+
+
+def get_client():
+    """Return the process-wide MongoClient, creating it on first use."""
+    global _client, _client_pid
+    if _client is not None and _client_pid == os.getpid():
+        return _client
+
+    with _client_lock:
+        if _client is None or _client_pid != os.getpid():
+            _client = MongoClient(
+                settings.DATABASES["default"]["CLIENT"]["host"],
+                maxPoolSize=getattr(settings, "MONGODB_MAX_POOL_SIZE", 100),
+                minPoolSize=getattr(settings, "MONGODB_MIN_POOL_SIZE", 0),
+                maxIdleTimeMS=getattr(settings, "MONGODB_MAX_IDLE_TIME_MS", None),
+                serverSelectionTimeoutMS=getattr(settings, "MONGODB_SERVER_SELECTION_TIMEOUT_MS", 30000),
+                connectTimeoutMS=getattr(settings, "MONGODB_CONNECT_TIMEOUT_MS", 20000),
+                socketTimeoutMS=getattr(settings, "MONGODB_SOCKET_TIMEOUT_MS", None),
+                connect=False,
+            )
+            _client_pid = os.getpid()
+        return _client
+
+
+def close_client():
+    """Close the process-wide client; the next access creates a new one."""
+    with _client_lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _reset_client()
+
+
+def get_database():
+    """Return the application database."""
+    return get_client()[settings.DATABASES["default"]["NAME"]]
+
+
+def food_items_collection():
+    return get_database()[FOOD_ITEMS_COLLECTION]
+
+
+def search_cache_collection():
+    return get_database()[SEARCH_CACHE_COLLECTION]
+
+
+def meals_collection():
+    return get_database()[MEALS_COLLECTION]
+
+
+def catalog_meta_collection():
+    return get_database()[CATALOG_META_COLLECTION]
+
+
+def search_locks_collection():
+    return get_database()[SEARCH_LOCKS_COLLECTION]
@@ -0,0 +1,430 @@
+import logging
+from collections import namedtuple
+
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+"""
+Combination engines for the meal search.
+
+An engine takes one RestaurantMenu from the catalog and yields every valid
+meal of up to two entrees, two sides and one dessert within the calorie, carb
+and fat limits (protein is never a limit). All engines yield the same meals,
+with the same macro totals, in the same order:
+
+    entree combos x side combos x dessert combos
+
+where each combo list is the empty combo, then single items, then pairs in
+calorie density order.
+"""
+
+# Upper bound on the number of (entree combo, side combo, dessert) candidates
+# the NumPy engine evaluates in one batch
+NUMPY_BATCH_SIZE = 1 << 20
+
+# Slack added to budgets when selecting candidate rows in the sorted-join engine,
+# so float rounding never drops a meal before the exact checks
+JOIN_SLACK = 1e-6
+
+
+def python_engine(catalog, menu, calorie_limit, carb_limit, fat_limit):
+    """Enumerate the meals of one restaurant with nested Python loops."""
+    ids, names, calories, protein, carbohydrates, fats = catalog.column_lists()
+    restaurant_name = menu.restaurant
+    entrees = menu.entrees.tolist()
+    sides = menu.sides.tolist()
+    desserts = menu.desserts.tolist()
+
+    # Generate valid entree combinations (0, 1, or 2 entrees)
+    entree_combinations = [()]  # Start with empty combo
+    if entrees:
+        entree_combinations.extend([(item,) for item in entrees])  # Add single entree combos
+        
+        # Only generate 2-entree combos if individual entrees are within limits
+        valid_two_entree_combos = []
+        for i, e1 in enumerate(entrees):
+            for e2 in entrees[i+1:]:
+                # Calculate combined macros
+                cal = calories[e1] + calories[e2]
+                carb = carbohydrates[e1] + carbohydrates[e2]
+                fat = fats[e1] + fats[e2]
+                
+                # Early termination if this combo already exceeds any limit
+                # (no protein check)
+                if (cal <= calorie_limit and 
+                    carb <= carb_limit and 
+                    fat <= fat_limit):
+                    valid_two_entree_combos.append((e1, e2))
+        
+        entree_combinations.extend(valid_two_entree_combos)
+    
+    # Generate valid side combinations (0, 1, or 2 sides) using same approach
+    side_combinations = [()]
+    if sides:
+        side_combinations.extend([(item,) for item in sides])
+        
+        valid_two_side_combos = []
+        for i, s1 in enumerate(sides):
+            for s2 in sides[i+1:]:
+                cal = calories[s1] + calories[s2]
+                carb = carbohydrates[s1] + carbohydrates[s2]
+                fat = fats[s1] + fats[s2]
+                
+                # No protein check
+                if (cal <= calorie_limit and 
+                    carb <= carb_limit and 
+                    fat <= fat_limit):
+                    valid_two_side_combos.append((s1, s2))
+        
+        side_combinations.extend(valid_two_side_combos)
+    
+    # Generate dessert combinations (0 or 1 dessert)
+    dessert_combinations = [()]
+    dessert_combinations.extend([(d,) for d in desserts])
+    
+    # Combine the components using pre-filtered valid combinations
+    for entree_combo in entree_combinations:
+        # Calculate macro totals for this entree combo
+        entree_calories = sum(calories[item] for item in entree_combo)
+        entree_protein = sum(protein[item] for item in entree_combo)
+        entree_carbs = sum(carbohydrates[item] for item in entree_combo)
+        entree_fats = sum(fats[item] for item in entree_combo)
+        
+        # Calculate remaining limits - no protein check
+        remaining_calories = calorie_limit - entree_calories
+        remaining_carbs = carb_limit - entree_carbs
+        remaining_fats = fat_limit - entree_fats
+        
+        # Skip if already over limits
+        if (remaining_calories < 0 or
+            remaining_carbs < 0 or 
+            remaining_fats < 0):
+            continue
+        
+        for side_combo in side_combinations:
+            # Calculate macro totals for this side combo
+            side_calories = sum(calories[item] for item in side_combo)
+            side_protein = sum(protein[item] for item in side_combo)
+            side_carbs = sum(carbohydrates[item] for item in side_combo)
+            side_fats = sum(fats[item] for item in side_combo)
+
+            # Calculate remaining limits after adding sides - no protein check
+            remaining_calories_after_sides = remaining_calories - side_calories
+            remaining_carbs_after_sides = remaining_carbs - side_carbs
+            remaining_fats_after_sides = remaining_fats - side_fats
+            
+            # Skip if over limits
+            if (remaining_calories_after_sides < 0 or
+                remaining_carbs_after_sides < 0 or 
+                remaining_fats_after_sides < 0):
+                continue
+            
+            for dessert_combo in dessert_combinations:
+                # Skip completely empty meals
+                if not entree_combo and not side_combo and not dessert_combo:
+                    continue
+                
+                # Calculate dessert macro totals
+                dessert_calories = sum(calories[item] for item in dessert_combo)
+                dessert_protein = sum(protein[item] for item in dessert_combo)
+                dessert_carbs = sum(carbohydrates[item] for item in dessert_combo)
+                dessert_fats = sum(fats[item] for item in dessert_combo)
+
+                # Final check against limits - no protein check
+                total_calories = entree_calories + side_calories + dessert_calories
+                total_protein = entree_protein + side_protein + dessert_protein
+                total_carbs = entree_carbs + side_carbs + dessert_carbs
+                total_fats = entree_fats + side_fats + dessert_fats
+                
+                if (total_calories <= calorie_limit and 
+                    total_carbs <= carb_limit and 
+                    total_fats <= fat_limit):
+                    
+                    # Create meal object in the requested format
+                    all_items = entree_combo + side_combo + dessert_combo
+                    food_item_ids = [ids[item] for item in all_items]
+                    item_names = [names[item] for item in all_items]
+
+                    meal = {
+                        "restaurant": restaurant_name,
+                        "calories": total_calories,
+                        "protein": total_protein,
+                        "carbs": total_carbs,
+                        "fats": total_fats,
+                        "food_item_ids": food_item_ids,
+                        "item_names" : item_names
+                    }
+                    
+                    yield meal
+
+
+def _combo_table(catalog, items, calorie_limit, carb_limit, fat_limit, allow_pairs=True):
+    """
+    Build the combo list for one role as arrays.
+
+    Returns (first, second, sums) where first/second are catalog indices (-1
+    for an unused slot) and sums is a (4, n) array of calories, protein, carbs
+    and fats. Row 0 is always the empty combo.
+    """
+    count = len(items)
+    empty = np.array([-1], dtype=np.int64)
+    firsts = [empty, items]
+    seconds = [empty, np.full(count, -1, dtype=np.int64)]
+
+    if allow_pairs and count > 1:
+        i, j = np.triu_indices(count, k=1)
+        a, b = items[i], items[j]
+        # Pairs must be within the limits on their own (no protein check)
+        within = (
+            (catalog.calories[a] + catalog.calories[b] <= calorie_limit)
+            & (catalog.carbohydrates[a] + catalog.carbohydrates[b] <= carb_limit)
+            & (catalog.fats[a] + catalog.fats[b] <= fat_limit)
+        )
+        firsts.append(a[within])
+        seconds.append(b[within])
+
+    first = np.concatenate(firsts)
+    second = np.concatenate(seconds)
+    sums = np.stack([
+        _take(column, first) + _take(column, second)
+        for column in (catalog.calories, catalog.protein, catalog.carbohydrates, catalog.fats)
+    ])
+    return first, second, sums
+
+
+def _take(column, indices):
+    """Gather column values, with 0 for unused (-1) slots."""
+    if not len(column):
+        return np.zeros(len(indices))
+    return np.where(indices >= 0, column[indices], 0.0)
+
+
+def numpy_engine(catalog, menu, calorie_limit, carb_limit, fat_limit):
+    """Enumerate the meals of one restaurant with broadcast array sums and boolean masks."""
+    limits = np.array([calorie_limit, carb_limit, fat_limit], dtype=np.float64)[:, None]
+
+    entree_first, entree_second, entree_sums = _combo_table(
+        catalog, menu.entrees, calorie_limit, carb_limit, fat_limit)
+    side_first, side_second, side_sums = _combo_table(
+        catalog, menu.sides, calorie_limit, carb_limit, fat_limit)
+    dessert_first, _, dessert_sums = _combo_table(
+        catalog, menu.desserts, calorie_limit, carb_limit, fat_limit, allow_pairs=False)
+    entree_slots = (entree_first, entree_second)
+    side_slots = (side_first, side_second)
+
+    # Entree combos that leave room in every limit (rows 0, 2, 3 are the limited macros)
+    entree_remaining = limits - entree_sums[[0, 2, 3]]
+    entree_rows = np.flatnonzero((entree_remaining >= 0).all(axis=0))
+    side_limited = side_sums[[0, 2, 3]]
+
+    entree_batch = max(1, NUMPY_BATCH_SIZE // side_sums.shape[1])
+    pair_batch = max(1, NUMPY_BATCH_SIZE // dessert_sums.shape[1])
+
+    for entree_start in range(0, len(entree_rows), entree_batch):
+        rows = entree_rows[entree_start:entree_start + entree_batch]
+
+        # Entree x side combos that still leave room, in entree-major order
+        side_remaining = entree_remaining[:, rows, None] - side_limited[:, None, :]
+        entree_pos, side_rows = np.nonzero((side_remaining >= 0).all(axis=0))
+        pair_entrees = rows[entree_pos]
+
+        for pair_start in range(0, len(pair_entrees), pair_batch):
+            yield from _numpy_meals(
+                catalog, menu.restaurant, calorie_limit, carb_limit, fat_limit,
+                pair_entrees[pair_start:pair_start + pair_batch],
+                side_rows[pair_start:pair_start + pair_batch],
+                entree_slots, entree_sums, side_slots, side_sums, dessert_first, dessert_sums,
+            )
+
+
+def _numpy_meals(catalog, restaurant_name, calorie_limit, carb_limit, fat_limit,
+                 e, s, entree_slots, entree_sums, side_slots, side_sums, dessert_first, dessert_sums):
+    """Add every dessert option to a batch of (entree combo, side combo) rows and yield the valid meals."""
+    dessert_count = dessert_sums.shape[1]
+
+    # Totals are summed as (entree + side) + dessert like the Python engine
+    totals = (entree_sums[:, e] + side_sums[:, s])[:, :, None] + dessert_sums[:, None, :]
+    valid = (
+        (totals[0] <= calorie_limit)
+        & (totals[2] <= carb_limit)
+        & (totals[3] <= fat_limit)
+    )
+    # Skip the completely empty meal
+    valid &= ~((e == 0) & (s == 0))[:, None] | (np.arange(dessert_count) > 0)[None, :]
+
+    pair_pos, d = np.nonzero(valid)
+    if not len(pair_pos):
+        return
+
+    e, s = e[pair_pos], s[pair_pos]
+    item_slots = np.stack([
+        entree_slots[0][e],
+        entree_slots[1][e],
+        side_slots[0][s],
+        side_slots[1][s],
+        dessert_first[d],
+    ], axis=1)
+    yield from _build_meals(catalog, restaurant_name, item_slots, totals[:, pair_pos, d])
+
+
+def _build_meals(catalog, restaurant_name, item_slots, totals):
+    """Yield meal dicts from an (n, 5) array of item slots (-1 when unused) and a (4, n) array of totals."""
+    ids, names = catalog.column_lists()[:2]
+    for slots, (total_calories, total_protein, total_carbs, total_fats) in zip(item_slots.tolist(), totals.T.tolist()):
+        all_items = [item for item in slots if item >= 0]
+        yield {
+            "restaurant": restaurant_name,
+            "calories": total_calories,
+            "protein": total_protein,
+            "carbs": total_carbs,
+            "fats": total_fats,
+            "food_item_ids": [ids[item] for item in all_items],
+            "item_names": [names[item] for item in all_items]
+        }
+
+
+# Side and dessert options of one restaurant, with their combined sums sorted by calories
+TailTable = namedtuple("TailTable", [
+    "side_first", "side_second", "side_sums", "dessert_first", "dessert_sums",
+    "calories", "carbs", "fats", "side_rows", "dessert_rows", "dessert_count",
+])
+
+
+def _tail_table(catalog, restaurant):
+    """
+    Return the calorie-sorted side combo x dessert table of a restaurant, or
+    None when it cannot be used.
+
+    The table covers every side and dessert of the restaurant regardless of
+    limits, so it is built once per catalog. Filtering by remaining budget is
+    exact because macros are never negative: a side combo and dessert that fit
+    the remaining budget are each within the limits on their own.
+    """
+    tables = catalog.derived.setdefault("tail_tables", {})
+    if restaurant in tables:
+        return tables[restaurant]
+
+    menu = catalog.restaurant_menu(restaurant)
+    items = np.concatenate([menu.entrees, menu.sides, menu.desserts])
+    macros = np.stack([catalog.calories[items], catalog.protein[items], catalog.carbohydrates[items], catalog.fats[items]])
+    if (macros < 0).any():
+        tables[restaurant] = None
+        return None
+
+    side_first, side_second, side_sums = _combo_table(catalog, menu.sides, np.inf, np.inf, np.inf)
+    dessert_first, _, dessert_sums = _combo_table(catalog, menu.desserts, np.inf, np.inf, np.inf, allow_pairs=False)
+    side_count, dessert_count = side_sums.shape[1], dessert_sums.shape[1]
+    if side_count * dessert_count > getattr(settings, "SEARCH_TAIL_TABLE_MAX_ROWS", 500000):
+        tables[restaurant] = None
+        return None
+
+    side_rows = np.repeat(np.arange(side_count, dtype=np.int32), dessert_count)
+    dessert_rows = np.tile(np.arange(dessert_count, dtype=np.int32), side_count)
+    tail_sums = side_sums[:, side_rows] + dessert_sums[:, dessert_rows]
+    order = np.argsort(tail_sums[0], kind="stable")
+
+    table = TailTable(
+        side_first, side_second, side_sums, dessert_first, dessert_sums,
+        tail_sums[0][order], tail_sums[2][order], tail_sums[3][order],
+        side_rows[order], dessert_rows[order], dessert_count,
+    )
+    tables[restaurant] = table
+    return table
+
+
+def sorted_join_engine(catalog, menu, calorie_limit, carb_limit, fat_limit):
+    """
+    Enumerate the meals of one restaurant by joining each entree combo with a
+    calorie-sorted side and dessert table (meet in the middle).
+
+    For each entree combo a binary search on the remaining calorie budget
+    finds the side/dessert rows that can fit, and carbs and fats are checked
+    only inside that range. The exact limit checks of the other engines are
+    then applied to the candidates, which are put back in engine order.
+    Restaurants without a usable table fall back to the NumPy engine.
+    """
+    table = _tail_table(catalog, menu.restaurant)
+    if table is None:
+        yield from numpy_engine(catalog, menu, calorie_limit, carb_limit, fat_limit)
+        return
+
+    entree_first, entree_second, entree_sums = _combo_table(
+        catalog, menu.entrees, calorie_limit, carb_limit, fat_limit)
+
+    for e in range(entree_sums.shape[1]):
+        entree_calories, entree_protein, entree_carbs, entree_fats = entree_sums[:, e]
+        remaining_calories = calorie_limit - entree_calories
+        remaining_carbs = carb_limit - entree_carbs
+        remaining_fats = fat_limit - entree_fats
+        if remaining_calories < 0 or remaining_carbs < 0 or remaining_fats < 0:
+            continue
+
+        # Candidate range by calories, with slack for rounding; exact checks follow
+        end = np.searchsorted(table.calories, remaining_calories + JOIN_SLACK, side="right")
+        in_budget = np.flatnonzero(
+            (table.carbs[:end] <= remaining_carbs + JOIN_SLACK)
+            & (table.fats[:end] <= remaining_fats + JOIN_SLACK)
+        )
+        if not len(in_budget):
+            continue
+
+        s = table.side_rows[in_budget]
+        d = table.dessert_rows[in_budget]
+        side_sums = table.side_sums[:, s]
+        dessert_sums = table.dessert_sums[:, d]
+
+        # The same checks and summation order as the other engines
+        totals = (entree_sums[:, e, None] + side_sums) + dessert_sums
+        valid = (
+            (remaining_calories - side_sums[0] >= 0)
+            & (remaining_carbs - side_sums[2] >= 0)
+            & (remaining_fats - side_sums[3] >= 0)
+            & (totals[0] <= calorie_limit)
+            & (totals[2] <= carb_limit)
+            & (totals[3] <= fat_limit)
+        )
+        if e == 0:
+            # Skip the completely empty meal
+            valid &= (s != 0) | (d != 0)
+
+        s, d, totals = s[valid], d[valid], totals[:, valid]
+        if not len(s):
+            continue
+
+        # Back to engine order: side combo, then dessert
+        order = np.argsort(s.astype(np.int64) * table.dessert_count + d)
+        s, d, totals = s[order], d[order], totals[:, order]
+
+        item_slots = np.stack([
+            np.full(len(s), entree_first[e]),
+            np.full(len(s), entree_second[e]),
+            table.side_first[s],
+            table.side_second[s],
+            table.dessert_first[d],
+        ], axis=1)
+        yield from _build_meals(catalog, menu.restaurant, item_slots, totals)
+
+
+ENGINES = {
+    "python": python_engine,
+    "numpy": numpy_engine,
+    "sorted": sorted_join_engine,
+}
+
+
+def get_engine(name=None):
+    """Return the engine function named by `name` or settings.SEARCH_ENGINE."""
+    name = name or getattr(settings, "SEARCH_ENGINE", "numpy")
+    try:
+        return ENGINES[name]
+    except KeyError:
+        raise ValueError(f"Unknown search engine: {name}")
+
+
+def generate_meals(catalog, calorie_limit, carb_limit, fat_limit, engine=None, restaurants=None):
+    """Yield every valid meal in the catalog, or of the given restaurants only, restaurant by restaurant."""
+    engine_fn = get_engine(engine)
+    for menu in catalog.restaurant_menus(calorie_limit, carb_limit, fat_limit, restaurants):
+        yield from engine_fn(catalog, menu, calorie_limit, carb_limit, fat_limit)
@@ -0,0 +1,109 @@
+import logging
+import threading
+import time
+from datetime import datetime
+
+from django.conf import settings
+from pymongo import ReturnDocument
+
+from .db import catalog_meta_collection
+
+logger = logging.getLogger(__name__)
+
+"""
+Food catalog generation counter.
+
+The catalog_meta collection holds one document counting the writes to
+meals_fooditem:
+
+    {"_id": "food_catalog", "generation": 12, "updated_at": datetime}
+
+Every write path (FoodItem saves and deletes through Django, and the CSV
+importer) bumps the generation. Each worker polls the counter at
+most every SEARCH_CATALOG_POLL_SECONDS; when it moves, the worker reloads its
+catalog on the next search and marks in-memory results of older generations
+stale, so they are checked restaurant by restaurant against the new catalog
+(see partitions.py) before they are served again.
+"""
+
+CATALOG_META_ID = "food_catalog"
+
+_generation = 0
+_checked_at = None
+_poll_lock = threading.Lock()
+
+
+def _observe(generation):
+    """Record a generation read from or written to MongoDB."""
+    global _generation
+    if generation <= _generation:
+        return
+    previous, _generation = _generation, generation
+    logger.info(f"Food catalog generation moved from {previous} to {generation}")
+
+    from .cache import meal_options_cache
+    meal_options_cache.set_generation(generation)
+
+
+def current_generation():
+    """
+    Return the catalog generation, reading it from MongoDB at most every
+    SEARCH_CATALOG_POLL_SECONDS. Returns the last known generation when the
+    database cannot be reached.
+    """
+    global _checked_at
+    interval = getattr(settings, "SEARCH_CATALOG_POLL_SECONDS", 5)
+    now = time.monotonic()
+    if _checked_at is not None and now - _checked_at < interval:
+        return _generation
+
+    with _poll_lock:
+        if _checked_at is None or time.monotonic() - _checked_at >= interval:
+            try:
+                document = catalog_meta_collection().find_one({"_id": CATALOG_META_ID}, {"generation": 1})
+                _observe(document.get("generation", 0) if document else 0)
+            except Exception as e:
+                logger.error(f"Could not read the food catalog generation: {e}")
+            _checked_at = time.monotonic()
+    return _generation
+
+
+async def async_current_generation():
+    """current_generation() for the async views, reading MongoDB through the Motor client."""
+    global _checked_at
+    interval = getattr(settings, "SEARCH_CATALOG_POLL_SECONDS", 5)
+    if _checked_at is not None and time.monotonic() - _checked_at < interval:
+        return _generation
+
+    from .async_db import async_catalog_meta_collection
+    try:
+        document = await async_catalog_meta_collection().find_one({"_id": CATALOG_META_ID}, {"generation": 1})
+        with _poll_lock:
+            _observe(document.get("generation", 0) if document else 0)
+    except Exception as e:
+        logger.error(f"Could not read the food catalog generation: {e}")
+    _checked_at = time.monotonic()
+    return _generation
+
+
+def bump_catalog_generation():
+    """
+    Mark the food catalog as changed.
+
+    Returns:
+        int: The new generation, or None when the bump failed
+    """
+    try:
+        document = catalog_meta_collection().find_one_and_update(
+            {"_id": CATALOG_META_ID},
+            {"$inc": {"generation": 1}, "$set": {"updated_at": datetime.now()}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+    except Exception as e:
+        logger.error(f"Could not bump the food catalog generation: {e}")
+        return None
+
+    with _poll_lock:
+        _observe(document["generation"])
+    return document["generation"]
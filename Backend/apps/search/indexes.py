@@ -0,0 +1,135 @@
+import logging
+from collections import namedtuple
+
+from bson import ObjectId
+
+from apps.accounts.models import CustomUser, SavedMeal
+
+from .catalog import FOOD_ITEM_INDEXES, candidate_query
+from .db import (
+    CATALOG_META_COLLECTION, FOOD_ITEMS_COLLECTION, MEALS_COLLECTION, SEARCH_CACHE_COLLECTION, SEARCH_LOCKS_COLLECTION,
+)
+from .generation import CATALOG_META_ID
+
+logger = logging.getLogger(__name__)
+
+"""
+Indexes the hot queries rely on, and the checks that they are used.
+
+REQUIRED_INDEXES declares the indexes of each collection beyond _id. An index
+counts as present when the collection has an index on the same keys, whatever
+its name, so indexes djongo created from the model definitions are not created
+twice. HOT_QUERIES are the canonical shapes of the queries served per request:
+explained against the database, none of them may be answered by a COLLSCAN.
+The ensure_indexes management command creates the missing indexes and runs
+the checks on deploy.
+"""
+
+Index = namedtuple("Index", ["keys", "options"])
+HotQuery = namedtuple("HotQuery", ["collection", "description", "filter"])
+
+USERS_COLLECTION = CustomUser._meta.db_table
+SAVED_MEALS_COLLECTION = SavedMeal._meta.db_table
+SAVED_MEAL_USER_FIELD = SavedMeal._meta.get_field("customuser").column
+SAVED_MEAL_MEAL_FIELD = SavedMeal._meta.get_field("meal").column
+
+REQUIRED_INDEXES = {
+    SEARCH_CACHE_COLLECTION: [
+        Index([("key", 1)], {"unique": True}),
+        Index([("expires_at", 1)], {"expireAfterSeconds": 0}),
+    ],
+    SEARCH_LOCKS_COLLECTION: [
+        Index([("expires_at", 1)], {"expireAfterSeconds": 0}),
+    ],
+    USERS_COLLECTION: [
+        Index([("email", 1)], {"unique": True}),
+    ],
+    SAVED_MEALS_COLLECTION: [
+        Index([(SAVED_MEAL_USER_FIELD, 1), (SAVED_MEAL_MEAL_FIELD, 1)], {"unique": True}),
+    ],
+    FOOD_ITEMS_COLLECTION: [
+        Index([("restaurant", 1), ("food_category", 1)], {}),
+        # Unique among the items imported with a menu_item_id, see apps/meals/importer.py
+        Index(
+            [("menu_item_id", 1)],
+            {"unique": True, "partialFilterExpression": {"menu_item_id": {"$type": "string"}}},
+        ),
+        *(Index(keys, {}) for keys in FOOD_ITEM_INDEXES),
+    ],
+}
+
+HOT_QUERIES = [
+    HotQuery(SEARCH_CACHE_COLLECTION, "cached search by key", {"key": "800-100-30"}),
+    HotQuery(SEARCH_LOCKS_COLLECTION, "search lock by key", {"_id": "800-100-30"}),
+    HotQuery(CATALOG_META_COLLECTION, "catalog generation", {"_id": CATALOG_META_ID}),
+    HotQuery(USERS_COLLECTION, "user by email", {"email": "user@example.com"}),
+    HotQuery(SAVED_MEALS_COLLECTION, "saved meals of a user", {SAVED_MEAL_USER_FIELD: 1}),
+    HotQuery(MEALS_COLLECTION, "meal by id", {"_id": ObjectId()}),
+    HotQuery(FOOD_ITEMS_COLLECTION, "food item by id", {"_id": ObjectId()}),
+    HotQuery(FOOD_ITEMS_COLLECTION, "food item by menu item id", {"menu_item_id": "530"}),
+    HotQuery(FOOD_ITEMS_COLLECTION, "food items of a restaurant", {"restaurant": "Restaurant"}),
+    HotQuery(FOOD_ITEMS_COLLECTION, "food items of a category", {"food_category": "Entrees"}),
+    HotQuery(
+        FOOD_ITEMS_COLLECTION, "food items of a restaurant category",
+        {"restaurant": "Restaurant", "food_category": "Entrees"},
+    ),
+    HotQuery(FOOD_ITEMS_COLLECTION, "candidate food items of a search", candidate_query(800, 100, 30)),
+]
+
+
+def ensure_collection_indexes(collection, indexes, create=True):
+    """
+    Create the indexes missing from a collection.
+
+    Args:
+        collection (Collection): pymongo collection
+        indexes (list): Index tuples the collection needs
+        create (bool): Only report the missing indexes when False
+
+    Returns:
+        list: Index tuples that were missing
+    """
+    existing = {tuple(info["key"]): info for info in collection.index_information().values()}
+    missing = []
+    for index in indexes:
+        info = existing.get(tuple(index.keys))
+        if info is None:
+            missing.append(index)
+            if create:
+                collection.create_index(index.keys, **index.options)
+                logger.info(f"Created index {index.keys} on {collection.name}")
+            continue
+
+        for option, value in index.options.items():
+            if info.get(option) != value:
+                logger.warning(
+                    f"Index {index.keys} on {collection.name} has {option}={info.get(option)!r}, expected {value!r}"
+                )
+    return missing
+
+
+def plan_stages(plan):
+    """
+    Return the names of every stage of an explain() query plan, including the
+    plans of each shard and the query plan of slot-based execution.
+    """
+    stages = []
+    pending = [plan]
+    while pending:
+        node = pending.pop()
+        if not isinstance(node, dict):
+            continue
+        if "stage" in node:
+            stages.append(node["stage"])
+        for child in ("inputStage", "queryPlan", "winningPlan"):
+            if child in node:
+                pending.append(node[child])
+        pending.extend(node.get("inputStages", []))
+        pending.extend(node.get("shards", []))
+    return stages
+
+
+def explain_query(collection, query_filter):
+    """Return the stage names of the winning plan MongoDB picks for a find() filter."""
+    explanation = collection.find(query_filter).explain()
+    return plan_stages(explanation["queryPlanner"]["winningPlan"])
@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.search.db import SEARCH_CACHE_COLLECTION, get_database
+from apps.search.indexes import HOT_QUERIES, REQUIRED_INDEXES, ensure_collection_indexes, explain_query
+from apps.search.persistent_cache import purge_stale_documents
+
+
+class Command(BaseCommand):
+    help = (
+        "Create the indexes the hot queries need and check with explain() that none of "
+        "them scans a whole collection. Fails when a query plan uses a COLLSCAN."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check", action="store_true",
+            help="Only report missing indexes instead of creating them, and fail when any is missing.",
+        )
+        parser.add_argument(
+            "--skip-explain", action="store_true",
+            help="Do not explain the hot queries.",
+        )
+
+    def handle(self, *args, **options):
+        database = get_database()
+        create = not options["check"]
+        failures = []
+
+        if create:
+            # Old-layout and duplicate cache documents would block the unique key index
+            deleted = purge_stale_documents(database[SEARCH_CACHE_COLLECTION])
+            if deleted:
+                self.stdout.write(f"Deleted {deleted} stale documents from {SEARCH_CACHE_COLLECTION}")
+
+        for collection_name, indexes in REQUIRED_INDEXES.items():
+            missing = ensure_collection_indexes(database[collection_name], indexes, create=create)
+            for index in missing:
+                if create:
+                    self.stdout.write(f"Created index {index.keys} on {collection_name}")
+                else:
+                    failures.append(f"{collection_name}: missing index {index.keys}")
+        if create:
+            self.stdout.write(self.style.SUCCESS("Indexes are in place."))
+
+        if not options["skip_explain"]:
+            for query in HOT_QUERIES:
+                stages = explain_query(database[query.collection], query.filter)
+                plan = " <- ".join(stages)
+                if "COLLSCAN" in stages:
+                    failures.append(f"{query.collection}: {query.description} scans the collection ({plan})")
+                    self.stdout.write(self.style.ERROR(f"COLLSCAN  {query.collection}: {query.description}"))
+                else:
+                    self.stdout.write(f"ok        {query.collection}: {query.description} ({plan})")
+
+        if failures:
+            raise CommandError("Index check failed:\n" + "\n".join(failures))
+        if not options["skip_explain"]:
+            self.stdout.write(self.style.SUCCESS("Every hot query uses an index."))
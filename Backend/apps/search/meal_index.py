@@ -0,0 +1,271 @@
+import heapq
+import logging
+import time
+
+import numpy as np
+from django.conf import settings
+
+from .branch_and_bound import BOUND_TOLERANCE, branch_and_bound_top_meals, lower_bound
+from .engine import _combo_table
+
+logger = logging.getLogger(__name__)
+
+"""
+K-d tree index over the precomputed meal space of each restaurant.
+
+Ranked search is a nearest-neighbour query in (calories, protein, carbs,
+fats) space restricted to the box given by the calorie, carb and fat limits.
+Each index holds every meal of 1-5 items (0-2 entrees, 0-2 sides, 0-1
+dessert) of one restaurant, ignoring limits, so it is built once per catalog.
+A query walks the trees of all restaurants best-first, using the same lower
+bound as the branch-and-bound search on each node's bounding box, and re-ranks
+the meals of every visited leaf exactly with calculate_rmse.
+
+Restaurants whose meal space exceeds SEARCH_MEAL_INDEX_MAX_MEALS, or whose
+items have negative macros, are not indexed and are searched with branch and
+bound instead.
+"""
+
+# Meals per leaf of the tree
+LEAF_SIZE = 64
+
+
+class MealIndex:
+    """
+    K-d tree over every meal of one restaurant.
+
+    Meals are stored as (entree combo, side combo, dessert) rows into the
+    combo tables of the restaurant's full menu, permuted so that each tree
+    node covers a contiguous range of rows. Nodes keep the bounding box of the
+    meal totals they cover.
+    """
+
+    def __init__(self, catalog, menu, leaf_size=LEAF_SIZE):
+        self.restaurant = menu.restaurant
+        self.entree_first, self.entree_second, self.entree_sums = _combo_table(
+            catalog, menu.entrees, np.inf, np.inf, np.inf)
+        self.side_first, self.side_second, self.side_sums = _combo_table(
+            catalog, menu.sides, np.inf, np.inf, np.inf)
+        self.dessert_first, _, self.dessert_sums = _combo_table(
+            catalog, menu.desserts, np.inf, np.inf, np.inf, allow_pairs=False)
+
+        side_count, dessert_count = self.side_sums.shape[1], self.dessert_sums.shape[1]
+        grid = np.arange(self.entree_sums.shape[1] * side_count * dessert_count)[1:]  # skip the empty meal
+        self.entree_rows = (grid // (side_count * dessert_count)).astype(np.int32)
+        self.side_rows = (grid // dessert_count % side_count).astype(np.int32)
+        self.dessert_rows = (grid % dessert_count).astype(np.int32)
+
+        self._build_tree(self._totals(np.arange(len(grid))).T, leaf_size)
+
+    def __len__(self):
+        return len(self.entree_rows)
+
+    def _totals(self, rows):
+        """Macro totals of meal rows, summed in the same order as the engines."""
+        return (
+            self.entree_sums[:, self.entree_rows[rows]] + self.side_sums[:, self.side_rows[rows]]
+        ) + self.dessert_sums[:, self.dessert_rows[rows]]
+
+    def _build_tree(self, points, leaf_size):
+        order = np.arange(len(points))
+        lows, highs, starts, ends, lefts, rights = [], [], [], [], [], []
+
+        def add_node(start, end):
+            node_points = points[order[start:end]]
+            lows.append(node_points.min(axis=0))
+            highs.append(node_points.max(axis=0))
+            starts.append(start)
+            ends.append(end)
+            lefts.append(-1)
+            rights.append(-1)
+            return len(starts) - 1
+
+        stack = [add_node(0, len(points))] if len(points) else []
+        while stack:
+            node = stack.pop()
+            start, end = starts[node], ends[node]
+            if end - start <= leaf_size:
+                continue
+
+            # Split at the median of the widest dimension
+            spread = highs[node] - lows[node]
+            dim = int(np.argmax(spread))
+            if spread[dim] <= 0:
+                continue
+            middle = (start + end) // 2
+            segment = order[start:end]
+            order[start:end] = segment[np.argpartition(points[segment, dim], middle - start)]
+
+            lefts[node] = add_node(start, middle)
+            rights[node] = add_node(middle, end)
+            stack.extend([lefts[node], rights[node]])
+
+        # Store rows in tree order so every node is a contiguous range
+        self.entree_rows = self.entree_rows[order]
+        self.side_rows = self.side_rows[order]
+        self.dessert_rows = self.dessert_rows[order]
+        self.node_lows = np.array(lows).reshape(-1, 4).tolist()
+        self.node_highs = np.array(highs).reshape(-1, 4).tolist()
+        self.node_starts = starts
+        self.node_ends = ends
+        self.node_lefts = lefts
+        self.node_rights = rights
+
+    def node_bound(self, node, target):
+        """Lower bound on the mean squared error of the node's meals, or None when none fits the limits."""
+        low = self.node_lows[node]
+        if low[0] > target[0] or low[2] > target[2] or low[3] > target[3]:
+            return None
+        return lower_bound(self.node_highs[node], (0, 0, 0, 0), target)
+
+    def leaf_meals(self, node, calorie_limit, carb_limit, fat_limit):
+        """Return (entree row, side row, dessert row, totals) for each meal of a leaf within the limits."""
+        rows = np.arange(self.node_starts[node], self.node_ends[node])
+        e, s, d = self.entree_rows[rows], self.side_rows[rows], self.dessert_rows[rows]
+        entree_sums, side_sums = self.entree_sums[:, e], self.side_sums[:, s]
+        totals = (entree_sums + side_sums) + self.dessert_sums[:, d]
+
+        # The engines' limit checks; item and pair checks follow from these as macros are never negative
+        valid = (
+            ((calorie_limit - entree_sums[0]) - side_sums[0] >= 0)
+            & ((carb_limit - entree_sums[2]) - side_sums[2] >= 0)
+            & ((fat_limit - entree_sums[3]) - side_sums[3] >= 0)
+            & (totals[0] <= calorie_limit)
+            & (totals[2] <= carb_limit)
+            & (totals[3] <= fat_limit)
+        )
+        keep = np.flatnonzero(valid)
+        return zip(e[keep].tolist(), s[keep].tolist(), d[keep].tolist(), totals[:, keep].T.tolist())
+
+    def meal_items(self, entree_row, side_row, dessert_row):
+        """Catalog indices of the items of a meal."""
+        slots = (
+            self.entree_first[entree_row], self.entree_second[entree_row],
+            self.side_first[side_row], self.side_second[side_row],
+            self.dessert_first[dessert_row],
+        )
+        return [int(item) for item in slots if item >= 0]
+
+
+def get_meal_index(catalog, restaurant):
+    """Return the MealIndex of a restaurant, building it on first use, or None when it is not indexed."""
+    indexes = catalog.derived.setdefault("meal_indexes", {})
+    if restaurant in indexes:
+        return indexes[restaurant]
+
+    menu = catalog.restaurant_menu(restaurant)
+    items = np.concatenate([menu.entrees, menu.sides, menu.desserts])
+    macros = np.stack([catalog.calories[items], catalog.protein[items], catalog.carbohydrates[items], catalog.fats[items]])
+
+    entree_count = len(menu.entrees)
+    side_count = len(menu.sides)
+    meal_count = (
+        (1 + entree_count + entree_count * (entree_count - 1) // 2)
+        * (1 + side_count + side_count * (side_count - 1) // 2)
+        * (1 + len(menu.desserts))
+    )
+    if (macros < 0).any() or meal_count > getattr(settings, "SEARCH_MEAL_INDEX_MAX_MEALS", 200000):
+        index = None
+    else:
+        start_time = time.time()
+        index = MealIndex(catalog, menu)
+        logger.info(f"Indexed {len(index)} meals for {restaurant} in {time.time() - start_time:.2f} seconds")
+
+    indexes[restaurant] = index
+    return index
+
+
+def indexed_top_meals(catalog, calorie_limit, protein_limit, carb_limit, fat_limit, top_n):
+    """
+    Find the top N meals by calculate_rmse by walking the meal indexes toward the target.
+
+    Args:
+        catalog (FoodCatalog): Food items to build meals from
+        calorie_limit (int): Maximum calories allowed
+        protein_limit (int): Minimum protein target in grams
+        carb_limit (int): Maximum carbohydrates allowed in grams
+        fat_limit (int): Maximum fats allowed in grams
+        top_n (int): Number of meals to return
+
+    Returns:
+        list: (rmse, meal) tuples in rank order, matching branch_and_bound_top_meals
+    """
+    from .rank_meals import calculate_rmse
+
+    if top_n <= 0:
+        return []
+
+    start_time = time.time()
+    target = (calorie_limit, protein_limit, carb_limit, fat_limit)
+    target_macros = {"calories": calorie_limit, "protein": protein_limit, "carbs": carb_limit, "fats": fat_limit}
+    positions = catalog.restaurant_positions(calorie_limit, carb_limit, fat_limit)
+
+    # Best-first frontier over the nodes of every indexed restaurant
+    frontier = []
+    unindexed = set()
+    for restaurant, position in positions.items():
+        index = get_meal_index(catalog, restaurant)
+        if index is None:
+            unindexed.add(restaurant)
+            continue
+        if not len(index):
+            continue
+        bound = index.node_bound(0, target)
+        if bound is not None:
+            frontier.append((bound, position, 0, index))
+    heapq.heapify(frontier)
+
+    # Same heap layout as branch and bound: negated (rmse, sequence) so heap[0] is the worst survivor
+    heap = []
+    visited = 0
+    while frontier:
+        bound, position, node, index = heapq.heappop(frontier)
+        if len(heap) >= top_n:
+            worst_rmse = -heap[0][0]
+            if bound > worst_rmse * worst_rmse * (1 + BOUND_TOLERANCE) + BOUND_TOLERANCE:
+                break
+
+        if index.node_lefts[node] >= 0:
+            for child in (index.node_lefts[node], index.node_rights[node]):
+                child_bound = index.node_bound(child, target)
+                if child_bound is not None:
+                    heapq.heappush(frontier, (child_bound, position, child, index))
+            continue
+
+        for entree_row, side_row, dessert_row, totals in index.leaf_meals(node, calorie_limit, carb_limit, fat_limit):
+            visited += 1
+            rmse = calculate_rmse(
+                {"calories": totals[0], "protein": totals[1], "carbs": totals[2], "fats": totals[3]},
+                target_macros,
+            )
+            neg_seq = (-position, -entree_row, -side_row, -dessert_row)
+            entry = (-rmse, neg_seq, index, (entree_row, side_row, dessert_row), totals)
+            if len(heap) < top_n:
+                heapq.heappush(heap, entry)
+            elif (-rmse, neg_seq) > heap[0][:2]:
+                heapq.heapreplace(heap, entry)
+
+    ids, names = catalog.column_lists()[:2]
+    scored = []
+    for neg_rmse, neg_seq, index, rows, totals in sorted(heap, key=lambda entry: entry[:2], reverse=True):
+        all_items = index.meal_items(*rows)
+        meal = {
+            "restaurant": index.restaurant,
+            "calories": totals[0],
+            "protein": totals[1],
+            "carbs": totals[2],
+            "fats": totals[3],
+            "food_item_ids": [ids[item] for item in all_items],
+            "item_names": [names[item] for item in all_items]
+        }
+        scored.append((-neg_rmse, -neg_seq[0], len(scored), meal))
+
+    # Restaurants without an index are searched by branch and bound and merged by (rmse, restaurant position)
+    if unindexed:
+        for rmse, meal in branch_and_bound_top_meals(
+                catalog, calorie_limit, protein_limit, carb_limit, fat_limit, top_n, restaurants=unindexed):
+            scored.append((rmse, positions[meal["restaurant"]], len(scored), meal))
+
+    scored.sort(key=lambda entry: entry[:3])
+    logger.info(f"Meal index scored {visited} meals for the top {top_n} in {time.time() - start_time:.2f} seconds")
+    return [(rmse, meal) for rmse, _, _, meal in scored[:top_n]]
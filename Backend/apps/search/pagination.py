@@ -0,0 +1,74 @@
+import base64
+import binascii
+import json
+import logging
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+"""
+Cursor pagination over meal option lists.
+
+Meals keep the engine's order, which is deterministic for given limits and
+catalog, so a page is an offset range into that order. Cursors are opaque
+URL-safe strings carrying the offset of the next page, the search parameters
+and the catalog generation; a cursor is rejected when it is used with other
+parameters or after the catalog changed, as offsets would no longer line up.
+"""
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(offset, params, generation):
+    payload = json.dumps({"o": offset, "p": list(params), "g": generation}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor, params, generation):
+    """
+    Return the offset stored in a cursor.
+
+    Raises:
+        InvalidCursor: When the cursor is malformed, belongs to other search
+            parameters or predates a catalog change
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        offset = payload["o"]
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise InvalidCursor("Invalid cursor")
+
+    if not isinstance(offset, int) or offset < 0 or payload.get("p") != list(params):
+        raise InvalidCursor("Invalid cursor")
+    if payload.get("g") != generation:
+        raise InvalidCursor("Cursor expired: the food catalog changed, restart from the first page")
+    return offset
+
+
+def page_size(limit):
+    """Clamp a requested page size to 1..SEARCH_MAX_PAGE_SIZE."""
+    return max(1, min(int(limit), getattr(settings, "SEARCH_MAX_PAGE_SIZE", 500)))
+
+
+def paginate(meals, limit, cursor, params, generation):
+    """
+    Slice one page out of a meal list.
+
+    Args:
+        meals (list): Every meal option, in engine order
+        limit (int): Requested page size
+        cursor (str): Cursor from the previous page, or None for the first page
+        params (tuple): Search parameters the cursor is bound to
+        generation (int): Current food catalog generation
+
+    Returns:
+        tuple: (page, next_cursor) where next_cursor is None on the last page
+    """
+    offset = decode_cursor(cursor, params, generation) if cursor else 0
+    end = offset + page_size(limit)
+    next_cursor = encode_cursor(end, params, generation) if end < len(meals) else None
+    return meals[offset:end], next_cursor
@@ -0,0 +1,162 @@
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+import numpy as np
+from django.apps import apps
+from django.conf import settings
+
+from .branch_and_bound import branch_and_bound_top_meals
+from .catalog import ROLE_DESSERT, ROLE_ENTREE, ROLE_SIDE
+from .engine import generate_meals, get_engine
+
+logger = logging.getLogger(__name__)
+
+"""
+Parallel enumeration across restaurants.
+
+The meals of each restaurant are independent, so restaurants are split into
+chunks that run in a pool of worker processes (SEARCH_PARALLEL_WORKERS). Each
+task gets a catalog holding only the candidate items of its restaurants and
+returns either its meals, grouped by restaurant, or its local top N. Results
+are merged back in the serial restaurant order, so the output is identical to
+the serial path.
+"""
+
+# Chunks per worker, so that one heavy restaurant does not leave other workers idle
+CHUNKS_PER_WORKER = 2
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _init_worker():
+    # Spawned workers start without Django; forked ones already have it set up
+    if not apps.ready:
+        os.environ.setdefault("DJANGO_SETTINGS_MODULE", "macrosondemand.settings")
+        django.setup()
+
+
+def _reset_executor():
+    # A forked child (e.g. a gunicorn worker) must not reuse its parent's pool
+    global _executor
+    _executor = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_executor)
+
+
+def parallel_workers():
+    """Number of worker processes for searches; 0 or 1 keeps searches serial."""
+    return getattr(settings, "SEARCH_PARALLEL_WORKERS", 0) or 0
+
+
+def get_executor():
+    """Return the process-wide pool of search workers, creating it on first use."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("fork" if "fork" in methods else "spawn")
+            _executor = ProcessPoolExecutor(
+                max_workers=parallel_workers(), mp_context=context, initializer=_init_worker
+            )
+        return _executor
+
+
+def _chunk_catalogs(catalog, calorie_limit, carb_limit, fat_limit):
+    """
+    Split the candidate items of a search into per-chunk catalogs.
+
+    Returns (chunks, positions) where positions maps each restaurant to its
+    position in the serial restaurant order.
+    """
+    candidates = np.flatnonzero(catalog.candidate_mask(calorie_limit, carb_limit, fat_limit))
+    positions = catalog.restaurant_positions(calorie_limit, carb_limit, fat_limit)
+    chunk_count = min(len(positions), parallel_workers() * CHUNKS_PER_WORKER)
+    if chunk_count <= 1:
+        return [catalog.take(candidates)] if len(positions) else [], positions
+
+    # Estimate each restaurant's work by its combo counts and spread the heaviest first
+    codes = catalog.restaurant_codes[candidates]
+    roles = catalog.roles[candidates]
+    work = {}
+    for restaurant in positions:
+        in_restaurant = codes == catalog.restaurant_lookup[restaurant]
+        entrees = np.count_nonzero(in_restaurant & (roles == ROLE_ENTREE))
+        sides = np.count_nonzero(in_restaurant & (roles == ROLE_SIDE))
+        desserts = np.count_nonzero(in_restaurant & (roles == ROLE_DESSERT))
+        work[restaurant] = (1 + entrees * (entrees + 1) / 2) * (1 + sides * (sides + 1) / 2) * (1 + desserts)
+
+    loads = [0.0] * chunk_count
+    members = [[] for _ in range(chunk_count)]
+    for restaurant in sorted(work, key=work.get, reverse=True):
+        chunk = loads.index(min(loads))
+        loads[chunk] += work[restaurant]
+        members[chunk].append(catalog.restaurant_lookup[restaurant])
+
+    chunks = [catalog.take(candidates[np.isin(codes, chunk_codes)]) for chunk_codes in members if chunk_codes]
+    return chunks, positions
+
+
+def _enumerate_chunk(catalog, calorie_limit, carb_limit, fat_limit, engine):
+    """Worker task: the meals of a chunk, grouped by restaurant."""
+    meals_by_restaurant = {}
+    for meal in generate_meals(catalog, calorie_limit, carb_limit, fat_limit, engine=engine):
+        meals_by_restaurant.setdefault(meal["restaurant"], []).append(meal)
+    return meals_by_restaurant
+
+
+def _top_meals_chunk(catalog, calorie_limit, protein_limit, carb_limit, fat_limit, top_n):
+    """Worker task: the local top N of a chunk as (rmse, meal) tuples in rank order."""
+    return branch_and_bound_top_meals(catalog, calorie_limit, protein_limit, carb_limit, fat_limit, top_n)
+
+
+def parallel_generate_meals(catalog, calorie_limit, carb_limit, fat_limit, engine=None):
+    """Return the same list of meals as generate_meals, enumerated across worker processes."""
+    start_time = time.time()
+    engine = engine or getattr(settings, "SEARCH_ENGINE", "numpy")
+    get_engine(engine)  # fail fast on an unknown engine
+    chunks, positions = _chunk_catalogs(catalog, calorie_limit, carb_limit, fat_limit)
+
+    executor = get_executor()
+    futures = [
+        executor.submit(_enumerate_chunk, chunk, calorie_limit, carb_limit, fat_limit, engine)
+        for chunk in chunks
+    ]
+    meals_by_restaurant = {}
+    for future in futures:
+        meals_by_restaurant.update(future.result())
+
+    valid_meals = []
+    for restaurant in sorted(meals_by_restaurant, key=positions.get):
+        valid_meals.extend(meals_by_restaurant[restaurant])
+
+    logger.info(f"Enumerated {len(valid_meals)} meals in {len(chunks)} parallel chunks in {time.time() - start_time:.2f} seconds")
+    return valid_meals
+
+
+def parallel_top_meals(catalog, calorie_limit, protein_limit, carb_limit, fat_limit, top_n):
+    """Return the same (rmse, meal) list as branch_and_bound_top_meals, searched across worker processes."""
+    if top_n <= 0:
+        return []
+
+    chunks, positions = _chunk_catalogs(catalog, calorie_limit, carb_limit, fat_limit)
+    executor = get_executor()
+    futures = [
+        executor.submit(_top_meals_chunk, chunk, calorie_limit, protein_limit, carb_limit, fat_limit, top_n)
+        for chunk in chunks
+    ]
+
+    # Each chunk's list is in rank order; ties across chunks break by restaurant position
+    scored = []
+    for future in futures:
+        for local_rank, (rmse, meal) in enumerate(future.result()):
+            scored.append((rmse, positions[meal["restaurant"]], local_rank, meal))
+    scored.sort(key=lambda entry: entry[:3])
+    return [(rmse, meal) for rmse, _, _, meal in scored[:top_n]]
@@ -0,0 +1,77 @@
+import logging
+
+from .engine import generate_meals
+
+logger = logging.getLogger(__name__)
+
+"""
+Per-restaurant partitions of cached meal lists.
+
+A restaurant's meals for given limits only depend on that restaurant's items,
+so cached lists record the fingerprint (FoodCatalog.restaurant_fingerprints)
+of every restaurant they cover. When the catalog changes, a cached list is
+split back into its restaurant partitions, the partitions whose fingerprint
+still matches are kept, and only the other restaurants are enumerated again
+before the partitions are merged in the current restaurant order.
+"""
+
+
+def partition_fingerprints(catalog, calorie_limit, carb_limit, fat_limit):
+    """Fingerprints of the restaurants with meals within the limits, in restaurant order."""
+    fingerprints = catalog.restaurant_fingerprints()
+    positions = catalog.restaurant_positions(calorie_limit, carb_limit, fat_limit)
+    return {restaurant: fingerprints[restaurant] for restaurant in positions}
+
+
+def split_partitions(meals, fingerprints):
+    """
+    Split a merged meal list into restaurant partitions.
+
+    Args:
+        meals (list): Meals grouped by restaurant, as the engine yields them
+        fingerprints (dict): Fingerprint of each restaurant the list covers
+
+    Returns:
+        dict: {restaurant: (fingerprint, meals)}
+    """
+    partitions = {restaurant: (fingerprint, []) for restaurant, fingerprint in fingerprints.items()}
+    start = 0
+    for end in range(1, len(meals) + 1):
+        if end == len(meals) or meals[end]["restaurant"] != meals[start]["restaurant"]:
+            restaurant = meals[start]["restaurant"]
+            if restaurant in partitions:
+                partitions[restaurant] = (partitions[restaurant][0], meals[start:end])
+            start = end
+    return partitions
+
+
+def merge_partitions(catalog, partitions, calorie_limit, carb_limit, fat_limit):
+    """
+    Merge cached restaurant partitions, enumerating the restaurants whose items changed.
+
+    Args:
+        catalog (FoodCatalog): Current food catalog
+        partitions (dict): {restaurant: (fingerprint, meals)} from a cached list
+        calorie_limit (int): Maximum calories allowed
+        carb_limit (int): Maximum carbohydrates allowed in grams
+        fat_limit (int): Maximum fats allowed in grams
+
+    Returns:
+        tuple: (meals, fingerprints, refreshed) where refreshed lists the restaurants
+            that were enumerated again
+    """
+    fingerprints = partition_fingerprints(catalog, calorie_limit, carb_limit, fat_limit)
+    refreshed = [
+        restaurant for restaurant, fingerprint in fingerprints.items()
+        if restaurant not in partitions or partitions[restaurant][0] != fingerprint
+    ]
+
+    fresh = {restaurant: [] for restaurant in refreshed}
+    if refreshed:
+        for meal in generate_meals(catalog, calorie_limit, carb_limit, fat_limit, restaurants=set(refreshed)):
+            fresh[meal["restaurant"]].append(meal)
+
+    meals = []
+    for restaurant in fingerprints:
+        meals.extend(fresh[restaurant] if restaurant in fresh else partitions[restaurant][1])
+    return meals, fingerprints, refreshed
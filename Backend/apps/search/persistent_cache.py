@@ -0,0 +1,261 @@
+import asyncio
+import logging
+import threading
+import zlib
+from datetime import datetime, timedelta
+
+import numpy as np
+from bson.binary import Binary
+from django.conf import settings
+
+from .db import search_cache_collection
+from .engine import _build_meals
+
+logger = logging.getLogger(__name__)
+
+"""
+Compact storage of meal lists in the search_cache collection.
+
+Instead of the full meal dicts, a document holds the ids of the items its
+meals use and one zlib-compressed binary field with, per meal, up to five
+indices into that id list and the four macro totals:
+
+    {
+        "key": "<cache key>",
+        "format": PACKED_FORMAT,
+        "count": 1234,
+        "limits": [800, 100, 30],
+        "generation": 12,
+        "partitions": [["Restaurant", "<fingerprint>", 0, 120], ...],
+        "item_ids": ["67cbcd5d57283efc873ae064", ...],
+        "meals": Binary(zlib(int32 item slots (count x 5) + float64 totals (4 x count))),
+        "created_at": datetime,
+        "expires_at": datetime
+    }
+
+Partitions give the fingerprint and row range of each restaurant's meals.
+Meal dicts are rebuilt from the catalog on read, for the restaurants whose
+fingerprint still matches the catalog only, so documents stay small, never
+repeat item names and survive edits to other restaurants. A TTL index on
+expires_at drops entries after SEARCH_PERSISTENT_CACHE_TTL seconds, and lists
+with more than SEARCH_PERSISTENT_CACHE_MAX_MEALS meals are not stored.
+Documents in older layouts are ignored on read. Before the unique key index is
+built, purge_stale_documents() deletes them, as they have no expires_at for the
+TTL index to drop them by, together with the duplicate documents of a key that
+concurrent upserts left behind before the index existed.
+"""
+
+# Version tag of the packed document layout
+PACKED_FORMAT = 2
+
+# Item slots per meal: two entrees, two sides and a dessert
+MEAL_SLOTS = 5
+
+# MongoDB rejects documents over 16 MB; leave room for the other fields
+MAX_DOCUMENT_BYTES = 15 * 1024 * 1024
+
+_indexed_collections = set()
+_index_lock = threading.Lock()
+
+
+def purge_stale_documents(cache_collection, batch_size=1000):
+    """
+    Delete the search_cache documents in older layouts, and every document of a
+    key but its newest one.
+
+    Args:
+        cache_collection (Collection): pymongo search_cache collection
+        batch_size (int): Duplicate documents deleted per delete_many
+
+    Returns:
+        int: Number of deleted documents
+    """
+    deleted = cache_collection.delete_many({"format": {"$ne": PACKED_FORMAT}}).deleted_count
+
+    newest = {}
+    duplicates = []
+    for document in cache_collection.find({}, {"key": 1, "created_at": 1}):
+        kept = newest.get(document.get("key"))
+        if kept is None:
+            newest[document.get("key")] = document
+        elif (document.get("created_at") or datetime.min) > (kept.get("created_at") or datetime.min):
+            duplicates.append(kept["_id"])
+            newest[document.get("key")] = document
+        else:
+            duplicates.append(document["_id"])
+    for start in range(0, len(duplicates), batch_size):
+        deleted += cache_collection.delete_many({"_id": {"$in": duplicates[start:start + batch_size]}}).deleted_count
+
+    if deleted:
+        logger.info(f"Deleted {deleted} stale documents from {cache_collection.full_name}")
+    return deleted
+
+
+def _has_unique_key_index(cache_collection):
+    return any(
+        info["key"] == [("key", 1)] and info.get("unique")
+        for info in cache_collection.index_information().values()
+    )
+
+
+def ensure_cache_indexes(cache_collection):
+    """
+    Create the key and expiry indexes of the cache collection once per process,
+    purging the stale documents first while the unique key index is missing.
+    """
+    name = cache_collection.full_name
+    if name in _indexed_collections:
+        return
+    with _index_lock:
+        if name in _indexed_collections:
+            return
+        if not _has_unique_key_index(cache_collection):
+            purge_stale_documents(cache_collection)
+        cache_collection.create_index("key", unique=True)
+        cache_collection.create_index("expires_at", expireAfterSeconds=0)
+        _indexed_collections.add(name)
+
+
+async def async_ensure_cache_indexes(cache_collection):
+    """ensure_cache_indexes() for a Motor collection, run with pymongo on the default executor."""
+    if cache_collection.full_name in _indexed_collections:
+        return
+    await asyncio.get_running_loop().run_in_executor(None, ensure_cache_indexes, search_cache_collection())
+
+
+def pack_meals(meals):
+    """
+    Encode meals as item id references and a compressed binary blob.
+
+    Args:
+        meals (list): Meal option dicts
+
+    Returns:
+        tuple: (item_ids, blob)
+    """
+    item_ids = []
+    local_index = {}
+    slots = np.full((len(meals), MEAL_SLOTS), -1, dtype=np.int32)
+    totals = np.empty((4, len(meals)), dtype=np.float64)
+
+    for row, meal in enumerate(meals):
+        for slot, item_id in enumerate(meal["food_item_ids"]):
+            if item_id not in local_index:
+                local_index[item_id] = len(item_ids)
+                item_ids.append(item_id)
+            slots[row, slot] = local_index[item_id]
+        totals[:, row] = (meal["calories"], meal["protein"], meal["carbs"], meal["fats"])
+
+    blob = zlib.compress(slots.tobytes() + totals.tobytes())
+    return item_ids, blob
+
+
+def pack_partitions(meals, fingerprints):
+    """Row range of each covered restaurant's meals as [restaurant, fingerprint, start, end] lists."""
+    ranges = {}
+    start = 0
+    for end in range(1, len(meals) + 1):
+        if end == len(meals) or meals[end]["restaurant"] != meals[start]["restaurant"]:
+            ranges[meals[start]["restaurant"]] = (start, end)
+            start = end
+    return [[restaurant, fingerprint, *ranges.get(restaurant, (0, 0))] for restaurant, fingerprint in fingerprints.items()]
+
+
+def unpack_partitions(catalog, item_ids, blob, count, partitions):
+    """
+    Rebuild the meal dicts of the partitions that still match the catalog.
+
+    Returns:
+        dict: {restaurant: (fingerprint, meals)} for every partition whose fingerprint
+            equals the restaurant's current fingerprint
+    """
+    fingerprints = catalog.restaurant_fingerprints()
+    valid = [partition for partition in partitions if fingerprints.get(partition[0]) == partition[1]]
+    if not valid:
+        return {}
+
+    # Items missing from the catalog can only belong to changed restaurants; they map to -2
+    positions = catalog.item_positions()
+    item_positions = np.array([positions.get(item_id, -2) for item_id in item_ids] + [-1], dtype=np.int64)
+
+    raw = zlib.decompress(blob)
+    slot_bytes = count * MEAL_SLOTS * np.dtype(np.int32).itemsize
+    slots = np.frombuffer(raw[:slot_bytes], dtype=np.int32).reshape(count, MEAL_SLOTS)
+    totals = np.frombuffer(raw[slot_bytes:], dtype=np.float64).reshape(4, count)
+
+    unpacked = {}
+    for restaurant, fingerprint, start, end in valid:
+        # Local index -1 maps to the trailing -1, keeping unused slots empty
+        items = item_positions[slots[start:end]]
+        if (items == -2).any():
+            continue
+        meals = list(_build_meals(catalog, restaurant, items, totals[:, start:end]))
+        unpacked[restaurant] = (fingerprint, meals)
+    return unpacked
+
+
+def load_cached_partitions(cache_collection, cache_key, catalog):
+    """
+    Read the still valid restaurant partitions of a meal list from the search_cache collection.
+
+    Returns:
+        dict: {restaurant: (fingerprint, meals)}, empty on a miss
+    """
+    return document_partitions(cache_collection.find_one({"key": cache_key}), catalog)
+
+
+def document_partitions(document, catalog):
+    """Return the still valid restaurant partitions of a search_cache document, empty for None."""
+    if not document or document.get("format") != PACKED_FORMAT or catalog is None:
+        return {}
+    return unpack_partitions(
+        catalog, document["item_ids"], document["meals"], document["count"], document["partitions"])
+
+
+def store_cached_meals(cache_collection, cache_key, meals, fingerprints, limits=None, generation=0):
+    """
+    Write a meal list and the fingerprints of its restaurants to the search_cache
+    collection in the packed format.
+
+    Returns:
+        bool: Whether the list was stored
+    """
+    document = cache_document(cache_key, meals, fingerprints, limits, generation)
+    if document is None:
+        return False
+    ensure_cache_indexes(cache_collection)
+    cache_collection.replace_one({"key": cache_key}, document, upsert=True)
+    return True
+
+
+def cache_document(cache_key, meals, fingerprints, limits=None, generation=0):
+    """
+    Pack a meal list into a search_cache document.
+
+    Returns:
+        dict: The document, or None when the list is too large to be stored
+    """
+    max_meals = getattr(settings, "SEARCH_PERSISTENT_CACHE_MAX_MEALS", 500000)
+    if len(meals) > max_meals:
+        logger.info(f"Not storing {len(meals)} meals for key {cache_key}: over the limit of {max_meals}")
+        return None
+
+    item_ids, blob = pack_meals(meals)
+    if len(blob) + 64 * len(item_ids) > MAX_DOCUMENT_BYTES:
+        logger.info(f"Not storing {len(meals)} meals for key {cache_key}: {len(blob)} bytes is too large")
+        return None
+
+    ttl = getattr(settings, "SEARCH_PERSISTENT_CACHE_TTL", 7 * 24 * 3600)
+    return {
+        "key": cache_key,
+        "format": PACKED_FORMAT,
+        "count": len(meals),
+        "limits": list(limits) if limits is not None else None,
+        "generation": generation,
+        "partitions": pack_partitions(meals, fingerprints),
+        "item_ids": item_ids,
+        "meals": Binary(blob),
+        "created_at": datetime.now(),
+        # TTL indexes compare against UTC
+        "expires_at": datetime.utcnow() + timedelta(seconds=ttl),
+    }
@@ -1,5 +1,11 @@
+import heapq
 import math
-from .script import check_meal_options
+import numpy as np
+from django.conf import settings
+from .branch_and_bound import branch_and_bound_top_meals
+from .meal_index import indexed_top_meals
+from .parallel import parallel_top_meals, parallel_workers
+from .script import check_meal_options, has_cached_meal_options, iter_meal_options, load_catalog
 
 def calculate_rmse(actual, target):
     """
@@ -66,40 +72,10 @@ def rank_meal_options(calorie_limit, protein_limit, carb_limit, fat_limit):
     }
     
     # Calculate RMSE for each meal
-    ranked_meals = []
-    for meal in valid_meals:
-        actual_macros = {
-            "calories": meal["calories"],
-            "protein": meal["protein"],
-            "carbs": meal["carbs"],
-            "fats": meal["fats"]
-        }
-        
-        # Calculate percentage utilization for each macro
-        utilization = {
-            "calories": (meal["calories"] / calorie_limit) * 100 if calorie_limit > 0 else 0,
-            "protein": (meal["protein"] / protein_limit) * 100 if protein_limit > 0 else 0,
-            "carbs": (meal["carbs"] / carb_limit) * 100 if carb_limit > 0 else 0,
-            "fats": (meal["fats"] / fat_limit) * 100 if fat_limit > 0 else 0
-        }
-        
-        # Calculate average utilization
-        avg_utilization = sum(utilization.values()) / len(utilization)
-        
-        # Calculate RMSE
-        rmse = calculate_rmse(actual_macros, target_macros)
-        
-        # Add ranking information to the meal
-        ranked_meal = {
-            "meal": meal,
-            "rmse": rmse,
-            "avg_utilization": avg_utilization,
-            "utilization": utilization,
-            "protein_target_met": meal["protein"] >= protein_limit,
-            "protein_percentage": (meal["protein"] / protein_limit) * 100 if protein_limit > 0 else 0
-        }
-        
-        ranked_meals.append(ranked_meal)
+    ranked_meals = [
+        build_ranked_meal(meal, calculate_rmse(meal, target_macros), target_macros)
+        for meal in valid_meals
+    ]
     
     # Sort meals by RMSE (lower is better)
     ranked_meals.sort(key=lambda x: x["rmse"])
@@ -110,6 +86,99 @@ def rank_meal_options(calorie_limit, protein_limit, carb_limit, fat_limit):
     
     return ranked_meals
 
+def build_ranked_meal(meal, rmse, target_macros):
+    """
+    Attach utilization and protein details to a scored meal.
+    
+    Args:
+        meal (dict): Meal option from the search engine
+        rmse (float): RMSE of the meal against the target macros
+        target_macros (dict): Target calories, protein, carbs and fats
+        
+    Returns:
+        dict: Ranking information for the meal (without a rank)
+    """
+    calorie_limit = target_macros["calories"]
+    protein_limit = target_macros["protein"]
+    carb_limit = target_macros["carbs"]
+    fat_limit = target_macros["fats"]
+
+    # Calculate percentage utilization for each macro
+    utilization = {
+        "calories": (meal["calories"] / calorie_limit) * 100 if calorie_limit > 0 else 0,
+        "protein": (meal["protein"] / protein_limit) * 100 if protein_limit > 0 else 0,
+        "carbs": (meal["carbs"] / carb_limit) * 100 if carb_limit > 0 else 0,
+        "fats": (meal["fats"] / fat_limit) * 100 if fat_limit > 0 else 0
+    }
+    
+    # Calculate average utilization
+    avg_utilization = sum(utilization.values()) / len(utilization)
+    
+    return {
+        "meal": meal,
+        "rmse": rmse,
+        "avg_utilization": avg_utilization,
+        "utilization": utilization,
+        "protein_target_met": meal["protein"] >= protein_limit,
+        "protein_percentage": (meal["protein"] / protein_limit) * 100 if protein_limit > 0 else 0
+    }
+
+def stream_top_meals(meals, target_macros, top_n, key=None):
+    """
+    Keep the top N meals by RMSE from a stream of meals using bounded heaps.
+    
+    Only the survivors get full ranking details. Ties keep the order in which
+    meals were produced, so ranks match sorting the full list by RMSE.
+    
+    Args:
+        meals (iterable): Meal options, e.g. a generator from the search engine
+        target_macros (dict): Target calories, protein, carbs and fats
+        top_n (int): Number of meals to keep (per group when key is given)
+        key (callable): Optional function mapping a meal to a group; the top N
+            is then kept separately for each group
+        
+    Returns:
+        dict: Maps each group (None without a key) to its ranked meals in rank
+        order. Ranks are positions in the overall ranking of all meals.
+    """
+    heaps = {}
+    # Overall ranks of grouped survivors need every score, not just the survivors'
+    all_rmse = [] if key else None
+    
+    for seq, meal in enumerate(meals):
+        rmse = calculate_rmse(meal, target_macros)
+        if all_rmse is not None:
+            all_rmse.append(rmse)
+        if top_n <= 0:
+            continue
+        
+        heap = heaps.setdefault(key(meal) if key else None, [])
+        # Heap entries are negated so heap[0] is the worst survivor
+        entry = (-rmse, -seq, meal)
+        if len(heap) < top_n:
+            heapq.heappush(heap, entry)
+        elif rmse < -heap[0][0]:
+            heapq.heapreplace(heap, entry)
+    
+    overall_ranks = None
+    if all_rmse:
+        order = np.argsort(np.array(all_rmse), kind="stable")
+        overall_ranks = np.empty(len(order), dtype=np.int64)
+        overall_ranks[order] = np.arange(1, len(order) + 1)
+    
+    top_meals = {}
+    for group, heap in heaps.items():
+        survivors = sorted(heap, key=lambda entry: (-entry[0], -entry[1]))
+        ranked_meals = []
+        for position, (neg_rmse, neg_seq, meal) in enumerate(survivors, 1):
+            ranked_meal = build_ranked_meal(meal, -neg_rmse, target_macros)
+            ranked_meal["rank"] = int(overall_ranks[-neg_seq]) if overall_ranks is not None else position
+            ranked_meals.append(ranked_meal)
+        top_meals[group] = ranked_meals
+    
+    # Groups come in the order of their best meal, as when grouping a full ranking
+    return dict(sorted(top_meals.items(), key=lambda item: item[1][0]["rank"]))
+
 def get_top_ranked_meals(calorie_limit, protein_limit, carb_limit, fat_limit, top_n=10):
     """
     Get the top N ranked meal options.
@@ -124,8 +193,38 @@ def get_top_ranked_meals(calorie_limit, protein_limit, carb_limit, fat_limit, to
     Returns:
         list: Top N ranked meal options
     """
-    ranked_meals = rank_meal_options(calorie_limit, protein_limit, carb_limit, fat_limit)
-    return ranked_meals[:min(top_n, len(ranked_meals))]
+    target_macros = {
+        "calories": calorie_limit,
+        "protein": protein_limit,
+        "carbs": carb_limit,
+        "fats": fat_limit
+    }
+    
+    # Branch and bound and the meal index avoid enumerating the full meal space,
+    # unless the full list is already cached
+    ranked_mode = getattr(settings, "SEARCH_RANKED_MODE", "branch_and_bound")
+    if ranked_mode in ("branch_and_bound", "index") and not has_cached_meal_options(
+            calorie_limit, protein_limit, carb_limit, fat_limit):
+        catalog = load_catalog((calorie_limit, carb_limit, fat_limit))
+        if catalog is None:
+            return []
+        
+        if ranked_mode == "index":
+            search = indexed_top_meals
+        elif parallel_workers() > 1:
+            search = parallel_top_meals
+        else:
+            search = branch_and_bound_top_meals
+        ranked_meals = []
+        top_meals = search(catalog, calorie_limit, protein_limit, carb_limit, fat_limit, top_n)
+        for rank, (rmse, meal) in enumerate(top_meals, 1):
+            ranked_meal = build_ranked_meal(meal, rmse, target_macros)
+            ranked_meal["rank"] = rank
+            ranked_meals.append(ranked_meal)
+        return ranked_meals
+    
+    meals = iter_meal_options(calorie_limit, protein_limit, carb_limit, fat_limit)
+    return stream_top_meals(meals, target_macros, top_n).get(None, [])
 
 def get_top_ranked_meals_by_restaurant(calorie_limit, protein_limit, carb_limit, fat_limit, top_n_per_restaurant=3):
     """
@@ -141,22 +240,16 @@ def get_top_ranked_meals_by_restaurant(calorie_limit, protein_limit, carb_limit,
     Returns:
         dict: Dictionary mapping restaurant names to lists of their top N ranked meal options
     """
-    ranked_meals = rank_meal_options(calorie_limit, protein_limit, carb_limit, fat_limit)
-    
-    # Group meals by restaurant
-    meals_by_restaurant = {}
-    for meal in ranked_meals:
-        restaurant = meal["meal"]["restaurant"]
-        if restaurant not in meals_by_restaurant:
-            meals_by_restaurant[restaurant] = []
-        meals_by_restaurant[restaurant].append(meal)
-    
-    # Get top N for each restaurant
-    top_meals_by_restaurant = {}
-    for restaurant, meals in meals_by_restaurant.items():
-        top_meals_by_restaurant[restaurant] = meals[:min(top_n_per_restaurant, len(meals))]
-    
-    return top_meals_by_restaurant
+    target_macros = {
+        "calories": calorie_limit,
+        "protein": protein_limit,
+        "carbs": carb_limit,
+        "fats": fat_limit
+    }
+    meals = iter_meal_options(calorie_limit, protein_limit, carb_limit, fat_limit)
+    return stream_top_meals(
+        meals, target_macros, top_n_per_restaurant, key=lambda meal: meal["restaurant"]
+    )
 
 if __name__ == "__main__":
     # Example usage
@@ -0,0 +1,86 @@
+import asyncio
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from .cache import meal_options_cache
+
+logger = logging.getLogger(__name__)
+
+"""
+Background refresh of cached searches past their soft expiry.
+
+A search answered from a cache entry past its soft expiry (see cache.py)
+returns the cached meals right away and hands the recomputation of the entry
+to a background worker: a SEARCH_CACHE_REFRESH_WORKERS thread pool for the sync
+views, a task on the event loop for the async views. The cache hands each
+entry to one caller only, and refreshes run through the same single-flight
+groups as foreground searches, so a key is never computed twice at once.
+A refresh that fails, or ends without replacing the entry, releases its claim,
+so a later search can start another one.
+"""
+
+_executor = None
+_executor_lock = threading.Lock()
+# Running refresh tasks, referenced until they finish so they are not garbage collected
+_tasks = set()
+
+
+def _reset_executor():
+    # A forked child must not reuse its parent's threads
+    global _executor
+    _executor = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_executor)
+
+
+def refresh_executor():
+    """Return the thread pool that runs background refreshes, creating it on first use."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, "SEARCH_CACHE_REFRESH_WORKERS", 1),
+                thread_name_prefix="search-refresh",
+            )
+        return _executor
+
+
+def _run_refresh(key, func, args):
+    try:
+        func(*args)
+        logger.info(f"Refreshed cached search with key: {key}")
+    except Exception as e:
+        logger.error(f"Background refresh of key {key} failed: {e}")
+    finally:
+        meal_options_cache.release_refresh(key)
+
+
+def refresh_in_background(key, func, *args):
+    """Run func(*args), which recomputes the cache entry of key, on the refresh thread pool."""
+    logger.info(f"Refreshing cached search in the background for key: {key}")
+    refresh_executor().submit(_run_refresh, key, func, args)
+
+
+async def _run_async_refresh(key, func, args):
+    try:
+        await func(*args)
+        logger.info(f"Refreshed cached search with key: {key}")
+    except Exception as e:
+        logger.error(f"Background refresh of key {key} failed: {e}")
+    finally:
+        meal_options_cache.release_refresh(key)
+
+
+def refresh_in_task(key, func, *args):
+    """Run the coroutine function func(*args), which recomputes the cache entry of key, in a new task."""
+    logger.info(f"Refreshing cached search in the background for key: {key}")
+    task = asyncio.get_running_loop().create_task(_run_async_refresh(key, func, args))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return task
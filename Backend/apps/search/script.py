@@ -1,12 +1,20 @@
 from itertools import combinations
 from django.conf import settings
 from djongo import models
-from pymongo import MongoClient
-from functools import lru_cache
 import time
 import hashlib
 import logging
-from datetime import datetime
+from .buckets import bucket_limits, bucketing_enabled, filter_meals, nonnegative_macros
+from .cache import meal_options_cache
+from .catalog import FoodCatalog, candidate_query, ensure_food_item_indexes, get_catalog
+from .db import food_items_collection, meals_collection, search_cache_collection
+from .engine import generate_meals
+from .generation import current_generation
+from .parallel import parallel_generate_meals, parallel_workers
+from .partitions import merge_partitions, partition_fingerprints, split_partitions
+from .persistent_cache import load_cached_partitions, store_cached_meals
+from .refresh import refresh_in_background
+from .singleflight import distributed_search_lock, meal_searches
 
 logger = logging.getLogger(__name__)
 
@@ -27,11 +35,9 @@ Example format of a valid meal option
 
 # MongoDB configuration
 def get_db_connection():
+    """Return the meals_fooditem collection on the shared client, or None when the client cannot be created."""
     try:
-        client = MongoClient(settings.DATABASES["default"]["CLIENT"]["host"])
-        db = client["MODdb"]
-        collection = db["meals_fooditem"]
-        return collection
+        return food_items_collection()
     except Exception as e:
         logger.error(f"Error connecting to database: {e}")
         return None
@@ -41,20 +47,87 @@ def get_cache_key(calorie_limit, protein_limit, carb_limit, fat_limit):
     params = f"{calorie_limit}_{protein_limit}_{carb_limit}_{fat_limit}"
     return hashlib.md5(params.encode()).hexdigest()
 
-#dictionary cache for storing meal options
-_meal_options_cache = {}
-
-# LRU cache for function memoization
-@lru_cache(maxsize=100)
 def cached_meal_options(cache_key):
     """Return cached meal options for the given cache key."""
-    return _meal_options_cache.get(cache_key, [])
+    return meal_options_cache.get(cache_key, [])
+
+def store_in_cache(cache_key, results, limits=None, generation=None, fingerprints=None):
+    """Store meal options in the bounded in-memory cache, indexed by the (calories, carbs, fats) limits they satisfy."""
+    meal_options_cache.set(cache_key, results, limits=limits, generation=generation, fingerprints=fingerprints)
+
+def superset_meal_options(limits, count=True):
+    """
+    Find a cached meal list for looser limits that covers a search.
+
+    Args:
+        limits (tuple): Calorie, carb and fat limits of the search
+        count (bool): Whether the lookup counts as a cache hit
+
+    Returns:
+        tuple: (cache_key, meals, catalog) of the cached superset, or None when the
+            cache holds none or superset lookups are off
+    """
+    if not getattr(settings, "SEARCH_CACHE_SUPERSETS", True):
+        return None
+    if meal_options_cache.find_dominating(limits, count=False) is None:
+        return None
+    catalog = load_catalog(limits)
+    if catalog is None or not nonnegative_macros(catalog):
+        return None
+    found = meal_options_cache.find_dominating(limits, count=count)
+    if found is None:
+        return None
+    return found[0], found[1], catalog
 
-def store_in_cache(cache_key, results):
-    """Store meal options in cache."""
-    _meal_options_cache[cache_key] = results
-    # refresh the LRU cache entry if needed
-    cached_meal_options.cache_clear()
+def load_catalog(limits=None):
+    """
+    Return the food catalog for a search, either the process-wide catalog or
+    one read straight from the database. Returns None without a database connection.
+
+    Args:
+        limits (tuple): Calorie, carb and fat limits of the search. A catalog read
+            from the database then only holds the items that can be part of its meals.
+    """
+    if getattr(settings, "SEARCH_USE_CATALOG", True):
+        return get_catalog()
+
+    collection = get_db_connection()
+    if collection is None:
+        return None
+    if limits is None:
+        return FoodCatalog.from_collection(collection)
+    # Let MongoDB drop excluded categories and items over the limits instead of sending them
+    ensure_food_item_indexes(collection)
+    return FoodCatalog.from_collection(collection, candidate_query(*limits))
+
+def get_bucket_cache_key(calorie_limit, carb_limit, fat_limit):
+    """Cache key of the meals of a bucket envelope, shared by every protein target."""
+    params = f"bucket_{calorie_limit}_{carb_limit}_{fat_limit}"
+    return hashlib.md5(params.encode()).hexdigest()
+
+def resolve_search(calorie_limit, protein_limit, carb_limit, fat_limit):
+    """
+    Decide which meal list answers a search.
+
+    Returns:
+        tuple: (cache_key, limits, catalog) where limits are the (calories, carbs, fats)
+            the cached list is generated for, and catalog is set only when that list
+            is a bucket envelope that must be filtered down to the request
+    """
+    if getattr(settings, "SEARCH_CACHE_BUCKETING", False):
+        catalog = load_catalog()
+        if bucketing_enabled(catalog):
+            envelope = bucket_limits(calorie_limit, carb_limit, fat_limit)
+            if envelope != (calorie_limit, carb_limit, fat_limit):
+                return get_bucket_cache_key(*envelope), envelope, catalog
+            return get_bucket_cache_key(*envelope), envelope, None
+    limits = (calorie_limit, carb_limit, fat_limit)
+    return get_cache_key(calorie_limit, protein_limit, carb_limit, fat_limit), limits, None
+
+def has_cached_meal_options(calorie_limit, protein_limit, carb_limit, fat_limit):
+    """Whether the meal list of a search is in the in-memory cache."""
+    cache_key, limits, _ = resolve_search(calorie_limit, protein_limit, carb_limit, fat_limit)
+    return bool(cached_meal_options(cache_key)) or superset_meal_options(limits, count=False) is not None
 
 def check_meal_options(calorie_limit, protein_limit, carb_limit, fat_limit):
     """
@@ -63,252 +136,233 @@ def check_meal_options(calorie_limit, protein_limit, carb_limit, fat_limit):
     2. Uses early termination for combinations that will definitely exceed limits
     3. Caches partial combinations to avoid redundant calculations
     4. Implements caching for repeated searches
+    5. Optionally shares one cached list between every search in the same macro bucket
     """
-    start_time = time.time()
-    
-    # generate cache key
-    cache_key = get_cache_key(calorie_limit, protein_limit, carb_limit, fat_limit)
+    cache_key, limits, bucket_catalog = resolve_search(calorie_limit, protein_limit, carb_limit, fat_limit)
+    valid_meals = search_meal_options(cache_key, *limits)
+    if bucket_catalog is not None:
+        valid_meals = filter_meals(bucket_catalog, valid_meals, calorie_limit, carb_limit, fat_limit)
+        logger.info(f"Filtered {len(valid_meals)} meal options from the bucket for key: {cache_key}")
+    return valid_meals
+
+def search_meal_options(cache_key, calorie_limit, carb_limit, fat_limit):
+    """
+    Return the meals within the limits from the cache, or generate and cache them.
+
+    Args:
+        cache_key (str): Key the meal list is cached under
+        calorie_limit (int): Maximum calories allowed
+        carb_limit (int): Maximum carbohydrates allowed in grams
+        fat_limit (int): Maximum fats allowed in grams
+
+    Returns:
+        list: Valid meal options
+    """
+    limits = (calorie_limit, carb_limit, fat_limit)
+    # Read before the catalog is loaded, so results are never tagged newer than their data
+    generation = current_generation()
+    partitions = {}
     
     # try to get from cache first
     try:
-        # Try in-memory cache first
-        cached_results = cached_meal_options(cache_key)
-        if cached_results:
-            logger.info(f"Retrieved results from in-memory cache for key: {cache_key}")
+        cached_results, partitions = lookup_meal_options(cache_key, limits, generation)
+        if cached_results is not None:
+            # Past its soft expiry, the entry is still served while one background refresh replaces it
+            if meal_options_cache.claim_refresh(cache_key):
+                refresh_in_background(cache_key, refresh_meal_options, cache_key, limits)
             return cached_results
-            
-        # then try database cache if using MongoDB for caching
-        collection = get_db_connection()
-        if collection:
-            cache_collection = collection.database["search_cache"]
-            cached_result = cache_collection.find_one({"key": cache_key})
-            
-            if cached_result:
-                logger.info(f"Retrieved results from database cache for key: {cache_key}")
-                # Store in in-memory cache for faster future access
-                store_in_cache(cache_key, cached_result["results"])
-                return cached_result["results"]
     except Exception as e:
         logger.error(f"Cache retrieval error: {e}")
-    
-    # Get database connection
-    collection = get_db_connection()
-    if collection is None:
+
+    # Concurrent searches for the same key wait for the first one instead of generating the same meals
+    return meal_searches.do(cache_key, compute_meal_options, cache_key, limits, generation, partitions)
+
+def refresh_meal_options(cache_key, limits):
+    """Recompute a cached search, replacing its in-memory entry, unless the same search is already running."""
+    generation = current_generation()
+    return meal_searches.do(cache_key, compute_meal_options, cache_key, limits, generation, {})
+
+
+def compute_meal_options(cache_key, limits, generation, partitions):
+    """
+    Generate and cache the meals of a search missing from the in-memory cache,
+    reusing the partitions cached in memory or in the database where possible.
+
+    Args:
+        cache_key (str): Key the meal list is cached under
+        limits (tuple): Calorie, carb and fat limits of the search
+        generation (int): Catalog generation the search runs at
+        partitions (dict): Partitions of a stale in-memory entry, {restaurant: (fingerprint, meals)}
+
+    Returns:
+        list: Valid meal options
+    """
+    catalog = load_catalog(limits)
+    if catalog is None:
         return []
+
+    source = "in-memory"
+    if not partitions:
+        # then reuse the unchanged restaurants of the database cache if using MongoDB for caching
+        partitions = database_partitions(cache_key, catalog)
+        source = "database"
+    if partitions:
+        return store_meal_options(cache_key, limits, generation, catalog, partitions, source)
+
+    # Cached nowhere: let one process generate the meals while the others wait for its database entry
+    with distributed_search_lock(cache_key) as waited:
+        if waited:
+            partitions = database_partitions(cache_key, catalog)
+        return store_meal_options(cache_key, limits, generation, catalog, partitions, source)
+
+def database_partitions(cache_key, catalog):
+    """Return the still valid partitions of a search in the database cache, empty on a miss or error."""
+    try:
+        return load_cached_partitions(search_cache_collection(), cache_key, catalog)
+    except Exception as e:
+        logger.error(f"Cache retrieval error: {e}")
+        return {}
+
+def store_meal_options(cache_key, limits, generation, catalog, partitions, source):
+    """Generate the meals of a search from cached partitions and the catalog, and store them in both caches."""
+    valid_meals, fingerprints, refreshed = enumerate_meal_options(
+        cache_key, limits, generation, catalog, partitions, source
+    )
     
-    # Query all food items - including restaurant info
-    all_items = list(collection.find({}, {
-        "id": 1,
-        "item_name": 1,
-        "food_category": 1, 
-        "restaurant": 1, 
-        "calories": 1, 
-        "protein": 1, 
-        "carbohydrates": 1, 
-        "fats": 1
-    }))
-    
-    # Filter out beverage and toppings/ingredients categories
-    excluded_categories = ["Beverages", "Toppings & Ingredients"]
-    
-    # OPTIMIZATION 1: Pre-filter items - allow any protein level
-    filtered_items = [
-        item for item in all_items 
-        if item.get("food_category") not in excluded_categories
-        and item.get("calories", 0) <= calorie_limit
-        and item.get("carbohydrates", 0) <= carb_limit
-        and item.get("fats", 0) <= fat_limit
-    ]
-    
-    # Group items by restaurant first
-    restaurants = {}
-    for item in filtered_items:
-        restaurant_name = item.get("restaurant")
-        if not restaurant_name:
-            continue
-            
-        if restaurant_name not in restaurants:
-            restaurants[restaurant_name] = []
-        restaurants[restaurant_name].append(item)
-    
-    valid_meals = []
+    # Store in database cache, unless it already holds every partition
+    try:
+        if refreshed and store_cached_meals(search_cache_collection(), cache_key, valid_meals, fingerprints, limits, generation):
+            logger.info(f"Stored results in database cache with key: {cache_key}")
+    except Exception as e:
+        logger.error(f"Cache storage error: {e}")
     
-    # Cache for macro sums to avoid recalculating the same combinations
-    @lru_cache(maxsize=10000)
-    def get_macro_sums(item_ids_tuple):
-        # Calculate the sum of macros for a given combination of items
-        items = tuple(item for item in filtered_items if str(item.get("id")) in item_ids_tuple)
-        return (
-            sum(item.get("calories", 0) for item in items),
-            sum(item.get("protein", 0) for item in items),
-            sum(item.get("carbohydrates", 0) for item in items),
-            sum(item.get("fats", 0) for item in items)
+    return valid_meals
+
+def lookup_meal_options(cache_key, limits, generation):
+    """
+    Answer a search from the in-memory cache, without database access beyond loading the catalog.
+
+    Args:
+        cache_key (str): Key the meal list is cached under
+        limits (tuple): Calorie, carb and fat limits of the search
+        generation (int): Catalog generation the search runs at
+
+    Returns:
+        tuple: (meals, partitions) where meals is the cached list, or None on a miss, and
+            partitions holds the restaurant partitions of an entry cached before the catalog changed
+    """
+    # Try in-memory cache first
+    cached_results = cached_meal_options(cache_key)
+    if cached_results:
+        logger.info(f"Retrieved results from in-memory cache for key: {cache_key}")
+        return cached_results, {}
+
+    # then filter the cached meals of looser limits
+    superset = superset_meal_options(limits)
+    if superset is not None:
+        superset_key, superset_meals, catalog = superset
+        valid_meals = filter_meals(catalog, superset_meals, *limits)
+        logger.info(f"Filtered {len(valid_meals)} meal options for key {cache_key} from cached key: {superset_key}")
+        fingerprints = partition_fingerprints(catalog, *limits)
+        store_in_cache(cache_key, valid_meals, limits, generation, fingerprints)
+        return valid_meals, {}
+
+    # then reuse the unchanged restaurants of an entry cached before the catalog changed
+    stale_entry = meal_options_cache.get_stale(cache_key)
+    if stale_entry is not None and stale_entry[1] is not None:
+        return None, split_partitions(*stale_entry)
+    return None, {}
+
+def enumerate_meal_options(cache_key, limits, generation, catalog, partitions, source):
+    """
+    Generate the meals of a search missing from the cache and store them in memory.
+
+    Args:
+        cache_key (str): Key the meal list is cached under
+        limits (tuple): Calorie, carb and fat limits of the search
+        generation (int): Catalog generation the search runs at
+        catalog (FoodCatalog): Food catalog to enumerate
+        partitions (dict): Cached restaurant partitions to reuse, {restaurant: (fingerprint, meals)}
+        source (str): Where the partitions come from, for logging
+
+    Returns:
+        tuple: (meals, fingerprints, refreshed) where refreshed lists the restaurants
+            that were enumerated
+    """
+    start_time = time.time()
+    calorie_limit, carb_limit, fat_limit = limits
+
+    if partitions:
+        # Only the restaurants whose items changed since the entry was cached are enumerated again
+        valid_meals, fingerprints, refreshed = merge_partitions(catalog, partitions, calorie_limit, carb_limit, fat_limit)
+        logger.info(
+            f"Retrieved {len(fingerprints) - len(refreshed)} of {len(fingerprints)} restaurants from {source} cache "
+            f"for key: {cache_key}"
         )
-    
-    # Process each restaurant separately
-    for restaurant_name, restaurant_items in restaurants.items():
-        # Group items by category for this restaurant
-        entrees = [item for item in restaurant_items if item.get("food_category") in ["Sandwiches", "Entrees", "Pizza", "Burgers"]]
-        sides = [item for item in restaurant_items if item.get("food_category") in ["Fried Potatoes", "Appetizers & Sides", "Salads", "Soup", "Baked Goods"]]
-        desserts = [item for item in restaurant_items if item.get("food_category") == "Desserts"]
-        
-        # OPTIMIZATION 2: Sort items within each category by calorie density (calories per gram of macronutrients)
-        # This prioritizes more macro-efficient foods when early-terminating combinations
-        def calorie_density(item):
-            total_macros = item.get("protein", 0) + item.get("carbohydrates", 0) + item.get("fats", 0)
-            if total_macros > 0:
-                return item.get("calories", 0) / total_macros
-            return float('inf')
-        
-        entrees.sort(key=calorie_density)
-        sides.sort(key=calorie_density)
-        desserts.sort(key=calorie_density)
-        
-        # Generate valid entree combinations (0, 1, or 2 entrees)
-        entree_combinations = [()]  # Start with empty combo
-        if entrees:
-            entree_combinations.extend([(item,) for item in entrees])  # Add single entree combos
-            
-            # Only generate 2-entree combos if individual entrees are within limits
-            valid_two_entree_combos = []
-            for i, e1 in enumerate(entrees):
-                for e2 in entrees[i+1:]:
-                    # Calculate combined macros
-                    cal = e1.get("calories", 0) + e2.get("calories", 0)
-                    carb = e1.get("carbohydrates", 0) + e2.get("carbohydrates", 0)
-                    fat = e1.get("fats", 0) + e2.get("fats", 0)
-                    
-                    # Early termination if this combo already exceeds any limit
-                    # (no protein check)
-                    if (cal <= calorie_limit and 
-                        carb <= carb_limit and 
-                        fat <= fat_limit):
-                        valid_two_entree_combos.append((e1, e2))
-            
-            entree_combinations.extend(valid_two_entree_combos)
-        
-        # Generate valid side combinations (0, 1, or 2 sides) using same approach
-        side_combinations = [()]
-        if sides:
-            side_combinations.extend([(item,) for item in sides])
-            
-            valid_two_side_combos = []
-            for i, s1 in enumerate(sides):
-                for s2 in sides[i+1:]:
-                    cal = s1.get("calories", 0) + s2.get("calories", 0)
-                    carb = s1.get("carbohydrates", 0) + s2.get("carbohydrates", 0)
-                    fat = s1.get("fats", 0) + s2.get("fats", 0)
-                    
-                    # No protein check
-                    if (cal <= calorie_limit and 
-                        carb <= carb_limit and 
-                        fat <= fat_limit):
-                        valid_two_side_combos.append((s1, s2))
-            
-            side_combinations.extend(valid_two_side_combos)
-        
-        # Generate dessert combinations (0 or 1 dessert)
-        dessert_combinations = [()]
-        dessert_combinations.extend([(d,) for d in desserts])
-        
-        # OPTIMIZATION 3: Combine the components using pre-filtered valid combinations
-        for entree_combo in entree_combinations:
-            # Calculate macro totals for this entree combo
-            entree_calories = sum(item.get("calories", 0) for item in entree_combo)
-            entree_protein = sum(item.get("protein", 0) for item in entree_combo)
-            entree_carbs = sum(item.get("carbohydrates", 0) for item in entree_combo)
-            entree_fats = sum(item.get("fats", 0) for item in entree_combo)
-            
-            # Calculate remaining limits - no protein check
-            remaining_calories = calorie_limit - entree_calories
-            remaining_carbs = carb_limit - entree_carbs
-            remaining_fats = fat_limit - entree_fats
-            
-            # Skip if already over limits
-            if (remaining_calories < 0 or
-                remaining_carbs < 0 or 
-                remaining_fats < 0):
-                continue
-            
-            for side_combo in side_combinations:
-                # Calculate macro totals for this side combo
-                side_calories = sum(item.get("calories", 0) for item in side_combo)
-                side_protein = sum(item.get("protein", 0) for item in side_combo)
-                side_carbs = sum(item.get("carbohydrates", 0) for item in side_combo)
-                side_fats = sum(item.get("fats", 0) for item in side_combo)
-
-                # Calculate remaining limits after adding sides - no protein check
-                remaining_calories_after_sides = remaining_calories - side_calories
-                remaining_carbs_after_sides = remaining_carbs - side_carbs
-                remaining_fats_after_sides = remaining_fats - side_fats
-                
-                # Skip if over limits
-                if (remaining_calories_after_sides < 0 or
-                    remaining_carbs_after_sides < 0 or 
-                    remaining_fats_after_sides < 0):
-                    continue
-                
-                for dessert_combo in dessert_combinations:
-                    # Skip completely empty meals
-                    if not entree_combo and not side_combo and not dessert_combo:
-                        continue
-                    
-                    # Calculate dessert macro totals
-                    dessert_calories = sum(item.get("calories", 0) for item in dessert_combo)
-                    dessert_protein = sum(item.get("protein", 0) for item in dessert_combo)
-                    dessert_carbs = sum(item.get("carbohydrates", 0) for item in dessert_combo)
-                    dessert_fats = sum(item.get("fats", 0) for item in dessert_combo)
-
-                    # Final check against limits - no protein check
-                    total_calories = entree_calories + side_calories + dessert_calories
-                    total_protein = entree_protein + side_protein + dessert_protein
-                    total_carbs = entree_carbs + side_carbs + dessert_carbs
-                    total_fats = entree_fats + side_fats + dessert_fats
-                    
-                    if (total_calories <= calorie_limit and 
-                        total_carbs <= carb_limit and 
-                        total_fats <= fat_limit):
-                        
-                        # Create meal object in the requested format
-                        all_items = entree_combo + side_combo + dessert_combo
-                        food_item_ids = [str(item.get("id")) for item in all_items]
-                        item_names = [str(item.get("item_name")) for item in all_items]
-
-                        meal = {
-                            "restaurant": restaurant_name,
-                            "calories": total_calories,
-                            "protein": total_protein,
-                            "carbs": total_carbs,
-                            "fats": total_fats,
-                            "food_item_ids": food_item_ids,
-                            "item_names" : item_names
-                        }
-                        
-                        valid_meals.append(meal)
+    else:
+        # OPTIMIZATION 1 and 2: the catalog pre-filters items over the limits (any protein level is allowed)
+        # and sorts each category by calorie density before the engine combines them
+        if parallel_workers() > 1:
+            valid_meals = parallel_generate_meals(catalog, calorie_limit, carb_limit, fat_limit)
+        else:
+            valid_meals = list(generate_meals(catalog, calorie_limit, carb_limit, fat_limit))
+        fingerprints = partition_fingerprints(catalog, calorie_limit, carb_limit, fat_limit)
+        refreshed = list(fingerprints)
     
     end_time = time.time()
     execution_time = end_time - start_time
-    logger.info(f"Generated {len(valid_meals)} meal options in {execution_time:.2f} seconds")
-    logger.info(f"Parameters: cal={calorie_limit}, prot={protein_limit}, carbs={carb_limit}, fat={fat_limit}")
+    logger.info(f"Generated {len(valid_meals)} meal options ({len(refreshed)} restaurants enumerated) in {execution_time:.2f} seconds")
+    logger.info(f"Parameters: cal={calorie_limit}, carbs={carb_limit}, fat={fat_limit}")
     
-    # Store results in cache
+    # Store results in memory cache
     try:
-        # Store in memory cache
-        store_in_cache(cache_key, valid_meals)
-        
-        # Store in database cache
-        if collection:
-            cache_collection = collection.database["search_cache"]
-            cache_collection.update_one(
-                {"key": cache_key},
-                {"$set": {"results": valid_meals, "created_at": datetime.now()}},
-                upsert=True
-            )
-            logger.info(f"Stored results in database cache with key: {cache_key}")
+        store_in_cache(cache_key, valid_meals, limits, generation, fingerprints)
     except Exception as e:
         logger.error(f"Cache storage error: {e}")
     
-    return valid_meals
+    return valid_meals, fingerprints, refreshed
+
+def iter_meal_options(calorie_limit, protein_limit, carb_limit, fat_limit):
+    """
+    Yield the same meals as check_meal_options without building the full list.
+
+    Cached results, or the filtered results of a cached looser search, are
+    replayed from the cache. A search missing from memory but stored in the
+    database cache is merged from its partitions and kept in memory, as
+    check_meal_options would; otherwise meals are generated by the engine one at
+    a time and are not cached.
+    """
+    cache_key, limits, bucket_catalog = resolve_search(calorie_limit, protein_limit, carb_limit, fat_limit)
+    # Read before the catalog is loaded, so results are never tagged newer than their data
+    generation = current_generation()
+    cached_results = cached_meal_options(cache_key)
+    if not cached_results:
+        superset = superset_meal_options(limits)
+        if superset is not None:
+            superset_key, cached_results, bucket_catalog = superset
+            logger.info(f"Streaming results for key {cache_key} from cached key: {superset_key}")
+    else:
+        logger.info(f"Streaming results from in-memory cache for key: {cache_key}")
+
+    catalog = None
+    if not cached_results:
+        catalog = load_catalog(limits)
+        partitions = database_partitions(cache_key, catalog) if catalog is not None else {}
+        if partitions:
+            cached_results = enumerate_meal_options(cache_key, limits, generation, catalog, partitions, "database")[0]
+
+    if cached_results:
+        if bucket_catalog is not None:
+            cached_results = filter_meals(bucket_catalog, cached_results, calorie_limit, carb_limit, fat_limit)
+        yield from cached_results
+        return
+
+    if limits != (calorie_limit, carb_limit, fat_limit):
+        catalog = load_catalog((calorie_limit, carb_limit, fat_limit))
+    if catalog is None:
+        return
+
+    yield from generate_meals(catalog, calorie_limit, carb_limit, fat_limit)
 
 def save_meal_to_db(meal_data):
     """
@@ -321,12 +375,8 @@ def save_meal_to_db(meal_data):
         dict: Response with meal ID and status message
     """
     try:
-        client = MongoClient(settings.DATABASES["default"]["CLIENT"]["host"])
-        db = client["MODdb"]
-        meals_collection = db["meals_meal"]
-        
         # Insert meal into database
-        result = meals_collection.insert_one(meal_data)
+        result = meals_collection().insert_one(meal_data)
         meal_id = str(result.inserted_id)
         
         return {
@@ -0,0 +1,33 @@
+import logging
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from apps.meals.importer import update_derived_fields
+from apps.meals.models import FoodItem
+
+from .db import food_items_collection
+from .generation import bump_catalog_generation
+
+logger = logging.getLogger(__name__)
+
+"""
+Bump the food catalog generation whenever a FoodItem is written through Django
+(the admin or the API), so cached searches are invalidated. A saved item also
+gets its derived fields recomputed, with the menu ordinals of its restaurant;
+deleting an item leaves the ordinals of the others in a valid order.
+"""
+
+
+@receiver(post_save, sender=FoodItem)
+def food_item_saved(sender, instance, **kwargs):
+    try:
+        update_derived_fields(food_items_collection(), [instance.restaurant])
+    except Exception as e:
+        logger.error(f"Could not update the derived fields of restaurant {instance.restaurant}: {e}")
+    bump_catalog_generation()
+
+
+@receiver(post_delete, sender=FoodItem)
+def food_item_deleted(sender, **kwargs):
+    bump_catalog_generation()
@@ -0,0 +1,252 @@
+import asyncio
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from pymongo.errors import DuplicateKeyError
+
+from .db import search_locks_collection
+
+logger = logging.getLogger(__name__)
+
+"""
+Coalescing of identical concurrent searches.
+
+Within a process, SingleFlight (threads) and AsyncSingleFlight (event loop)
+run one computation per key at a time: the first caller computes, concurrent
+callers with the same key wait for its result instead of enumerating the same
+meals again.
+
+Across processes, a search that is cached nowhere can take a short-lived lock
+document in the search_locks collection, when SEARCH_DISTRIBUTED_LOCKS is set:
+
+    {"_id": "<cache key>", "owner": "<host>:<pid>:<token>", "expires_at": datetime}
+
+Other processes running the same search wait until the lock is released (or
+for at most SEARCH_LOCK_WAIT_SECONDS) and then read the meals the owner stored
+in the search_cache collection. Locks expire after SEARCH_LOCK_TTL seconds, so
+a crashed owner never blocks a search for longer than that.
+"""
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Run a function once per key for callers in concurrent threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.coalesced = 0
+
+    def do(self, key, func, *args):
+        """
+        Return func(*args), or the result of the call already running for key.
+
+        Raises:
+            Exception: Whatever the running call raised, in every caller
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            logger.info(f"Waiting for the running search with key: {key}")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func(*args)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class AsyncSingleFlight:
+    """Run a coroutine function once per key for concurrent tasks of an event loop."""
+
+    def __init__(self):
+        self._calls = {}
+        self.coalesced = 0
+
+    async def do(self, key, func, *args):
+        """Return await func(*args), or the result of the call already running for key."""
+        loop = asyncio.get_running_loop()
+        task = self._calls.get(key)
+        if task is None or task.done() or task.get_loop() is not loop:
+            task = self._calls[key] = loop.create_task(func(*args))
+            task.add_done_callback(lambda done: self._calls.pop(key, None) if self._calls.get(key) is done else None)
+        else:
+            self.coalesced += 1
+            logger.info(f"Waiting for the running search with key: {key}")
+        # A cancelled caller must not cancel the call the others wait on
+        return await asyncio.shield(task)
+
+
+def distributed_locks_enabled():
+    return getattr(settings, "SEARCH_DISTRIBUTED_LOCKS", False)
+
+
+def _lock_owner():
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}"
+
+
+def _lock_update(owner):
+    # TTL indexes compare against UTC
+    now = datetime.utcnow()
+    ttl = getattr(settings, "SEARCH_LOCK_TTL", 120)
+    # Matches expired locks only; a live lock makes the upsert collide on _id
+    return (
+        {"expires_at": {"$lt": now}},
+        {"$set": {"owner": owner, "expires_at": now + timedelta(seconds=ttl)}},
+    )
+
+
+_indexed_collections = set()
+
+
+def acquire_search_lock(collection, key, owner):
+    """Take the lock of a search key, or take over an expired one. Returns whether it was taken."""
+    if collection.full_name not in _indexed_collections:
+        collection.create_index("expires_at", expireAfterSeconds=0)
+        _indexed_collections.add(collection.full_name)
+    query, update = _lock_update(owner)
+    try:
+        collection.update_one({"_id": key, **query}, update, upsert=True)
+        return True
+    except DuplicateKeyError:
+        return False
+
+
+def wait_for_search_lock(collection, key):
+    """Wait until the lock of a search key is released or expires. Returns False on timeout."""
+    deadline = time.monotonic() + getattr(settings, "SEARCH_LOCK_WAIT_SECONDS", 60)
+    interval = getattr(settings, "SEARCH_LOCK_POLL_SECONDS", 0.5)
+    while time.monotonic() < deadline:
+        if collection.find_one({"_id": key, "expires_at": {"$gte": datetime.utcnow()}}, {"_id": 1}) is None:
+            return True
+        time.sleep(interval)
+    return False
+
+
+@contextmanager
+def distributed_search_lock(key):
+    """
+    Hold the cross-process lock of a search key while its meals are generated and stored.
+
+    Yields:
+        bool: Whether another process held the lock and may have stored the meals
+            meanwhile, so the search_cache collection should be read again
+    """
+    if not distributed_locks_enabled():
+        yield False
+        return
+
+    owner = _lock_owner()
+    acquired = waited = False
+    try:
+        collection = search_locks_collection()
+        acquired = acquire_search_lock(collection, key, owner)
+        if not acquired:
+            logger.info(f"Waiting for another process to generate the meals of key: {key}")
+            waited = True
+            if not wait_for_search_lock(collection, key):
+                logger.warning(f"Gave up waiting for the lock of key {key}, generating the meals here")
+            acquired = acquire_search_lock(collection, key, owner)
+    except Exception as e:
+        logger.error(f"Search lock error: {e}")
+
+    try:
+        yield waited
+    finally:
+        if acquired:
+            try:
+                collection.delete_one({"_id": key, "owner": owner})
+            except Exception as e:
+                logger.error(f"Search lock release error: {e}")
+
+
+async def async_acquire_search_lock(collection, key, owner):
+    """acquire_search_lock() for a Motor collection."""
+    if collection.full_name not in _indexed_collections:
+        await collection.create_index("expires_at", expireAfterSeconds=0)
+        _indexed_collections.add(collection.full_name)
+    query, update = _lock_update(owner)
+    try:
+        await collection.update_one({"_id": key, **query}, update, upsert=True)
+        return True
+    except DuplicateKeyError:
+        return False
+
+
+async def async_wait_for_search_lock(collection, key):
+    """wait_for_search_lock() for a Motor collection."""
+    deadline = time.monotonic() + getattr(settings, "SEARCH_LOCK_WAIT_SECONDS", 60)
+    interval = getattr(settings, "SEARCH_LOCK_POLL_SECONDS", 0.5)
+    while time.monotonic() < deadline:
+        if await collection.find_one({"_id": key, "expires_at": {"$gte": datetime.utcnow()}}, {"_id": 1}) is None:
+            return True
+        await asyncio.sleep(interval)
+    return False
+
+
+@asynccontextmanager
+async def async_distributed_search_lock(key):
+    """distributed_search_lock() for the async views."""
+    if not distributed_locks_enabled():
+        yield False
+        return
+
+    from .async_db import async_search_locks_collection
+
+    owner = _lock_owner()
+    acquired = waited = False
+    try:
+        collection = async_search_locks_collection()
+        acquired = await async_acquire_search_lock(collection, key, owner)
+        if not acquired:
+            logger.info(f"Waiting for another process to generate the meals of key: {key}")
+            waited = True
+            if not await async_wait_for_search_lock(collection, key):
+                logger.warning(f"Gave up waiting for the lock of key {key}, generating the meals here")
+            acquired = await async_acquire_search_lock(collection, key, owner)
+    except Exception as e:
+        logger.error(f"Search lock error: {e}")
+
+    try:
+        yield waited
+    finally:
+        if acquired:
+            try:
+                await collection.delete_one({"_id": key, "owner": owner})
+            except Exception as e:
+                logger.error(f"Search lock release error: {e}")
+
+
+# Searches of this process that are generating meals, by cache key
+meal_searches = SingleFlight()
+async_meal_searches = AsyncSingleFlight()
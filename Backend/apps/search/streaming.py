@@ -0,0 +1,72 @@
+import json
+import logging
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+
+from macrosondemand.renderers import dumps
+
+logger = logging.getLogger(__name__)
+
+"""
+Streaming responses for large meal option lists.
+
+Meals are serialized in chunks of SEARCH_STREAM_CHUNK_MEALS as they are
+produced, so neither the meal list nor the response body is ever held in
+memory in full. Two formats are supported:
+
+    ndjson  one meal object per line (application/x-ndjson)
+    json    {"valid_meals": [...], "count": n}, with the count written after
+            the meals, in the spaced, ASCII-escaped layout of JsonResponse:
+            the same bytes as JsonResponse({"valid_meals": meals, "count": n})
+"""
+
+STREAM_FORMATS = ("ndjson", "json")
+
+
+def _chunks(meals):
+    size = getattr(settings, "SEARCH_STREAM_CHUNK_MEALS", 500)
+    chunk = []
+    for meal in meals:
+        chunk.append(meal)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def ndjson_stream(meals):
+    """Yield meals as newline-delimited JSON, one chunk of lines at a time."""
+    for chunk in _chunks(meals):
+        yield b"".join(dumps(meal) + b"\n" for meal in chunk)
+
+
+def json_array_stream(meals):
+    """Yield {"valid_meals": [...], "count": n} piece by piece."""
+    count = 0
+    yield b'{"valid_meals": ['
+    for chunk in _chunks(meals):
+        # A chunk is serialized as a list, without its brackets
+        yield (b", " if count else b"") + json.dumps(chunk, cls=DjangoJSONEncoder)[1:-1].encode()
+        count += len(chunk)
+    yield b'], "count": %d}' % count
+
+
+def streaming_meals_response(meals, stream_format):
+    """
+    Build a StreamingHttpResponse that serializes meals as they are produced.
+
+    Args:
+        meals (iterable): Meal option dicts, consumed lazily
+        stream_format (str): "ndjson" or "json"
+
+    Raises:
+        ValueError: For an unknown format
+    """
+    if stream_format == "ndjson":
+        return StreamingHttpResponse(ndjson_stream(meals), content_type="application/x-ndjson")
+    if stream_format == "json":
+        return StreamingHttpResponse(json_array_stream(meals), content_type="application/json")
+    raise ValueError(f"Unknown stream format: {stream_format}, expected one of {', '.join(STREAM_FORMATS)}")
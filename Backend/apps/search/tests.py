@@ -1,3 +1,936 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import decimal
+import io
+import json
+import random
+import threading
+import time
+import uuid
 
-# Create your tests here.
+from unittest import mock
+
+from bson import ObjectId
+from django.contrib.auth.models import AnonymousUser
+from django.core.management import CommandError, call_command
+from django.http import JsonResponse
+from django.test import RequestFactory, SimpleTestCase
+from pymongo.errors import DuplicateKeyError
+from rest_framework.renderers import JSONRenderer
+
+from macrosondemand import renderers
+from macrosondemand.renderers import FastJSONRenderer
+
+from .branch_and_bound import branch_and_bound_top_meals
+from .buckets import bucket_limits, filter_meals
+from .cache import MealOptionsCache
+from . import async_db, async_search, async_views, db, generation, indexes, refresh, script, singleflight, views
+from . import catalog as catalog_module
+from .catalog import CATALOG_PROJECTION, FOOD_ITEM_INDEXES, FoodCatalog
+from .engine import generate_meals
+from .management.commands import ensure_indexes
+from .meal_index import indexed_top_meals
+from .parallel import parallel_generate_meals, parallel_top_meals
+from .partitions import merge_partitions, partition_fingerprints, split_partitions
+from .persistent_cache import (
+    PACKED_FORMAT, cache_document, ensure_cache_indexes, pack_meals, pack_partitions, unpack_partitions,
+)
+from .rank_meals import build_ranked_meal, calculate_rmse, get_top_ranked_meals_by_restaurant, stream_top_meals
+from .singleflight import AsyncSingleFlight, SingleFlight
+
+
+def make_food_items(restaurant_count=4, items_per_restaurant=24, seed=7):
+    """Build random meals_fooditem documents across every category the engine knows about."""
+    rng = random.Random(seed)
+    categories = [
+        "Burgers", "Sandwiches", "Entrees", "Pizza",
+        "Fried Potatoes", "Appetizers & Sides", "Salads", "Soup", "Baked Goods",
+        "Desserts", "Beverages", "Toppings & Ingredients", "Breakfast",
+    ]
+    items = []
+    for r in range(restaurant_count):
+        for i in range(items_per_restaurant):
+            item_id = ObjectId()
+            items.append({
+                "_id": item_id,
+                "id": item_id,
+                "item_name": f"Item {r}-{i}",
+                "restaurant": f"Restaurant {r}",
+                "food_category": rng.choice(categories),
+                "calories": float(rng.randint(50, 700)),
+                "protein": float(rng.randint(0, 40)),
+                "carbohydrates": rng.randint(0, 80) + rng.choice([0.0, 0.5]),
+                "fats": float(rng.randint(0, 35)),
+            })
+    rng.shuffle(items)
+    return items
+
+
+class CombinationEngineTests(SimpleTestCase):
+    """The vectorized engines must match the nested-loop engine exactly"""
+
+    def setUp(self):
+        self.catalog = FoodCatalog(make_food_items())
+
+    def test_engines_match(self):
+        for limits in [(800, 100, 30), (1500, 150, 60), (300, 40, 10), (0, 0, 0)]:
+            python_meals = list(generate_meals(self.catalog, *limits, engine="python"))
+            for engine in ("numpy", "sorted"):
+                meals = list(generate_meals(self.catalog, *limits, engine=engine))
+                self.assertEqual(python_meals, meals, f"{engine} engine differs for limits {limits}")
+
+    def test_meals_respect_limits(self):
+        meals = list(generate_meals(self.catalog, 900, 110, 40))
+        self.assertTrue(meals)
+        for meal in meals:
+            self.assertLessEqual(meal["calories"], 900)
+            self.assertLessEqual(meal["carbs"], 110)
+            self.assertLessEqual(meal["fats"], 40)
+            self.assertTrue(1 <= len(meal["food_item_ids"]) <= 5)
+
+
+class StreamingTopMealsTests(SimpleTestCase):
+    """Bounded-heap ranking must agree with ranking the full list"""
+
+    def setUp(self):
+        self.catalog = FoodCatalog(make_food_items())
+        self.target = {"calories": 1000, "protein": 250, "carbs": 120, "fats": 45}
+        self.meals = list(generate_meals(self.catalog, 1000, 120, 45))
+        self.full_ranking = sorted(
+            (build_ranked_meal(meal, calculate_rmse(meal, self.target), self.target) for meal in self.meals),
+            key=lambda meal: meal["rmse"],
+        )
+        for rank, meal in enumerate(self.full_ranking, 1):
+            meal["rank"] = rank
+
+    def test_top_n_matches_full_ranking(self):
+        top_meals = stream_top_meals(iter(self.meals), self.target, 10)[None]
+        self.assertEqual(top_meals, self.full_ranking[:10])
+
+    def test_top_n_per_restaurant_matches_full_ranking(self):
+        expected = {}
+        for meal in self.full_ranking:
+            expected.setdefault(meal["meal"]["restaurant"], []).append(meal)
+        expected = {restaurant: meals[:3] for restaurant, meals in expected.items()}
+
+        top_meals = stream_top_meals(iter(self.meals), self.target, 3, key=lambda meal: meal["restaurant"])
+        self.assertEqual(list(top_meals.items()), list(expected.items()))
+
+
+class BranchAndBoundTests(SimpleTestCase):
+    """Pruned ranked search must return exactly the top of the full ranking"""
+
+    def test_matches_full_ranking(self):
+        catalog = FoodCatalog(make_food_items(restaurant_count=6, items_per_restaurant=30))
+        for calorie_limit, carb_limit, fat_limit in [(1200, 140, 50), (600, 70, 20), (2000, 200, 80)]:
+            target = {"calories": calorie_limit, "protein": 250, "carbs": carb_limit, "fats": fat_limit}
+            full_ranking = sorted(
+                ((calculate_rmse(meal, target), meal)
+                 for meal in generate_meals(catalog, calorie_limit, carb_limit, fat_limit)),
+                key=lambda scored: scored[0],
+            )
+            for top_n in (1, 10):
+                self.assertEqual(
+                    branch_and_bound_top_meals(catalog, calorie_limit, 250, carb_limit, fat_limit, top_n),
+                    full_ranking[:top_n],
+                )
+
+
+class MealIndexTests(SimpleTestCase):
+    """Walking the k-d tree indexes must return exactly the top of the full ranking"""
+
+    def test_matches_full_ranking(self):
+        catalog = FoodCatalog(make_food_items(restaurant_count=6, items_per_restaurant=30))
+        for max_meals in (200000, 2000):
+            with self.settings(SEARCH_MEAL_INDEX_MAX_MEALS=max_meals):
+                catalog.derived.clear()
+                for calorie_limit, carb_limit, fat_limit in [(1200, 140, 50), (600, 70, 20), (2000, 200, 80)]:
+                    target = {"calories": calorie_limit, "protein": 250, "carbs": carb_limit, "fats": fat_limit}
+                    full_ranking = sorted(
+                        ((calculate_rmse(meal, target), meal)
+                         for meal in generate_meals(catalog, calorie_limit, carb_limit, fat_limit)),
+                        key=lambda scored: scored[0],
+                    )
+                    for top_n in (1, 10):
+                        self.assertEqual(
+                            indexed_top_meals(catalog, calorie_limit, 250, carb_limit, fat_limit, top_n),
+                            full_ranking[:top_n],
+                        )
+
+
+class ParallelSearchTests(SimpleTestCase):
+    """Merged results from the worker pool must match the serial search exactly"""
+
+    def test_matches_serial_search(self):
+        catalog = FoodCatalog(make_food_items(restaurant_count=6, items_per_restaurant=30))
+        with self.settings(SEARCH_PARALLEL_WORKERS=2):
+            for calorie_limit, carb_limit, fat_limit in [(1200, 140, 50), (600, 70, 20)]:
+                self.assertEqual(
+                    parallel_generate_meals(catalog, calorie_limit, carb_limit, fat_limit),
+                    list(generate_meals(catalog, calorie_limit, carb_limit, fat_limit)),
+                )
+                for top_n in (1, 10):
+                    self.assertEqual(
+                        parallel_top_meals(catalog, calorie_limit, 250, carb_limit, fat_limit, top_n),
+                        branch_and_bound_top_meals(catalog, calorie_limit, 250, carb_limit, fat_limit, top_n),
+                    )
+
+
+class MealOptionsCacheTests(SimpleTestCase):
+    """The result cache evicts least recently used lists past its budgets and expires old ones"""
+
+    def make_cache(self, **kwargs):
+        options = {"max_bytes": 100, "max_entries": 10, "ttl": 60, "sizer": len}
+        options.update(kwargs)
+        return MealOptionsCache(**options)
+
+    def test_evicts_least_recently_used_past_byte_budget(self):
+        cache = self.make_cache()
+        cache.set("a", [0] * 40)
+        cache.set("b", [0] * 40)
+        cache.get("a")
+        cache.set("c", [0] * 40)
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("a"))
+        self.assertEqual(cache.total_bytes, 80)
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_evicts_past_entry_limit_and_skips_oversized_values(self):
+        cache = self.make_cache(max_entries=2)
+        for key in "abc":
+            cache.set(key, [0])
+        self.assertEqual([entry["key"] for entry in cache.entries()], ["b", "c"])
+        self.assertFalse(cache.set("big", [0] * 101))
+        self.assertNotIn("big", cache)
+
+    def test_finds_smallest_dominating_entry(self):
+        cache = self.make_cache()
+        cache.set("loose", [0] * 30, limits=(1000, 100, 40))
+        cache.set("tight", [0] * 10, limits=(800, 100, 30))
+        cache.set("low_carb", [0] * 5, limits=(1200, 50, 50))
+        self.assertEqual(cache.find_dominating((700, 90, 30))[0], "tight")
+        self.assertEqual(cache.find_dominating((900, 100, 30))[0], "loose")
+        self.assertIsNone(cache.find_dominating((1100, 60, 30)))
+        self.assertEqual(cache.stats()["superset_hits"], 2)
+
+    def test_older_generations_expire(self):
+        cache = self.make_cache()
+        cache.set("old", [0] * 10, limits=(1000, 100, 40))
+        cache.set_generation(2)
+        self.assertFalse(cache.set("stale", [0], generation=1))
+        cache.set("new", [0] * 20, limits=(1000, 100, 40))
+        self.assertEqual(cache.find_dominating((900, 90, 30))[0], "new")
+        self.assertIsNone(cache.get("old"))
+        self.assertEqual(cache.get_stale("old"), ([0] * 10, None))
+        self.assertEqual([entry["stale"] for entry in cache.entries()], [True, False])
+
+    def test_entries_expire_after_ttl(self):
+        cache = self.make_cache(ttl=10)
+        with mock.patch("apps.search.cache.time.time", return_value=1000):
+            cache.set("a", [1])
+        with mock.patch("apps.search.cache.time.time", return_value=1009):
+            self.assertEqual(cache.get("a"), [1])
+        with mock.patch("apps.search.cache.time.time", return_value=1010):
+            self.assertEqual(cache.get("a", []), [])
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["expirations"], stats["bytes"]), (1, 1, 1, 0))
+
+    def test_one_refresh_claim_past_soft_expiry(self):
+        cache = self.make_cache(ttl=10, soft_ttl=5)
+        with mock.patch("apps.search.cache.time.time", return_value=1000):
+            cache.set("a", [1])
+        with mock.patch("apps.search.cache.time.time", return_value=1004):
+            self.assertFalse(cache.claim_refresh("a"))
+        with mock.patch("apps.search.cache.time.time", return_value=1006):
+            self.assertEqual(cache.get("a"), [1])
+            self.assertTrue(cache.claim_refresh("a"))
+            self.assertFalse(cache.claim_refresh("a"))
+            cache.set("a", [2])
+            self.assertFalse(cache.claim_refresh("a"))
+        self.assertEqual(cache.stats()["refreshes"], 1)
+
+
+class CacheStatsViewTests(SimpleTestCase):
+    """The cache stats view is only served to staff"""
+
+    def request(self, user):
+        request = RequestFactory().get("/api/search/cache/", {"entries": "true"})
+        request.user = user
+        return views.cache_stats_view(request)
+
+    def test_staff_only(self):
+        response = self.request(AnonymousUser())
+        self.assertEqual(response.status_code, 302)
+        self.assertIn("/admin/login/", response["Location"])
+
+        with mock.patch.object(views, "meal_options_cache", MealOptionsCache(2 ** 30, 100)):
+            response = self.request(mock.Mock(is_active=True, is_staff=True))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)["entries"], [])
+
+
+class StaleWhileRevalidateTests(SimpleTestCase):
+    """Searches past the soft expiry are served from the cache while one background refresh replaces them"""
+
+    def setUp(self):
+        self.catalog = FoodCatalog(make_food_items())
+        self.cache = MealOptionsCache(2 ** 30, 100, ttl=60, soft_ttl=30)
+        search_cache = mock.MagicMock()
+        search_cache.find_one.return_value = None
+        patches = [
+            mock.patch.object(script, "meal_options_cache", self.cache),
+            mock.patch.object(script, "current_generation", return_value=0),
+            mock.patch.object(script, "load_catalog", return_value=self.catalog),
+            mock.patch.object(script, "search_cache_collection", return_value=search_cache),
+            mock.patch.object(script, "store_cached_meals", return_value=True),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_serves_stale_entry_and_refreshes_once(self):
+        with mock.patch("apps.search.cache.time.time", return_value=1000):
+            self.cache.set("key", ["old meals"], limits=(800, 100, 30))
+        with mock.patch("apps.search.cache.time.time", return_value=1040), \
+                mock.patch.object(script, "refresh_in_background") as refresh:
+            self.assertEqual(script.search_meal_options("key", 800, 100, 30), ["old meals"])
+            self.assertEqual(script.search_meal_options("key", 800, 100, 30), ["old meals"])
+            refresh.assert_called_once_with("key", script.refresh_meal_options, "key", (800, 100, 30))
+
+            refresh.call_args.args[1](*refresh.call_args.args[2:])
+            fresh = list(generate_meals(self.catalog, 800, 100, 30))
+            self.assertEqual(script.search_meal_options("key", 800, 100, 30), fresh)
+            self.assertEqual(refresh.call_count, 1)
+
+    def test_failed_refresh_releases_claim(self):
+        with mock.patch("apps.search.cache.time.time", return_value=1000):
+            self.cache.set("key", ["old meals"], limits=(800, 100, 30))
+        with mock.patch("apps.search.cache.time.time", return_value=1040), \
+                mock.patch.object(refresh, "meal_options_cache", self.cache), \
+                mock.patch.object(script, "refresh_in_background") as refresh_in_background, \
+                mock.patch.object(script, "generate_meals", side_effect=RuntimeError("database down")):
+            self.assertEqual(script.search_meal_options("key", 800, 100, 30), ["old meals"])
+            func, *args = refresh_in_background.call_args.args[1:]
+            refresh._run_refresh("key", func, args)
+
+            self.assertEqual(script.search_meal_options("key", 800, 100, 30), ["old meals"])
+            self.assertEqual(refresh_in_background.call_count, 2)
+
+
+class FilteredCatalogQueryTests(SimpleTestCase):
+    """Without the in-memory catalog, searches read only their candidate items and find the same meals"""
+
+    def test_filtered_catalog_matches_full_catalog(self):
+        documents = make_food_items(restaurant_count=5)
+        limits = (700, 60, 25)
+        candidates = [
+            doc for doc in documents
+            if doc["food_category"] not in ("Beverages", "Toppings & Ingredients")
+            and all(doc[field] <= limit for field, limit in zip(("calories", "carbohydrates", "fats"), limits))
+        ]
+        collection = mock.MagicMock(full_name="MODdb.meals_fooditem")
+        # An index scan returns the documents in another order than the collection
+        collection.find.return_value = sorted(candidates, key=lambda doc: doc["calories"])
+
+        with self.settings(SEARCH_USE_CATALOG=False), \
+                mock.patch.object(script, "get_db_connection", return_value=collection):
+            catalog = script.load_catalog(limits)
+
+        query, projection = collection.find.call_args.args
+        self.assertEqual(query["food_category"], {"$nin": ["Beverages", "Toppings & Ingredients"]})
+        self.assertEqual(query["fats"], {"$not": {"$gt": 25}})
+        self.assertEqual(projection, CATALOG_PROJECTION)
+        self.assertEqual(len(catalog), len(candidates))
+        self.assertEqual(
+            list(generate_meals(catalog, *limits)),
+            list(generate_meals(FoodCatalog.from_documents(documents), *limits)),
+        )
+        self.assertEqual(collection.create_index.call_count, len(FOOD_ITEM_INDEXES))
+
+
+class BucketedSearchTests(SimpleTestCase):
+    """Filtering the meals of a bucket envelope must give exactly the meals of the request"""
+
+    def test_filtered_envelope_matches_exact_search(self):
+        catalog = FoodCatalog(make_food_items(restaurant_count=6, items_per_restaurant=30))
+        with self.settings(SEARCH_CACHE_BUCKETS={"calories": 100, "carbs": 25, "fats": 10}):
+            for limits in [(1201, 141, 51), (613, 77, 23), (650, 70, 20), (401, 33.5, 12)]:
+                envelope = bucket_limits(*limits)
+                self.assertTrue(all(wide >= exact for wide, exact in zip(envelope, limits)))
+                self.assertEqual(
+                    filter_meals(catalog, list(generate_meals(catalog, *envelope)), *limits),
+                    list(generate_meals(catalog, *limits)),
+                )
+
+
+class PersistentCacheFormatTests(SimpleTestCase):
+    """Packed search_cache entries must rebuild exactly the meals that were stored"""
+
+    def pack(self, catalog, limits):
+        meals = list(generate_meals(catalog, *limits))
+        fingerprints = partition_fingerprints(catalog, *limits)
+        item_ids, blob = pack_meals(meals)
+        return meals, item_ids, blob, pack_partitions(meals, fingerprints)
+
+    def test_round_trip(self):
+        catalog = FoodCatalog(make_food_items(restaurant_count=6, items_per_restaurant=30))
+        meals, item_ids, blob, partitions = self.pack(catalog, (900, 110, 40))
+        unpacked = unpack_partitions(catalog, item_ids, blob, len(meals), partitions)
+        self.assertEqual([meal for _, part in unpacked.values() for meal in part], meals)
+
+    def test_changed_restaurant_is_dropped(self):
+        documents = make_food_items(restaurant_count=3)
+        catalog = FoodCatalog(documents)
+        meals, item_ids, blob, partitions = self.pack(catalog, (900, 110, 40))
+        removed = next(doc for doc in documents if str(doc["id"]) == item_ids[0])
+        smaller = FoodCatalog([doc for doc in documents if doc is not removed])
+        unpacked = unpack_partitions(smaller, item_ids, blob, len(meals), partitions)
+        self.assertEqual(set(unpacked), {name for name, *_ in partitions} - {removed["restaurant"]})
+
+
+class FakeCacheCollection:
+    """The part of a search_cache collection purging and indexing use, holding its documents in a list"""
+
+    full_name = "test.search_cache"
+
+    def __init__(self, documents):
+        self.documents = documents
+        self.indexes = {"_id_": {"key": [("_id", 1)]}}
+
+    def delete_many(self, query):
+        if "format" in query:
+            removed = [doc for doc in self.documents if doc.get("format") != query["format"]["$ne"]]
+        else:
+            removed = [doc for doc in self.documents if doc["_id"] in query["_id"]["$in"]]
+        self.documents = [doc for doc in self.documents if doc not in removed]
+        return mock.Mock(deleted_count=len(removed))
+
+    def find(self, query, projection):
+        return [
+            {"_id": doc["_id"], **{field: doc[field] for field in projection if field in doc}} for doc in self.documents
+        ]
+
+    def index_information(self):
+        return self.indexes
+
+    def create_index(self, key, unique=False, **options):
+        keys = [doc.get(key) for doc in self.documents]
+        if unique and len(set(keys)) < len(keys):
+            raise DuplicateKeyError(f"duplicate {key}")
+        self.indexes[f"{key}_1"] = {"key": [(key, 1)], "unique": unique, **options}
+
+
+class StaleCacheDocumentTests(SimpleTestCase):
+    """Old-layout and duplicate search_cache documents are deleted before the unique key index is built"""
+
+    def test_purge_before_indexing(self):
+        def document(key, day, **fields):
+            return {"_id": ObjectId(), "key": key, "created_at": datetime.datetime(2024, 1, day), **fields}
+
+        newest = document("800-100-30", 3, format=PACKED_FORMAT)
+        other = document("900-110-40", 1, format=PACKED_FORMAT)
+        collection = FakeCacheCollection([
+            document("800-100-30", 1, format=PACKED_FORMAT),
+            newest,
+            document("800-100-30", 2, format=PACKED_FORMAT),
+            other,
+            {"_id": ObjectId(), "key": "900-110-40", "meals": []},
+            {"_id": ObjectId(), "key": "700-90-20", "meals": [], "format": 1},
+        ])
+        with self.assertRaises(DuplicateKeyError):
+            collection.create_index("key", unique=True)
+
+        with mock.patch("apps.search.persistent_cache._indexed_collections", set()):
+            ensure_cache_indexes(collection)
+
+        self.assertEqual(collection.documents, [newest, other])
+        self.assertTrue(collection.indexes["key_1"]["unique"])
+        self.assertEqual(collection.indexes["expires_at_1"]["expireAfterSeconds"], 0)
+
+
+class RestaurantPartitionTests(SimpleTestCase):
+    """After a catalog edit only the edited restaurant is enumerated again, with identical results"""
+
+    def test_merge_after_edit(self):
+        documents = make_food_items(restaurant_count=5, items_per_restaurant=30)
+        catalog = FoodCatalog(documents)
+        limits = (1000, 120, 45)
+        partitions = split_partitions(
+            list(generate_meals(catalog, *limits)), partition_fingerprints(catalog, *limits))
+
+        edited = [dict(doc) for doc in documents]
+        target = next(doc for doc in edited if doc["restaurant"] == "Restaurant 2" and doc["food_category"] == "Burgers")
+        target["calories"] += 10
+        edited.append({**target, "id": ObjectId(), "item_name": "New item", "restaurant": "Restaurant 9"})
+        new_catalog = FoodCatalog(edited)
+
+        meals, fingerprints, refreshed = merge_partitions(new_catalog, partitions, *limits)
+        self.assertEqual(sorted(refreshed), ["Restaurant 2", "Restaurant 9"])
+        self.assertEqual(meals, list(generate_meals(new_catalog, *limits)))
+        self.assertEqual(fingerprints, partition_fingerprints(new_catalog, *limits))
+
+
+class SharedClientTests(SimpleTestCase):
+    """One pooled client is created per process and replaced after a fork"""
+
+    def setUp(self):
+        db._reset_client()
+        self.addCleanup(db._reset_client)
+
+    def test_reuses_client_within_process(self):
+        with mock.patch.object(db, "MongoClient") as client_class:
+            self.assertIs(db.food_items_collection().database.client, db.meals_collection().database.client)
+            self.assertEqual(client_class.call_count, 1)
+            self.assertEqual(client_class.call_args.kwargs["maxPoolSize"], 50)
+
+    def test_new_client_in_forked_process(self):
+        with mock.patch.object(db, "MongoClient") as client_class:
+            client_class.side_effect = lambda *args, **kwargs: mock.MagicMock()
+            parent_client = db.get_client()
+            with mock.patch.object(db.os, "getpid", return_value=-1):
+                self.assertIsNot(db.get_client(), parent_client)
+            self.assertEqual(client_class.call_count, 2)
+
+
+class CatalogGenerationTests(SimpleTestCase):
+    """Writes bump the catalog generation, which workers poll and apply to their caches"""
+
+    def setUp(self):
+        self.meta = mock.MagicMock()
+        self.meta.find_one_and_update.side_effect = self.increment
+        self.stored = 0
+        patches = [
+            mock.patch.object(generation, "catalog_meta_collection", return_value=self.meta),
+            mock.patch.object(generation, "_generation", 0),
+            mock.patch.object(generation, "_checked_at", None),
+            mock.patch("apps.search.cache.meal_options_cache.set_generation"),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def increment(self, *args, **kwargs):
+        self.stored += 1
+        return {"generation": self.stored}
+
+    def test_bump_records_new_generation(self):
+        self.assertEqual(generation.bump_catalog_generation(), 1)
+        self.assertEqual(generation.bump_catalog_generation(), 2)
+        self.assertEqual(self.meta.find_one_and_update.call_count, 2)
+        self.assertEqual(generation._generation, 2)
+
+    def test_polls_at_most_once_per_interval(self):
+        self.meta.find_one.return_value = {"generation": 4}
+        with self.settings(SEARCH_CATALOG_POLL_SECONDS=60):
+            self.assertEqual(generation.current_generation(), 4)
+            self.meta.find_one.return_value = {"generation": 5}
+            self.assertEqual(generation.current_generation(), 4)
+        self.assertEqual(self.meta.find_one.call_count, 1)
+        from .cache import meal_options_cache
+        meal_options_cache.set_generation.assert_called_once_with(4)
+
+
+class MealOptionsPaginationTests(SimpleTestCase):
+    """Paging through meal options returns every meal once, in engine order"""
+
+    def setUp(self):
+        catalog = FoodCatalog(make_food_items())
+        self.meals = list(generate_meals(catalog, 800, 100, 30))
+        self.generation = 3
+        patches = [
+            mock.patch.object(views, "check_meal_options", return_value=self.meals),
+            mock.patch.object(views, "current_generation", side_effect=lambda: self.generation),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def get(self, **params):
+        request = RequestFactory().get("/api/search/meal-options/", {"calories": 800, **params})
+        return json.loads(views.meal_options_view(request).content)
+
+    def test_pages_cover_every_meal(self):
+        pages, cursor = [], None
+        while True:
+            body = self.get(limit=7, **({"cursor": cursor} if cursor else {}))
+            self.assertEqual(body["count"], len(self.meals))
+            pages.extend(body["valid_meals"])
+            cursor = body["next_cursor"]
+            if cursor is None:
+                break
+        self.assertEqual(pages, self.meals)
+
+    def test_without_limit_returns_everything(self):
+        self.assertEqual(self.get()["valid_meals"], self.meals)
+
+    def test_cursor_is_bound_to_search_and_catalog(self):
+        cursor = self.get(limit=5)["next_cursor"]
+        self.assertIn("error", self.get(cursor=cursor, calories=900))
+        self.generation += 1
+        self.assertIn("expired", self.get(cursor=cursor)["error"])
+        self.assertIn("error", self.get(cursor="not-a-cursor"))
+
+
+class StreamingResponseTests(SimpleTestCase):
+    """Streamed meal options parse back to the same meals as the buffered response"""
+
+    def setUp(self):
+        catalog = FoodCatalog(make_food_items())
+        self.meals = list(generate_meals(catalog, 800, 100, 30))
+        patch = mock.patch.object(views, "iter_meal_options", side_effect=lambda *args: iter(self.meals))
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def stream(self, stream_format):
+        request = RequestFactory().get("/api/search/meal-options/", {"stream": stream_format})
+        with self.settings(SEARCH_STREAM_CHUNK_MEALS=7):
+            response = views.meal_options_view(request)
+            return response, b"".join(response.streaming_content).decode()
+
+    def test_ndjson(self):
+        response, body = self.stream("ndjson")
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        self.assertEqual([json.loads(line) for line in body.splitlines()], self.meals)
+
+    def test_json_array(self):
+        _, body = self.stream("json")
+        self.assertEqual(json.loads(body), {"valid_meals": self.meals, "count": len(self.meals)})
+        self.meals = []
+        self.assertEqual(json.loads(self.stream("json")[1]), {"valid_meals": [], "count": 0})
+
+    def test_unknown_format(self):
+        response = views.meal_options_view(RequestFactory().get("/api/search/meal-options/", {"stream": "xml"}))
+        self.assertEqual(response.status_code, 400)
+
+
+class StreamedSearchCacheTests(SimpleTestCase):
+    """Streamed and per-restaurant searches missing from memory are read from the database cache"""
+
+    def setUp(self):
+        self.catalog = FoodCatalog(make_food_items())
+        self.meals = list(generate_meals(self.catalog, 800, 100, 30))
+        limits = (800, 100, 30)
+        document = cache_document(
+            script.get_cache_key(800, 50, 100, 30), self.meals, partition_fingerprints(self.catalog, *limits), limits
+        )
+        self.search_cache = mock.MagicMock()
+        self.search_cache.find_one.return_value = document
+        patches = [
+            mock.patch.object(script, "meal_options_cache", MealOptionsCache(2 ** 30, 100)),
+            mock.patch.object(script, "current_generation", return_value=0),
+            mock.patch.object(script, "load_catalog", return_value=self.catalog),
+            mock.patch.object(script, "search_cache_collection", return_value=self.search_cache),
+            mock.patch.object(script, "generate_meals", side_effect=AssertionError("enumerated a cached search")),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_database_hit_is_not_enumerated(self):
+        self.assertEqual(list(script.iter_meal_options(800, 50, 100, 30)), self.meals)
+        self.search_cache.find_one.assert_called_once_with({"key": script.get_cache_key(800, 50, 100, 30)})
+        # Kept in memory for the next request
+        self.assertEqual(list(script.iter_meal_options(800, 50, 100, 30)), self.meals)
+        self.assertEqual(self.search_cache.find_one.call_count, 1)
+
+        by_restaurant = get_top_ranked_meals_by_restaurant(800, 50, 100, 30)
+        self.assertEqual(set(by_restaurant), {meal["restaurant"] for meal in self.meals})
+
+
+class FastJsonRenderingTests(SimpleTestCase):
+    """orjson and the standard library write the same bytes as the stock renderers, and search views as JsonResponse"""
+
+    def setUp(self):
+        self.payload = {
+            "user": "Zo\u00eb \u2028 \u2029 \u00d8",
+            "created_at": datetime.datetime(2024, 5, 1, 12, 30, 15, 123456, tzinfo=datetime.timezone.utc),
+            "day": datetime.date(2024, 5, 1),
+            "price": decimal.Decimal("4.50"),
+            "token": uuid.UUID("12345678-1234-5678-1234-567812345678"),
+            "macros": [{"calories": 512.5, "fats": 0.1, "count": 3, "ok": True, "note": None}],
+            1: "non-string key",
+        }
+
+    def render(self, renderer, data):
+        return renderer.render(data, "application/json", {"indent": None})
+
+    def test_drf_renderer_matches_stock_renderer(self):
+        expected = self.render(JSONRenderer(), self.payload)
+        self.assertEqual(self.render(FastJSONRenderer(), self.payload), expected)
+        with mock.patch.object(renderers, "orjson", None):
+            self.assertEqual(self.render(FastJSONRenderer(), self.payload), expected)
+
+    def test_indented_output_uses_stock_renderer(self):
+        context = {"indent": 2}
+        self.assertEqual(
+            FastJSONRenderer().render(self.payload, "application/json", context),
+            JSONRenderer().render(self.payload, "application/json", context),
+        )
+
+    def test_object_ids_and_wide_integers(self):
+        oid = ObjectId()
+        self.assertEqual(json.loads(renderers.dumps({"id": oid})), {"id": str(oid)})
+        self.assertEqual(renderers.dumps({"n": 2 ** 70}), b'{"n":%d}' % 2 ** 70)
+
+    def test_exponent_floats(self):
+        data = {"big": 1e16, "small": 1e-7, "plain": 0.1}
+        with mock.patch.object(renderers, "orjson", None):
+            stdlib = renderers.dumps(data)
+        self.assertEqual(stdlib, b'{"big":1e+16,"small":1e-07,"plain":0.1}')
+        if renderers.orjson is not None:
+            # orjson spells exponents differently, for the same values
+            self.assertEqual(renderers.dumps(data), b'{"big":1e16,"small":1e-7,"plain":0.1}')
+        self.assertEqual(json.loads(renderers.dumps(data)), json.loads(stdlib))
+
+    def test_non_finite_floats(self):
+        data = {"meals": [{"calorie_density": float("inf"), "fats": float("nan")}], "note": None}
+        expected = b'{"meals":[{"calorie_density":Infinity,"fats":NaN}],"note":null}'
+        self.assertEqual(renderers.dumps(data), expected)
+        with self.assertRaises(ValueError):
+            renderers.dumps(data, allow_nan=False)
+        self.assertEqual(renderers.dumps({"note": None}, allow_nan=False), b'{"note":null}')
+
+        # STRICT_JSON, on by default, rejects them as the stock renderer does
+        for renderer in (FastJSONRenderer(), JSONRenderer()):
+            with self.assertRaises(ValueError):
+                self.render(renderer, data)
+        lenient, stock = FastJSONRenderer(), JSONRenderer()
+        lenient.strict = stock.strict = False
+        self.assertEqual(self.render(lenient, data), self.render(stock, data))
+
+    def test_search_responses_keep_json_response_bytes(self):
+        items = make_food_items()
+        for item in items:
+            if item["restaurant"] == "Restaurant 0":
+                item["restaurant"] = "Tropical Smoothie Caf\u00e9"
+        meals = list(generate_meals(FoodCatalog(items), 800, 100, 30))
+        meals[0] = {**meals[0], "calories": 1e16}
+
+        request = RequestFactory().get("/api/search/meal-options/")
+        with mock.patch.object(views, "check_meal_options", return_value=meals):
+            content = views.meal_options_view(request).content
+        self.assertEqual(content, JsonResponse({"count": len(meals), "valid_meals": meals}).content)
+        self.assertIn(b'"restaurant": "Tropical Smoothie Caf\\u00e9"', content)
+        self.assertIn(b'"calories": 1e+16', content)
+
+        with mock.patch.object(views, "iter_meal_options", side_effect=lambda *args: iter(meals)):
+            request = RequestFactory().get("/api/search/meal-options/", {"stream": "json"})
+            with self.settings(SEARCH_STREAM_CHUNK_MEALS=7):
+                streamed = b"".join(views.meal_options_view(request).streaming_content)
+        self.assertEqual(streamed, JsonResponse({"valid_meals": meals, "count": len(meals)}).content)
+
+
+class AsyncSearchTests(SimpleTestCase):
+    """The async views wait on MongoDB through Motor and answer like the sync views"""
+
+    def setUp(self):
+        self.items = make_food_items()
+        self.catalog = FoodCatalog.from_documents(self.items)
+        self.food_items = mock.MagicMock()
+        self.food_items.find.return_value.to_list = mock.AsyncMock(return_value=self.items)
+        self.search_cache = mock.MagicMock()
+        self.search_cache.find_one = mock.AsyncMock(return_value=None)
+        self.search_cache.replace_one = mock.AsyncMock()
+        self.meals = mock.MagicMock()
+        self.meals.insert_one = mock.AsyncMock(return_value=mock.Mock(inserted_id=ObjectId()))
+        patches = [
+            mock.patch.object(script, "meal_options_cache", MealOptionsCache(2 ** 30, 100)),
+            mock.patch.object(catalog_module, "_catalog", None),
+            mock.patch.object(generation, "current_generation", return_value=0),
+            mock.patch.object(async_search, "async_current_generation", mock.AsyncMock(return_value=0)),
+            mock.patch.object(async_search, "async_food_items_collection", return_value=self.food_items),
+            mock.patch.object(async_search, "async_search_cache_collection", return_value=self.search_cache),
+            mock.patch.object(async_search, "async_meals_collection", return_value=self.meals),
+            mock.patch.object(async_search, "async_ensure_cache_indexes", mock.AsyncMock()),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_matches_engine_and_caches(self):
+        expected = list(generate_meals(self.catalog, 800, 100, 30))
+        self.assertEqual(asyncio.run(async_search.async_check_meal_options(800, 50, 100, 30)), expected)
+        self.assertEqual(asyncio.run(async_search.async_check_meal_options(800, 50, 100, 30)), expected)
+        self.assertEqual(self.food_items.find.call_count, 1)
+        self.assertEqual(self.search_cache.find_one.await_count, 1)
+        self.assertEqual(self.search_cache.replace_one.await_count, 1)
+
+    def test_concurrent_searches_share_one_catalog_load(self):
+        async def search_all():
+            return await asyncio.gather(*(
+                async_search.async_check_meal_options(calories, 50, 100, 30) for calories in (600, 700, 800)
+            ))
+
+        results = asyncio.run(search_all())
+        self.assertEqual(results[1], list(generate_meals(self.catalog, 700, 100, 30)))
+        self.assertEqual(self.food_items.find.call_count, 1)
+
+    def test_views(self):
+        request = RequestFactory().get("/api/search/meal-options/", {"calories": 800})
+        response = asyncio.run(async_views.meal_options_view(request))
+        meals = list(generate_meals(self.catalog, 800, 100, 30))
+        self.assertEqual(response.content, JsonResponse({"count": len(meals), "valid_meals": meals}).content)
+
+        request = RequestFactory().post("/api/search/meal-options/")
+        self.assertEqual(asyncio.run(async_views.meal_options_view(request)).status_code, 405)
+
+        request = RequestFactory().get("/api/search/meal-options/", {"calories": 700, "stream": "ndjson"})
+        self.assertEqual(asyncio.run(async_views.meal_options_view(request)).status_code, 400)
+        self.assertEqual(self.food_items.find.call_count, 1)
+
+        meal = {"restaurant": "Restaurant 0", "food_item_ids": [], "calories": 0, "protein": 0, "carbs": 0, "fats": 0}
+        request = RequestFactory().post("/api/search/save-meal/", json.dumps(meal), content_type="application/json")
+        response = asyncio.run(async_views.save_meal_view(request))
+        self.assertEqual(json.loads(response.content)["message"], "Meal saved successfully.")
+        self.meals.insert_one.assert_awaited_once_with(meal)
+
+    def test_threaded_collection_without_motor(self):
+        collection = mock.MagicMock(full_name="MODdb.meals_fooditem")
+        collection.find_one.return_value = self.items[0]
+        collection.find.return_value = iter(self.items)
+        threaded = async_db.ThreadedCollection(collection)
+
+        self.assertEqual(asyncio.run(threaded.find_one({"_id": 0})), self.items[0])
+        collection.find_one.assert_called_once_with({"_id": 0})
+        self.assertEqual(asyncio.run(threaded.find({}, CATALOG_PROJECTION).to_list(None)), self.items)
+        collection.find.assert_called_once_with({}, CATALOG_PROJECTION)
+        self.assertEqual(threaded.full_name, "MODdb.meals_fooditem")
+
+
+class SingleFlightTests(SimpleTestCase):
+    """Concurrent searches for the same key run once, in a process and across processes"""
+
+    def test_threads_share_one_call(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def compute(value):
+            calls.append(value)
+            release.wait(5)
+            return [value]
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(flight.do("key", compute, 1))) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        while flight.coalesced < 3:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(calls, [1])
+        self.assertEqual(results, [[1]] * 4)
+        self.assertTrue(all(result is results[0] for result in results))
+        self.assertEqual(flight.do("key", compute, 2), [2])
+
+    def test_errors_reach_every_caller(self):
+        flight = AsyncSingleFlight()
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            raise ValueError("no catalog")
+
+        async def search_all():
+            return await asyncio.gather(*(flight.do("key", compute) for _ in range(3)), return_exceptions=True)
+
+        results = asyncio.run(search_all())
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+
+    def test_distributed_lock_waits_for_other_process(self):
+        collection = mock.MagicMock(full_name="MODdb.search_locks")
+        collection.update_one.side_effect = [DuplicateKeyError("held"), None]
+        collection.find_one.side_effect = [{"_id": "key"}, None]
+        with mock.patch.object(singleflight, "search_locks_collection", return_value=collection):
+            with self.settings(SEARCH_DISTRIBUTED_LOCKS=True, SEARCH_LOCK_POLL_SECONDS=0):
+                with singleflight.distributed_search_lock("key") as waited:
+                    self.assertTrue(waited)
+            with singleflight.distributed_search_lock("other") as waited:
+                self.assertFalse(waited)
+        self.assertEqual(collection.update_one.call_count, 2)
+        owner = collection.update_one.call_args.args[1]["$set"]["owner"]
+        collection.delete_one.assert_called_once_with({"_id": "key", "owner": owner})
+
+
+class EnsureIndexesTests(SimpleTestCase):
+    """ensure_indexes creates only the missing indexes and fails on query plans that scan a collection"""
+
+    def test_plan_stages(self):
+        plan = {
+            "stage": "SHARD_MERGE",
+            "shards": [
+                {"winningPlan": {"stage": "FETCH", "inputStage": {"stage": "IXSCAN"}}},
+                {"winningPlan": {"queryPlan": {"stage": "OR", "inputStages": [{"stage": "COLLSCAN"}]}}},
+            ],
+        }
+        self.assertEqual(sorted(indexes.plan_stages(plan)), ["COLLSCAN", "FETCH", "IXSCAN", "OR", "SHARD_MERGE"])
+
+    def test_existing_keys_are_not_created_again(self):
+        collection = mock.MagicMock()
+        collection.index_information.return_value = {
+            "_id_": {"key": [("_id", 1)]},
+            "search_cache_key_uniq": {"key": [("key", 1)], "unique": True},
+        }
+        missing = indexes.ensure_collection_indexes(collection, indexes.REQUIRED_INDEXES[db.SEARCH_CACHE_COLLECTION])
+        self.assertEqual([index.keys for index in missing], [[("expires_at", 1)]])
+        collection.create_index.assert_called_once_with([("expires_at", 1)], expireAfterSeconds=0)
+
+    def test_command_fails_on_collscan(self):
+        database = mock.MagicMock()
+        database.__getitem__.return_value.index_information.return_value = {}
+        database.__getitem__.return_value.find.return_value.explain.return_value = {
+            "queryPlanner": {"winningPlan": {"stage": "FETCH", "inputStage": {"stage": "IXSCAN"}}}
+        }
+        with mock.patch.object(ensure_indexes, "get_database", return_value=database):
+            call_command("ensure_indexes", stdout=io.StringIO())
+            with self.assertRaises(CommandError):
+                call_command("ensure_indexes", "--check", "--skip-explain", stdout=io.StringIO())
+
+            database.__getitem__.return_value.find.return_value.explain.return_value = {
+                "queryPlanner": {"winningPlan": {"stage": "COLLSCAN"}}
+            }
+            with self.assertRaises(CommandError):
+                call_command("ensure_indexes", stdout=io.StringIO())
+
+
+class StoredDerivedFieldsTests(SimpleTestCase):
+    """A catalog reading the derived fields stored by the importer generates the same meals as one computing them"""
+
+    def with_derived_fields(self, items):
+        by_restaurant = {}
+        for item in sorted(items, key=lambda item: item["_id"]):
+            by_restaurant.setdefault(item["restaurant"], []).append(dict(item, **catalog_module.derived_fields(item)))
+        documents = []
+        for restaurant_items in by_restaurant.values():
+            for item, ordinal in zip(restaurant_items, catalog_module.menu_ordinals(restaurant_items)):
+                item["menu_ordinal"] = ordinal
+                documents.append(item)
+        return documents
+
+    def test_same_meals(self):
+        items = make_food_items(6, 30)
+        computed = FoodCatalog.from_documents(items)
+        stored = FoodCatalog.from_documents(self.with_derived_fields(items))
+
+        # Ordinals read from the documents rank items within their restaurant only
+        self.assertLess(stored.menu_ordinals.max(), 30)
+        self.assertEqual(stored.roles.tolist(), computed.roles.tolist())
+        self.assertEqual(stored.calorie_density.tolist(), computed.calorie_density.tolist())
+        for limits in ((800, 100, 30), (1500, 200, 80), (400, 40, 15)):
+            self.assertEqual(list(generate_meals(stored, *limits)), list(generate_meals(computed, *limits)))
+        for restaurant in computed.restaurants:
+            self.assertEqual(
+                [column.tolist() for column in stored.restaurant_menu(restaurant)[1:]],
+                [column.tolist() for column in computed.restaurant_menu(restaurant)[1:]],
+            )
+
+    def test_partly_derived_documents_are_recomputed(self):
+        documents = self.with_derived_fields(make_food_items(2, 10))
+        documents[3]["menu_ordinal"] = None
+        documents[5]["menu_ordinal"] = -100
+        catalog = FoodCatalog.from_documents(documents)
+        expected = FoodCatalog.from_documents(make_food_items(2, 10))
+        self.assertEqual(catalog.menu_ordinals.tolist(), expected.menu_ordinals.tolist())
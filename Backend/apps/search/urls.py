@@ -5,4 +5,5 @@ urlpatterns = [
     path('options/', views.meal_options_view, name='meal_options'),
     path('ranked/', views.ranked_meal_options_view, name='ranked_meal_options'),
     path('save/', views.save_meal_view, name='save_meal'),
+    path('cache/', views.cache_stats_view, name='cache_stats'),
 ]
\ No newline at end of file
@@ -1,14 +1,28 @@
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
 from django.http import JsonResponse
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
 import json
-from .script import check_meal_options, save_meal_to_db
+from .cache import meal_options_cache
+from .generation import current_generation
+from .pagination import paginate
+from .script import check_meal_options, iter_meal_options, save_meal_to_db
+from .singleflight import async_meal_searches, meal_searches
+from .streaming import streaming_meals_response
 from .rank_meals import rank_meal_options, get_top_ranked_meals, get_top_ranked_meals_by_restaurant
 
+# Fields a saved meal must have
+REQUIRED_MEAL_FIELDS = ["restaurant", "food_item_ids", "calories", "protein", "carbs", "fats"]
+
 @require_http_methods(["GET"])
 def meal_options_view(request):
     """
     View function to get meal options based on specified macronutrient limits
+
+    Pass `limit` (and then the returned `next_cursor` as `cursor`) to page through
+    the meals; without either parameter every meal is returned at once. Pass
+    `stream=ndjson` or `stream=json` to stream every meal as it is produced.
     """
     try:
         # Get user-defined macronutrient constraints from query parameters
@@ -17,9 +31,33 @@ def meal_options_view(request):
         carb_limit = int(request.GET.get("carbs", 100))
         fat_limit = int(request.GET.get("fats", 30))
 
+        stream_format = request.GET.get("stream")
+        if stream_format:
+            # Serialize meals as the cache or the engine yields them, without building the full list
+            return streaming_meals_response(
+                iter_meal_options(calorie_limit, protein_limit, carb_limit, fat_limit), stream_format
+            )
+
         # Call the function from script.py to generate valid meal options
         valid_meals = check_meal_options(calorie_limit, protein_limit, carb_limit, fat_limit)
 
+        limit = request.GET.get("limit")
+        cursor = request.GET.get("cursor")
+        if limit is not None or cursor is not None:
+            # Later pages are sliced from the cached result of the same search
+            page, next_cursor = paginate(
+                valid_meals,
+                limit or getattr(settings, "SEARCH_PAGE_SIZE", 100),
+                cursor,
+                (calorie_limit, protein_limit, carb_limit, fat_limit),
+                current_generation(),
+            )
+            return JsonResponse({
+                "count": len(valid_meals),
+                "valid_meals": page,
+                "next_cursor": next_cursor
+            })
+
         return JsonResponse({
             "count": len(valid_meals),
             "valid_meals": valid_meals
@@ -29,6 +67,16 @@ def meal_options_view(request):
             "error": str(e)
         }, status=400)
 
+def format_ranked_meal(meal):
+    """Response entry of a ranked meal"""
+    return {
+        "rank": meal["rank"],
+        "rmse": meal["rmse"],
+        "avg_utilization": meal["avg_utilization"],
+        "utilization": meal["utilization"],
+        "meal": meal["meal"]
+    }
+
 @require_http_methods(["GET"])
 def ranked_meal_options_view(request):
     """
@@ -59,14 +107,7 @@ def ranked_meal_options_view(request):
             
             for restaurant, meals in top_meals.items():
                 formatted_result["restaurants"][restaurant] = [
-                    {
-                        "rank": meal["rank"],
-                        "rmse": meal["rmse"],
-                        "avg_utilization": meal["avg_utilization"],
-                        "utilization": meal["utilization"],
-                        "meal": meal["meal"]
-                    }
-                    for meal in meals
+                    format_ranked_meal(meal) for meal in meals
                 ]
             
             return JsonResponse(formatted_result)
@@ -80,14 +121,7 @@ def ranked_meal_options_view(request):
             formatted_result = {
                 "count": len(top_meals),
                 "ranked_meals": [
-                    {
-                        "rank": meal["rank"],
-                        "rmse": meal["rmse"],
-                        "avg_utilization": meal["avg_utilization"],
-                        "utilization": meal["utilization"],
-                        "meal": meal["meal"]
-                    }
-                    for meal in top_meals
+                    format_ranked_meal(meal) for meal in top_meals
                 ]
             }
             
@@ -98,6 +132,19 @@ def ranked_meal_options_view(request):
             "error": str(e)
         }, status=400)
 
+@staff_member_required
+@require_http_methods(["GET"])
+def cache_stats_view(request):
+    """
+    View function to inspect the in-memory meal options cache of this worker.
+    Staff only: the entries reveal the searches users ran.
+    """
+    response = meal_options_cache.stats()
+    response["coalesced_searches"] = meal_searches.coalesced + async_meal_searches.coalesced
+    if request.GET.get("entries", "false").lower() == "true":
+        response["entries"] = meal_options_cache.entries()
+    return JsonResponse(response)
+
 @csrf_exempt
 @require_http_methods(["POST"])
 def save_meal_view(request):
@@ -109,8 +156,7 @@ def save_meal_view(request):
         data = json.loads(request.body)
         
         # Validate input
-        required_fields = ["restaurant", "food_item_ids", "calories", "protein", "carbs", "fats"]
-        for field in required_fields:
+        for field in REQUIRED_MEAL_FIELDS:
             if field not in data:
                 return JsonResponse({
                     "error": f"Missing required field: {field}"
@@ -0,0 +1,123 @@
+import json
+import logging
+import math
+
+from bson import ObjectId
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils import encoders
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+"""
+Fast JSON rendering for the API.
+
+Responses are serialized with orjson when it is installed and with the
+standard library otherwise. Both paths write compact separators, UTF-8
+instead of \\u escapes, U+2028 and U+2029 escaped, and dates, decimals and
+ObjectIds through the usual encoder defaults (orjson is told to pass datetimes
+through to them, as its own format differs). The bytes are the same except for
+floats written with an exponent: orjson writes 1e16 and 1e-7 where the standard
+library writes 1e+16 and 1e-07, which parse to the same values.
+
+The search views keep answering with JsonResponse instead: their payloads
+are written in its spaced, ASCII-escaped layout, which orjson cannot produce.
+
+Data orjson cannot serialize (e.g. integers wider than 64 bits) falls back to
+the standard library, and so does data holding NaN or infinities, which orjson
+would write as null: the standard library writes them as NaN and Infinity, or
+raises ValueError when allow_nan is False.
+"""
+
+SHORT_SEPARATORS = (",", ":")
+ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS if orjson else 0
+
+
+class JSONEncoder(DjangoJSONEncoder):
+    """DjangoJSONEncoder that also writes MongoDB ObjectIds as strings."""
+
+    def default(self, o):
+        if isinstance(o, ObjectId):
+            return str(o)
+        return super().default(o)
+
+
+class APIJSONEncoder(encoders.JSONEncoder):
+    """The REST framework encoder, also writing MongoDB ObjectIds as strings."""
+
+    def default(self, obj):
+        if isinstance(obj, ObjectId):
+            return str(obj)
+        return super().default(obj)
+
+
+def _escape_line_terminators(content):
+    # U+2028 and U+2029 are valid in JSON but not in JavaScript string literals
+    return content.replace(b"\xe2\x80\xa8", b"\\u2028").replace(b"\xe2\x80\xa9", b"\\u2029")
+
+
+def _has_non_finite(value):
+    """Whether a float anywhere in a value of dicts, lists and tuples is NaN or infinite."""
+    pending = [value]
+    while pending:
+        value = pending.pop()
+        if isinstance(value, float):
+            if not math.isfinite(value):
+                return True
+        elif isinstance(value, dict):
+            pending.extend(value.values())
+        elif isinstance(value, (list, tuple)):
+            pending.extend(value)
+    return False
+
+
+def dumps(data, encoder_class=JSONEncoder, allow_nan=True):
+    """
+    Serialize data to compact UTF-8 JSON.
+
+    Args:
+        data: Any JSON serializable value
+        encoder_class (type): json.JSONEncoder subclass whose default() handles
+            the types JSON has no representation for
+        allow_nan (bool): Write NaN and infinities as NaN and Infinity; when False they raise ValueError
+
+    Returns:
+        bytes: The serialized data
+    """
+    if orjson is not None:
+        try:
+            content = orjson.dumps(data, default=encoder_class().default, option=ORJSON_OPTIONS)
+        except orjson.JSONEncodeError as e:
+            logger.debug(f"orjson could not serialize the response, falling back to json: {e}")
+        else:
+            # orjson writes non-finite floats as null; only then is the data walked to look for them
+            if b"null" not in content or not _has_non_finite(data):
+                return _escape_line_terminators(content)
+
+    content = json.dumps(data, cls=encoder_class, ensure_ascii=False, separators=SHORT_SEPARATORS,
+                         allow_nan=allow_nan)
+    return _escape_line_terminators(content.encode())
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    REST framework JSONRenderer serializing with orjson.
+
+    Requests for indented output, and projects configured for ASCII or
+    spaced JSON, go through the stock renderer, as orjson cannot write them.
+    """
+
+    encoder_class = APIJSONEncoder
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        renderer_context = renderer_context or {}
+        if self.get_indent(accepted_media_type, renderer_context) is not None or self.ensure_ascii or not self.compact:
+            return super().render(data, accepted_media_type, renderer_context)
+        return dumps(data, self.encoder_class, allow_nan=not self.strict)
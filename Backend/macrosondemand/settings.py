@@ -95,6 +95,14 @@ DATABASES = {
     }
 }
 
+# Shared pymongo client used by the search app (apps/search/db.py), one per worker process
+MONGODB_MAX_POOL_SIZE = 50
+MONGODB_MIN_POOL_SIZE = 0
+MONGODB_MAX_IDLE_TIME_MS = 300000
+MONGODB_SERVER_SELECTION_TIMEOUT_MS = 5000
+MONGODB_CONNECT_TIMEOUT_MS = 5000
+MONGODB_SOCKET_TIMEOUT_MS = 30000
+
 
 
 # Password validation
@@ -160,6 +168,10 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'apps.accounts.authentication.CustomJWTAuthentication',
     ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'macrosondemand.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
 }
 
 
@@ -193,3 +205,60 @@ CORS_ALLOW_HEADERS = [
     'x-csrftoken',
     'x-requested-with',
 ]
+
+# Meal search engine
+# Serve searches from an in-memory catalog of food items instead of scanning meals_fooditem each time
+SEARCH_USE_CATALOG = True
+# Combination engine used for uncached searches: "numpy" (vectorized), "sorted" (binary-search join
+# against per-restaurant side/dessert tables) or "python" (nested loops)
+SEARCH_ENGINE = "numpy"
+# Largest side/dessert table the "sorted" engine keeps per restaurant before falling back to "numpy"
+SEARCH_TAIL_TABLE_MAX_ROWS = 500000
+# How /api/search/ranked-meals/ finds the top meals: "branch_and_bound" (prunes by an RMSE lower bound),
+# "index" (walks per-restaurant k-d trees of every meal) or "stream" (scores every meal, keeps the best in a heap)
+SEARCH_RANKED_MODE = "branch_and_bound"
+# Restaurants with more possible meals than this are not indexed and use branch and bound in "index" mode
+SEARCH_MEAL_INDEX_MAX_MEALS = 200000
+# Worker processes that enumerate restaurants in parallel for uncached searches (0 or 1 runs serially)
+SEARCH_PARALLEL_WORKERS = 0
+# In-memory meal options cache per worker: evicts least recently used lists past either limit,
+# and drops lists older than SEARCH_CACHE_TTL seconds
+SEARCH_CACHE_MAX_BYTES = 256 * 1024 * 1024
+SEARCH_CACHE_MAX_ENTRIES = 100
+SEARCH_CACHE_TTL = 3600
+# Cached lists older than SEARCH_CACHE_SOFT_TTL seconds are still served, while one of
+# SEARCH_CACHE_REFRESH_WORKERS background threads recomputes them (None turns background refreshes off)
+SEARCH_CACHE_SOFT_TTL = 3000
+SEARCH_CACHE_REFRESH_WORKERS = 1
+# Share one cached meal list between searches whose calorie, carb and fat limits round up to the same
+# multiple of these widths; each search filters the shared list down to its exact limits
+SEARCH_CACHE_BUCKETING = False
+SEARCH_CACHE_BUCKETS = {"calories": 50, "carbs": 10, "fats": 5}
+# Answer a search missing from the in-memory cache by filtering a cached list for looser calorie, carb
+# and fat limits, when one exists
+SEARCH_CACHE_SUPERSETS = True
+# Meal lists stored in the search_cache collection expire after this many seconds, and lists with more
+# meals than SEARCH_PERSISTENT_CACHE_MAX_MEALS are only cached in memory
+SEARCH_PERSISTENT_CACHE_TTL = 7 * 24 * 3600
+SEARCH_PERSISTENT_CACHE_MAX_MEALS = 500000
+# Seconds between checks of the food catalog generation; a newer generation reloads the catalog and
+# invalidates cached searches
+SEARCH_CATALOG_POLL_SECONDS = 5
+# Page size of /api/search/meal-options/ when only a cursor is given, and the largest page a client may request
+SEARCH_PAGE_SIZE = 100
+SEARCH_MAX_PAGE_SIZE = 500
+# Meals serialized per chunk when /api/search/meal-options/ streams its response (?stream=ndjson or json)
+SEARCH_STREAM_CHUNK_MEALS = 500
+# Route the search endpoints to the async views of apps/search/async_views.py; only enable when serving
+# macrosondemand.asgi with uvicorn workers. CPU-bound search steps run on SEARCH_ASYNC_EXECUTOR_WORKERS threads
+# The async meal options view answers ?stream= with a 400, as streaming needs the sync views
+SEARCH_ASYNC_VIEWS = False
+SEARCH_ASYNC_EXECUTOR_WORKERS = 4
+# Let one process generate the meals of a search cached nowhere while other processes running the same search
+# wait (for at most SEARCH_LOCK_WAIT_SECONDS) and read its search_cache entry; locks expire after SEARCH_LOCK_TTL seconds
+SEARCH_DISTRIBUTED_LOCKS = False
+SEARCH_LOCK_TTL = 120
+SEARCH_LOCK_WAIT_SECONDS = 60
+SEARCH_LOCK_POLL_SECONDS = 0.5
+# Food items written per insert_many batch by manage.py import_food_items
+FOOD_IMPORT_BATCH_SIZE = 1000
@@ -18,7 +18,12 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import include, path
 from django.shortcuts import redirect
-from apps.search.views import meal_options_view, save_meal_view, ranked_meal_options_view
+from django.conf import settings
+from apps.search.views import cache_stats_view, meal_options_view, save_meal_view, ranked_meal_options_view
+
+if getattr(settings, "SEARCH_ASYNC_VIEWS", False):
+    # Served over ASGI (uvicorn workers), the search endpoints wait on MongoDB without blocking a worker
+    from apps.search.async_views import meal_options_view, save_meal_view, ranked_meal_options_view
 
 def home_redirect(request):
     return redirect('/api/auth/signup/')  # Redirect to the sign-in page
@@ -30,4 +35,5 @@ urlpatterns = [
     path('api/search/meal-options/', meal_options_view, name='meal-options'),
     path('api/search/save-meal/', save_meal_view, name='save-meal'),
     path('api/search/ranked-meals/', ranked_meal_options_view, name='ranked-meals'),
+    path('api/search/cache/', cache_stats_view, name='search-cache'),
 ]
\ No newline at end of file